@@ -84,11 +84,14 @@ async function getResults(searchQuery: string, webview: vscode.WebviewView)
 {
     let u = vscode.Uri.joinPath(globalUri);
 			let params:string[] = [];
+			let locations:string[] = [];
       // create params for easier processing.
 			functionDefinitionMap.forEach((value: string, key: string) => 
 			{
 				params.push(key);
 				params.push(value[0]);
+				// the file each function is defined in, the server indexes descriptions per file.
+				locations.push(value[1]);
 			});
 
       // Get Search results, basically has text similarity implemented under the hood. 
@@ -98,6 +101,7 @@ async function getResults(searchQuery: string, webview: vscode.WebviewView)
 				u.path,
 				params,
 				searchQuery,
+				locations,
 			);
 
       let items = [];
@@ -4,8 +4,6 @@ import * as path from "path";
 import { toUSVString } from "util";
 import * as vscode from 'vscode';
 
-let startOfCurrentSet = -1;
-let mostRecentInCurrentSet= -1;
 let descriptionWriting = false;
 let num = 1;
 
@@ -168,56 +166,15 @@ export function activate(context: vscode.ExtensionContext): void {
 				}
 			}
 			
-			if (startOfCurrentSet === -1) {
-				startOfCurrentSet = currentChange;
-				mostRecentInCurrentSet = currentChange;
-			}
-			else 
-			{
-				// if the currentchange is made without breaking the set, i.e it is appended to the most recent change.
-				if (currentChange === mostRecentInCurrentSet || currentChange === mostRecentInCurrentSet + 1) {
-					// if we have reached the limit of 4 lines, generate the summary again
-					if (startOfCurrentSet + 4 <= currentChange) {
-						let content = '';
-						let sourceFile: vscode.TextDocument = event.document;
-						for (let i = startOfCurrentSet; i < currentChange; i++) {
-							try {
-								let endDes = sourceFile.lineAt(i);
-								content += endDes.text + '\n';
-							}
-							catch (e) {
-							}
-						}
-
-						console.log(content);
-						getFunctionBody(currentChange);
-						startOfCurrentSet = currentChange;
-					}
-					mostRecentInCurrentSet = currentChange;
-				}
-				else {
-					// if the current set is broken, i.e. the change is made somewhere else in the file..
-					let content = '';
-					let sourceFile: vscode.TextDocument = event.document;
-					for (let i = startOfCurrentSet; i <= mostRecentInCurrentSet; i++) {
-						try {
-							let endDes = sourceFile.lineAt(i);
-							content += endDes.text + '\n';
-						}
-						catch (e) {
-						}
-					}
-					startOfCurrentSet = currentChange;
-					// generate the summary for changes made so far, 
-					getFunctionBody(currentChange);
-					
-					// and re-initialize the set.
-					mostRecentInCurrentSet = currentChange;
-				}
-			}
+			// The language server parses every change and summarizes the functions whose body changed,
+			// see summaryReady below.
 		}
 	});
-		
+
+	// The summary of a function that changed is ready: write it above the function.
+	client.onReady().then(() => {
+		client.onNotification('ACS-python/summaryReady', summaryReady);
+	});
 
 	//This provides the hover.
 	vscode.languages.registerHoverProvider('python', {
@@ -225,6 +182,8 @@ export function activate(context: vscode.ExtensionContext): void {
 
 			const range = document.getWordRangeAtPosition(position); 		//fetch the range of the hovered word
 			const word = document.getText(range);							//fetch the word
+			// summarize the hovered function first, if its summary is still pending
+			vscode.commands.executeCommand('ACS-python.prioritizeSummaries', document.uri.toString(), [word]);
 			if( functionDefinitionMap.has(word) )							//if the word has a definition, then return it
 			{
 				return {
@@ -329,127 +288,30 @@ function insertDescriptionBox(lineNumber: number)
 	}
 }
 
-// Get the function body of the function enclosing the line: 'lineNumber'
-async function getFunctionBody(lineNumber: number)
+// Writes the summary sent by the language server for the function 'name' defined at 'line' of the document 'uri':
+// replace the description if one is present, add a new one if not.
+async function summaryReady(params: {uri: string, name: string, line: number, summary: string})
 {
-	let functionStartLine = -1;
-	let functionEndLine = -1;
-
-	let textEditor = vscode.window.activeTextEditor;
-	if( textEditor )
+	let textEditor = vscode.window.visibleTextEditors.find(editor => editor.document.uri.toString() === params.uri);
+	if (textEditor) 
 	{
-		let sourceFile = textEditor.document;
-		let ln = lineNumber;
-		
-		// Search for the keyword 'def by moving to the top.
-		while( ln !== 0 )
-		{
-			let line = '';
-			try{
-			line = sourceFile.lineAt(ln).text;
-			}
-			catch(e)
-			{}
-			var splitted = line.split(" ", 3);
-			if( splitted.length !== 0 )
-			{
-				if( splitted[0] === "def" )
-				{
-					functionStartLine = ln;
-					break;
-				}
-			}
-			ln -= 1;
-		}
-		try{
-			console.log(sourceFile.lineAt(functionStartLine).text);
-		}
-		catch(e)
-		{
-			return;
-		}
-
-		ln = lineNumber;
-		// search for the end of function, moving down and checking the indentation
-		while( true )
-		{
-			let line = '';
-			try{
-				line = sourceFile.lineAt(ln).text;
-			}
-			catch(e)
-			{
-				break;
-			}
-			if( line !== '' && line.substring(0, 4) !== "    " )
-			{
-				functionEndLine = ln-1;
-				break;
-			}
-			ln++;
-		}
-		if( functionEndLine === -1 )
-		{
-			functionEndLine = ln-1;
-		}
-
-		try{
-			console.log(sourceFile.lineAt(functionEndLine).text);
-		}
-		catch(e)
-		{
-			return;
-		}
-		
-		// if the current line isn't inside a function.. return
-		if( functionStartLine === -1 || functionEndLine === -1 )
+		let sourceFile: vscode.TextDocument = textEditor.document;
+		let position = new vscode.Position(params.line, 0);
+		let description = params.summary;
+		// the document may have changed since, check the function is still there
+		if (params.line >= sourceFile.lineCount || !sourceFile.lineAt(params.line).text.trim().match("^(async )?def " + params.name + "\\b"))
 		{
 			return;
 		}
-
-		let body = '';
-		// get the body by iterating over the range
-		for( let i = functionStartLine; i <= functionEndLine ; i++ )
-		{
-			try{
-				body += sourceFile.lineAt(i).text + "\n";
-			}
-			catch(e)
-			{
-				return;
-			}
-		}
-
-		let startPosition = new vscode.Position(functionStartLine, 0);
-		if( body !== '' )
-		{
-			// Edit the description
-			changeDescription(textEditor.document, startPosition, body);
-		}
-	}
-}
-
-// fetches the new description and modifies the old description - replace if a description is present, add a new one if not.
-async function changeDescription(sourceFile: vscode.TextDocument, position: vscode.Position, body: string) 
-{
-	let textEditor = vscode.window.activeTextEditor;
-
-	if (textEditor) 
-	{
-		// fetch the description for the function
-		let description: string = await vscode.commands.executeCommand(
-			'ACS-python.fetchSummary',
-			body,
-		);
 		let i = 1;
-		let endDes = sourceFile.lineAt(position.line - i);
+		let endDes = sourceFile.lineAt(Math.max(position.line - i, 0));
 
 		i++;
 		// if description already exists
-		if (endDes.text === "$\"\"\"") 
+		if (position.line > 0 && endDes.text === "$\"\"\"") 
 		{
 			let temp = sourceFile.lineAt(position.line - i);
-			while (position.line - i >= 0 && temp.text !== "\"\"\"$") 
+			while (position.line - i > 0 && temp.text !== "\"\"\"$") 
 			{
 				i++;
 				temp = sourceFile.lineAt(position.line - i);
@@ -0,0 +1,200 @@
+# Inference backends of the summarization model, and a tool that checks them
+# against eager fp32:
+#
+#     python backends.py --checkpoint pytorch_model.bin
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+
+BACKENDS = ("eager", "int8", "torchscript")
+
+
+def quantize(model):
+    """
+    Copy of `model` whose nn.Linear layers (encoder, decoder feed-forward,
+    `dense` and `lm_head`) are dynamically quantized to int8: weights are
+    stored as int8 and activations are quantized on the fly.
+    """
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export(model, source_length=32):
+    """
+    Trace `encode` and `decode_step` of `model` with TorchScript, and make
+    the model use the traced graphs from now on.
+    """
+    model.eval()
+    source_ids = torch.randint(
+        3, model.config.vocab_size, (1, source_length), dtype=torch.long
+    )
+    source_mask = torch.ones_like(source_ids)
+    with torch.no_grad():
+        state = model._init_cache(model.encode(source_ids, source_mask), source_mask)
+        input_ids = torch.full((model.beam_size, 1), model.sos_id, dtype=torch.long)
+        step = (
+            input_ids,
+            state["positions"],
+            state["self_keys"],
+            state["self_values"],
+            state["memory_keys"],
+            state["memory_values"],
+            state["memory_mask"],
+        )
+        # Trace with a non-empty cache, like every step but the first.
+        _, self_keys, self_values, positions = model.decode_step(*step)
+        step = (input_ids, positions, self_keys, self_values) + step[4:]
+        traced = torch.jit.trace_module(
+            model,
+            {"encode": (source_ids, source_mask), "decode_step": step},
+            check_trace=False,
+        )
+    model.exported = {"encode": traced.encode, "decode_step": traced.decode_step}
+    return model
+
+
+def prepare(model, backend):
+    "`model` set up to run with `backend`, one of BACKENDS."
+    if backend == "eager":
+        return model.eval()
+    if backend == "int8":
+        return quantize(model.eval())
+    if backend == "torchscript":
+        return export(model.eval())
+    raise ValueError(
+        "Unknown backend %r, expected one of %s" % (backend, ", ".join(BACKENDS))
+    )
+
+
+def compare(reference, candidate, source_ids, source_mask, repeat=3):
+    """
+    Run `reference` and `candidate` on the same batch.
+
+    Returns the largest absolute difference of their encoder outputs, the
+    fraction of examples whose best prediction is identical, and the best
+    latency (in seconds) of each over `repeat` runs.
+    """
+    latencies = []
+    outputs = []
+    with torch.no_grad():
+        for model in (reference, candidate):
+            encode = model.exported.get("encode", model.encode)
+            encoder_output = encode(source_ids, source_mask)
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                preds = model(source_ids=source_ids, source_mask=source_mask)
+                best = min(best, time.perf_counter() - start)
+            latencies.append(best)
+            outputs.append((encoder_output, preds[:, 0]))
+    (ref_encoder, ref_preds), (encoder_output, preds) = outputs
+    return {
+        "max_abs_diff": float((ref_encoder - encoder_output.float()).abs().max()),
+        "agreement": float((ref_preds == preds).all(1).float().mean()),
+        "eager_latency": latencies[0],
+        "latency": latencies[1],
+        "speedup": latencies[0] / latencies[1],
+    }
+
+
+def sample_sources(paths):
+    "Source code of every function defined in the python files `paths`."
+    if __package__:
+        from .workspace import functions
+    else:
+        from workspace import functions
+
+    sources = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        sources.extend(function.source for function in functions(text) or ())
+    return sources
+
+
+def main():
+    import glob
+    import os
+
+    from transformers import RobertaConfig, RobertaModel
+
+    from pipeline import DTYPES, build_model, get_features
+    from tokenization import CodeTokenizer
+    from utils import Example
+
+    parser = argparse.ArgumentParser(
+        description="Check every inference backend against eager fp32 and report the speedup."
+    )
+    parser.add_argument("--checkpoint", default="pytorch_model.bin")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS[1:])
+    parser.add_argument(
+        "--dtypes",
+        nargs="+",
+        choices=sorted(DTYPES),
+        default=[],
+        help="Also check eager with the weights kept in these dtypes",
+    )
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        default=sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))),
+        help="Python files whose functions are summarized",
+    )
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Largest allowed absolute difference of the encoder output",
+    )
+    parser.add_argument(
+        "--min-agreement",
+        type=float,
+        default=0.75,
+        help="Smallest allowed fraction of predictions identical to eager",
+    )
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    config = RobertaConfig.from_pretrained("microsoft/codebert-base")
+    tokenizer = CodeTokenizer("microsoft/codebert-base")
+    reference = build_model(RobertaModel, config, tokenizer, args.checkpoint)
+    examples = [
+        Example(source=source, target=None)
+        for source in sample_sources(args.sources)[: args.batch_size]
+    ]
+    source_ids, source_mask = get_features(examples, tokenizer).tensors
+
+    failed = False
+    candidates = [(backend, backend, None) for backend in args.backends]
+    candidates += [("eager", "eager-" + dtype, DTYPES[dtype]) for dtype in args.dtypes]
+    for backend, name, dtype in candidates:
+        candidate = copy.deepcopy(reference)
+        if dtype is not None:
+            candidate = candidate.to(dtype)
+        candidate = prepare(candidate, backend)
+        result = compare(reference, candidate, source_ids, source_mask)
+        ok = (
+            result["max_abs_diff"] <= args.tolerance
+            and result["agreement"] >= args.min_agreement
+        )
+        failed = failed or not ok
+        print(
+            "%-16s max_abs_diff=%.4f agreement=%.2f latency=%.3fs (eager %.3fs) speedup=%.2fx %s"
+            % (
+                name,
+                result["max_abs_diff"],
+                result["agreement"],
+                result["latency"],
+                result["eager_latency"],
+                result["speedup"],
+                "ok" if ok else "FAILED",
+            )
+        )
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+
+class MicroBatcher(object):
+    """
+    Groups concurrent requests into batches for the model.
+
+    Requests that arrive within `window` seconds of the first queued request
+    (up to `max_batch_size` of them) are handed to `run_batch` together, and
+    each caller gets back its own entry of the result.
+
+    Parameters:
+
+    * `run_batch`- coroutine function called with a list of items, returns
+      one result per item.
+    * `window`- how long (in seconds) to wait for more requests.
+    * `max_batch_size`- largest number of items passed to `run_batch`.
+    * `concurrency`- number of batches that may run at the same time.
+    * `metrics`- optional metrics.Metrics that receives the size of every
+      batch and the time each request waited in the queue.
+    """
+
+    def __init__(
+        self, run_batch, window=0.01, max_batch_size=16, concurrency=1, metrics=None
+    ):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.metrics = metrics
+        # Created on first use, so they belong to the server's event loop.
+        self.queue = None
+        self.slots = None
+        self.worker = None
+
+        # callers waiting for their result
+        self.waiting = 0
+        self.requests = 0
+        self.batches = 0
+        self.batched = 0
+        self.max_queue_depth = 0
+
+    async def submit(self, item):
+        "Queue `item` and wait for its result."
+        loop = asyncio.get_running_loop()
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self.queue.put_nowait((item, future, loop.time()))
+        self.requests += 1
+        self.waiting += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        try:
+            return await future
+        finally:
+            self.waiting -= 1
+
+    def idle(self):
+        "True when no caller is waiting for a result."
+        return self.waiting == 0
+
+    def close(self):
+        """
+        Stop collecting batches. Batches already running finish, the next
+        `submit` starts over.
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free slot before collecting the next batch, so that
+            # requests keep queueing (and batching) while all slots are busy.
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            loop.create_task(self._process(batch))
+
+    async def _process(self, batch):
+        try:
+            # Callers that went away don't need their result.
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                return
+            self.batches += 1
+            self.batched += len(batch)
+            if self.metrics is not None:
+                now = asyncio.get_running_loop().time()
+                for _, _, queued in batch:
+                    self.metrics.observe("acs_queue_wait_seconds", now - queued)
+                self.metrics.observe("acs_batch_size", len(batch))
+            try:
+                results = await self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        "Queue depth and batching counters."
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.batched / self.batches if self.batches else 0,
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+            "concurrency": self.concurrency,
+        }
+
+
+class Coalescer(object):
+    """
+    Shares one run between concurrent requests for the same key, and
+    cancels the run once every caller waiting for it went away.
+
+    `start(cancel)` starts the run, `cancel` is a `threading.Event` that is
+    set when nobody wants the result anymore, e.g. to stop a beam search
+    running on a worker thread between two decode steps.
+    """
+
+    def __init__(self):
+        # key -> [task, cancel, number of callers waiting]
+        self.running = {}
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def run(self, key, start):
+        "Result of the run for `key`, starting it unless one is in flight."
+        entry = self.running.get(key)
+        if entry is None:
+            cancel = threading.Event()
+            entry = [asyncio.ensure_future(start(cancel)), cancel, 0]
+            self.running[key] = entry
+            entry[0].add_done_callback(lambda _: self._finished(key, entry))
+        else:
+            self.coalesced += 1
+        entry[2] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[2] -= 1
+            if entry[2] == 0 and not entry[0].done():
+                # New requests for `key` start a fresh run.
+                self._finished(key, entry)
+                entry[1].set()
+                entry[0].cancel()
+                self.cancelled += 1
+
+    def _finished(self, key, entry):
+        if self.running.get(key) is entry:
+            del self.running[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self.running),
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
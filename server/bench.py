@@ -0,0 +1,374 @@
+# Offline benchmarks of the summarization and search hot paths. Everything
+# runs on a small randomly initialized model and a synthetic word vector
+# table, so nothing is downloaded:
+#
+#     python bench.py --out bench.json
+#     python bench.py --quick --compare bench.json
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# name -> grid of parameters, and the smaller grid used with --quick
+GRIDS = {
+    "forward": (
+        {"beam_size": [1, 4, 10], "source_length": [32, 128], "batch_size": [1, 8]},
+        {"beam_size": [1, 4], "source_length": [32], "batch_size": [1, 4]},
+    ),
+    "beam": (
+        {"beam_size": [1, 4, 10]},
+        {"beam_size": [1, 10]},
+    ),
+    "features": (
+        {"source_length": [32, 256], "batch_size": [1, 16, 64]},
+        {"source_length": [32], "batch_size": [1, 16]},
+    ),
+    "get_vector": (
+        {"corpus_size": [10000, 100000], "words": [2, 8]},
+        {"corpus_size": [10000], "words": [2, 8]},
+    ),
+    "search": (
+        {"corpus_size": [100, 1000, 10000, 100000], "mode": ["dense", "hybrid"]},
+        {"corpus_size": [100, 1000], "mode": ["dense", "hybrid"]},
+    ),
+}
+
+WORDS = ["".join(w) for w in itertools.product("abcdefghij", repeat=5)]
+
+
+class SyntheticTokenizer(object):
+    "Whitespace tokenizer with the special tokens of RoBERTa, ids by hash."
+
+    cls_token = "<s>"
+    sep_token = "</s>"
+    cls_token_id = 0
+    pad_token_id = 1
+    sep_token_id = 2
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+
+    def tokenize(self, text):
+        return text.split()
+
+    def convert_tokens_to_ids(self, tokens):
+        special = {self.cls_token: 0, self.sep_token: 2}
+        return [
+            special.get(token, 3 + zlib.crc32(token.encode()) % (self.vocab_size - 3))
+            for token in tokens
+        ]
+
+    def batch_decode(self, sequences, **kwargs):
+        return [" ".join(str(i) for i in sequence) for sequence in sequences]
+
+
+def tiny_model(beam_size, max_length, vocab_size=1000, seed=0):
+    "Randomly initialized Seq2Seq with a small encoder and decoder."
+    from transformers import RobertaConfig, RobertaModel
+
+    from model import Seq2Seq
+
+    torch.manual_seed(seed)
+    config = RobertaConfig(
+        vocab_size=vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=128,
+        max_position_embeddings=514,
+    )
+    decoder_layer = nn.TransformerDecoderLayer(
+        d_model=config.hidden_size, nhead=config.num_attention_heads
+    )
+    model = Seq2Seq(
+        encoder=RobertaModel(config),
+        decoder=nn.TransformerDecoder(decoder_layer, num_layers=2),
+        config=config,
+        beam_size=beam_size,
+        max_length=max_length,
+        sos_id=SyntheticTokenizer.cls_token_id,
+        eos_id=SyntheticTokenizer.sep_token_id,
+        use_cache=True,
+    )
+    return model.eval()
+
+
+def sources(count, length, seed=0, vocabulary=WORDS):
+    "`count` synthetic sources of `length` words of `vocabulary`."
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(vocabulary, k=length)) for _ in range(count)]
+
+
+def synthetic_vectors(path, corpus_size, dim=300, seed=0):
+    "Word vector store of `corpus_size` random words, in the layout of vectors.py."
+    import vectors
+
+    class KeyedVectors(object):
+        index_to_key = WORDS[:corpus_size]
+
+    rng = np.random.default_rng(seed)
+    KeyedVectors.vectors = rng.standard_normal((corpus_size, dim), dtype=np.float32)
+    vectors.build(KeyedVectors, path)
+    return vectors.WordVectors(path)
+
+
+def measure(fn, repeat, warmup=1):
+    "Seconds taken by each of `repeat` calls of `fn`, after `warmup` calls."
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, items):
+    "Latency percentiles (ms) and throughput (`items` per second)."
+    timings = np.array(timings)
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p90_ms": float(np.percentile(timings, 90) * 1000),
+        "p99_ms": float(np.percentile(timings, 99) * 1000),
+        "mean_ms": float(timings.mean() * 1000),
+        "throughput": float(items / timings.mean()),
+    }
+
+
+def bench_forward(beam_size, source_length, batch_size, repeat, max_length=32):
+    "Seq2Seq.forward (beam search), throughput in summaries per second."
+    from pipeline import get_features
+    from utils import Example
+
+    tokenizer = SyntheticTokenizer(1000)
+    model = tiny_model(beam_size, max_length, tokenizer.vocab_size)
+    examples = [
+        Example(source=source, target=None)
+        for source in sources(batch_size, source_length)
+    ]
+    source_ids, source_mask = get_features(examples, tokenizer).tensors
+
+    def run():
+        with torch.no_grad():
+            model(source_ids=source_ids, source_mask=source_mask)
+
+    return summarize(measure(run, repeat), batch_size)
+
+
+def bench_beam(beam_size, repeat, steps=32, vocab_size=50265):
+    "Beam.advance over `steps` steps plus getFinal/getHyp, in steps per second."
+    from model import Beam
+
+    torch.manual_seed(0)
+    scores = torch.randn(steps, beam_size, vocab_size).log_softmax(-1)
+
+    def run():
+        beam = Beam(beam_size, 0, 2, "cpu")
+        for step in range(steps):
+            if beam.done():
+                break
+            beam.advance(scores[step])
+        beam.buildTargetTokens(beam.getHyp(beam.getFinal()))
+
+    return summarize(measure(run, repeat), steps)
+
+
+def bench_features(source_length, batch_size, repeat):
+    """
+    convert_examples_to_features (padded to 256) and, as `tensors_p50_ms`,
+    convert_examples_to_tensors. Throughput in examples per second.
+    """
+    from utils import Example, convert_examples_to_features, convert_examples_to_tensors
+
+    tokenizer = SyntheticTokenizer(1000)
+    examples = [
+        Example(source=source, target=None)
+        for source in sources(batch_size, source_length)
+    ]
+    result = summarize(
+        measure(
+            lambda: convert_examples_to_features(examples, tokenizer, stage="test"),
+            repeat,
+        ),
+        batch_size,
+    )
+    tensors = summarize(
+        measure(
+            lambda: convert_examples_to_tensors(examples, tokenizer, stage="test"),
+            repeat,
+        ),
+        batch_size,
+    )
+    result["tensors_p50_ms"] = tensors["p50_ms"]
+    return result
+
+
+def bench_get_vector(corpus_size, words, repeat, directory, queries=100):
+    "Sum of the word vectors of a query, like run.get_vector, in queries per second."
+    from lexical import terms
+
+    store = synthetic_vectors(
+        os.path.join(directory, "vectors-%d" % corpus_size), corpus_size
+    )
+    texts = sources(queries, words, vocabulary=WORDS[:corpus_size])
+
+    def run():
+        for text in texts:
+            store.sum_known(terms(text))
+
+    return summarize(measure(run, repeat), queries)
+
+
+def bench_search(corpus_size, mode, repeat, directory, queries=20, shortlist=256):
+    """
+    The index behind getResults: embedding `corpus_size` descriptions into a
+    VectorIndex (as `index_ms`), then top-4 queries over all of them, in
+    queries per second. `mode` "dense" ranks every description by cosine,
+    "hybrid" only the BM25 shortlist.
+    """
+    from index import VectorIndex
+
+    store = synthetic_vectors(os.path.join(directory, "vectors-search"), 10000)
+
+    def embed(s):
+        return store.sum(s.split())
+
+    descriptions = sources(corpus_size, 8, seed=1, vocabulary=WORDS[:10000])
+    texts = sources(queries, 3, seed=2, vocabulary=WORDS[:10000])
+    # 50 functions per file
+    files = {}
+    for i, description in enumerate(descriptions):
+        files.setdefault("file%d.py" % (i // 50), {})["f%d" % i] = description
+
+    start = time.perf_counter()
+    index = VectorIndex(embed, store.vector_size)
+    for file, definitions in files.items():
+        index.update_file(file, definitions)
+    index_ms = (time.perf_counter() - start) * 1000
+
+    def run():
+        for text in texts:
+            if mode == "hybrid":
+                index.query(embed(text), top_k=4, text=text, shortlist=shortlist)
+            else:
+                index.query(embed(text), top_k=4)
+
+    result = summarize(measure(run, repeat), queries)
+    result["index_ms"] = index_ms
+    return result
+
+
+def run_benchmarks(names, quick=False, repeat=None):
+    "Run the benchmarks `names` over their grids, returns the result rows."
+    directory = tempfile.mkdtemp()
+    rows = []
+    try:
+        for name in names:
+            grid = GRIDS[name][1 if quick else 0]
+            bench = globals()["bench_" + name]
+            for values in itertools.product(*grid.values()):
+                params = dict(zip(grid.keys(), values))
+                kwargs = dict(params, repeat=repeat or (5 if quick else 20))
+                if name in ("get_vector", "search"):
+                    kwargs["directory"] = directory
+                row = {"name": name, "params": params, **bench(**kwargs)}
+                print(
+                    "%-10s %-55s p50 %9.3f ms  p99 %9.3f ms  %10.1f/s"
+                    % (
+                        name,
+                        json.dumps(params),
+                        row["p50_ms"],
+                        row["p99_ms"],
+                        row["throughput"],
+                    )
+                )
+                rows.append(row)
+    finally:
+        shutil.rmtree(directory)
+    return rows
+
+
+def compare(rows, baseline, threshold):
+    """
+    Rows whose p50 latency is more than `threshold` times the one of the
+    same benchmark and parameters in `baseline`, as (row, baseline p50).
+    """
+    before = {
+        (row["name"], json.dumps(row["params"], sort_keys=True)): row["p50_ms"]
+        for row in baseline["results"]
+    }
+    regressions = []
+    for row in rows:
+        p50 = before.get((row["name"], json.dumps(row["params"], sort_keys=True)))
+        if p50 is not None and row["p50_ms"] > threshold * p50:
+            regressions.append((row, p50))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the summarization and search hot paths offline."
+    )
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=sorted(GRIDS), default=list(GRIDS)
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Smaller grids and fewer repeats"
+    )
+    parser.add_argument("--repeat", type=int, help="Timed calls per benchmark")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--compare", help="JSON results of an earlier run to check for regressions"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Largest allowed ratio of p50 latency to the earlier run",
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    rows = run_benchmarks(args.benchmarks, args.quick, args.repeat)
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "threads": args.threads,
+            "quick": args.quick,
+        },
+        "results": rows,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(rows, json.load(f), args.threshold)
+        for row, p50 in regressions:
+            print(
+                "REGRESSION %s %s: p50 %.3f ms, was %.3f ms"
+                % (row["name"], json.dumps(row["params"]), row["p50_ms"], p50)
+            )
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
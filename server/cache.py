@@ -0,0 +1,215 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import textwrap
+import threading
+from collections import OrderedDict
+
+
+def normalize_code(code):
+    """
+    Normalize source code before hashing it, so that edits which only touch
+    indentation, trailing whitespace or blank lines map to the same entry.
+    """
+    lines = textwrap.dedent(code.replace("\r\n", "\n")).split("\n")
+    return "\n".join(line.rstrip() for line in lines if line.strip())
+
+
+def checkpoint_fingerprint(path):
+    """
+    Identify a model checkpoint by its path, size and modification time, so
+    that replacing the checkpoint invalidates the cached summaries.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return os.path.abspath(path)
+    return "%s:%d:%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def model_fingerprint(checkpoint, backend="eager", dtype="float32"):
+    """
+    Identify the summaries of a model by its checkpoint and by how it runs:
+    the int8 and torchscript backends (see backends.py) and the half
+    precision dtypes don't give exactly the same summaries as eager fp32.
+    """
+    return "%s:%s:%s" % (checkpoint_fingerprint(checkpoint), backend, dtype)
+
+
+class SummaryCache(object):
+    """
+    Summaries keyed by a hash of the normalized code, the model and the
+    decoding settings.
+
+    Entries live in an in-memory LRU, and optionally in a sqlite file that
+    survives restarts. The sqlite file is emptied when it was written for a
+    different `model_id`. Writes to the sqlite file happen on a background
+    thread, so `put` never waits for the disk.
+
+    Parameters:
+
+    * `capacity`- number of entries kept in memory.
+    * `path`- sqlite file for the persistent tier, or None to keep memory only.
+    * `model_id`- identifies the model the summaries come from, e.g.
+      `model_fingerprint("pytorch_model.bin", "eager", "bfloat16")`.
+    """
+
+    def __init__(self, capacity=4096, path=None, model_id=""):
+        self.capacity = capacity
+        self.model_id = model_id
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # key -> summary, put but not written to the sqlite file yet
+        self.pending = {}
+        self.writer = None
+        self.wakeup = threading.Event()
+
+        self.db = None
+        # serializes the lookups of `get`, which may run on several threads
+        self.read_lock = threading.Lock()
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # readers don't wait for the writer's transactions
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = self.db.execute(
+                "SELECT value FROM meta WHERE name = 'model_id'"
+            ).fetchone()
+            if row is None or row[0] != model_id:
+                self.db.execute("DELETE FROM summaries")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('model_id', ?)", (model_id,)
+                )
+            self.db.commit()
+            # the writer thread's own connection, `write_lock` serializes its use
+            self.writes = sqlite3.connect(path, check_same_thread=False)
+            self.write_lock = threading.Lock()
+            atexit.register(self.flush)
+
+    def key(self, code, **settings):
+        "Hash of the normalized code, the model and the decoding `settings`."
+        data = json.dumps(
+            [normalize_code(code), self.model_id, sorted(settings.items())]
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, code, **settings):
+        "The cached summary of `code`, or None."
+        key = self.key(code, **settings)
+        summary = self._get_memory(key)
+        if summary is None:
+            summary = self._get_disk(key)
+        return summary
+
+    async def get_async(self, code, **settings):
+        """
+        Like `get`, for the event loop: a summary that isn't in memory is
+        looked up in the sqlite file on a thread.
+        """
+        key = self.key(code, **settings)
+        summary = self._get_memory(key)
+        if summary is None and self.db is None:
+            return self._get_disk(key)
+        if summary is None:
+            loop = asyncio.get_running_loop()
+            summary = await loop.run_in_executor(None, self._get_disk, key)
+        return summary
+
+    def _get_memory(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if key in self.pending:
+                self.hits += 1
+                self._remember(key, self.pending[key])
+                return self.pending[key]
+        return None
+
+    def _get_disk(self, key):
+        row = None
+        if self.db is not None:
+            with self.read_lock:
+                row = self.db.execute(
+                    "SELECT summary FROM summaries WHERE key = ?", (key,)
+                ).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, code, summary, **settings):
+        """
+        Cache `summary`. It is written to the sqlite file in the background,
+        together with every other summary put since the last write.
+        """
+        key = self.key(code, **settings)
+        with self.lock:
+            self._remember(key, summary)
+            if self.db is None:
+                return
+            self.pending[key] = summary
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write, daemon=True)
+                self.writer.start()
+        self.wakeup.set()
+
+    def _write(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        "Write the pending summaries to the sqlite file, in one transaction."
+        if self.db is None:
+            return
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if pending:
+                self.writes.executemany(
+                    "INSERT OR REPLACE INTO summaries VALUES (?, ?)", pending.items()
+                )
+                self.writes.commit()
+
+    def _remember(self, key, summary):
+        self.entries[key] = summary
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+        if self.db is not None:
+            with self.write_lock:
+                self.writes.execute("DELETE FROM summaries")
+                self.writes.commit()
+
+    def stats(self):
+        "Hit/miss counters of the cache."
+        return {
+            "entries": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "pending_writes": len(self.pending),
+        }
@@ -0,0 +1,161 @@
+import ast
+from collections import namedtuple
+
+# Tokens of a source the model sees, the other two of its 256 are cls and sep.
+MAX_TOKENS = 254
+
+# `name` is the dotted path of the function or class the chunk belongs to
+# ("<module>" for module-level code), `start` and `end` are its first and
+# last 0-based lines.
+Chunk = namedtuple("Chunk", ["name", "start", "end", "source"])
+
+
+def split_source(text, count, max_tokens=MAX_TOKENS, overlap=2):
+    """
+    Split `text` into chunks of at most `max_tokens` tokens each, so that
+    nothing past the model's input window is lost.
+
+    Chunks follow `ast` boundaries: every function and class that fits is a
+    chunk of its own, and the module-level statements in between are packed
+    together. A class that is too long is split into its methods, a function
+    that is too long into groups of its statements, each repeating the
+    function's signature. Text that doesn't parse, and single statements
+    that are still too long, are cut into windows of whole lines that
+    overlap by `overlap` lines.
+
+    `count` returns the number of tokens of a string.
+    """
+    lines = text.splitlines(keepends=True)
+    if not lines:
+        return []
+    if count(text) <= max_tokens:
+        return [Chunk("<module>", 0, len(lines) - 1, text)]
+    splitter = _Splitter(lines, count, max_tokens, overlap)
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        splitter.windows("<module>", "", 0, len(lines) - 1)
+    else:
+        splitter.body(tree.body, "", "<module>", "", 0, len(lines) - 1)
+    return splitter.chunks
+
+
+class _Splitter(object):
+    def __init__(self, lines, count, max_tokens, overlap):
+        self.lines = lines
+        self.count = count
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.chunks = []
+
+    def text(self, start, end):
+        return "".join(self.lines[start : end + 1])
+
+    def add(self, name, header, start, end):
+        self.chunks.append(Chunk(name, start, end, header + self.text(start, end)))
+
+    def body(self, nodes, prefix, name, header, begin, end):
+        """
+        Chunks of the statements `nodes`, from line `begin` to `end`. Definitions
+        are named `prefix` + their name, other statements `name`, and every
+        chunk of other statements starts with `header`.
+        """
+        pending = []
+        for i, node in enumerate(nodes):
+            # up to the next statement, so comments in between are kept
+            first = begin if i == 0 else _first_line(node)
+            last = _first_line(nodes[i + 1]) - 1 if i + 1 < len(nodes) else end
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.statements(name, header, pending)
+                pending = []
+                self.definition(node, prefix, first, last)
+            else:
+                pending.append((first, last))
+        self.statements(name, header, pending)
+
+    def definition(self, node, prefix, start, end):
+        name = prefix + node.name
+        if self.count(self.text(start, end)) <= self.max_tokens:
+            self.add(name, "", start, end)
+            return
+        # the `def`/`class` line(s), up to the first statement of the body
+        begin = _first_line(node.body[0])
+        signature = self.text(start, begin - 1)
+        if isinstance(node, ast.ClassDef):
+            self.body(node.body, name + ".", name, signature, begin, end)
+            return
+        spans = []
+        for i, child in enumerate(node.body):
+            last = _first_line(node.body[i + 1]) - 1 if i + 1 < len(node.body) else end
+            spans.append((_first_line(child), last))
+        self.statements(name, signature, spans)
+
+    def statements(self, name, header, spans):
+        "Pack the consecutive line `spans` of statements into chunks."
+        budget = self.max_tokens - (self.count(header) if header else 0)
+        group = None
+        used = 0
+        for start, end in spans:
+            tokens = self.count(self.text(start, end))
+            if group is not None and used + tokens <= budget:
+                group[1] = end
+                used += tokens
+                continue
+            if group is not None:
+                self.add(name, header, *group)
+            if tokens > budget:
+                self.windows(name, header, start, end)
+                group = None
+                used = 0
+            else:
+                group = [start, end]
+                used = tokens
+        if group is not None:
+            self.add(name, header, *group)
+
+    def windows(self, name, header, start, end):
+        "Cut the lines `start`..`end` into overlapping windows of whole lines."
+        budget = self.max_tokens - (self.count(header) if header else 0)
+        counts = [self.count(line) for line in self.lines[start : end + 1]]
+        first = start
+        while first <= end:
+            last = first
+            used = counts[first - start]
+            while last < end and used + counts[last + 1 - start] <= budget:
+                last += 1
+                used += counts[last - start]
+            self.add(name, header, first, last)
+            if last == end:
+                break
+            first = max(last + 1 - self.overlap, first + 1)
+
+
+def _first_line(node):
+    "0-based first line of `node`, including its decorators."
+    decorators = getattr(node, "decorator_list", None)
+    lineno = min([node.lineno] + [d.lineno for d in decorators or ()])
+    return lineno - 1
+
+
+def outline(chunks, summaries):
+    """
+    Combine the `summaries` of `chunks` into one hierarchical summary: a
+    line "name: summary" per chunk in source order, indented by the depth
+    of the name, with "(part i/n)" after names split into several chunks.
+    A single chunk gives its summary as it is.
+    """
+    if len(chunks) == 1:
+        return summaries[0]
+    totals = {}
+    for chunk in chunks:
+        totals[chunk.name] = totals.get(chunk.name, 0) + 1
+    seen = {}
+    result = []
+    for chunk, summary in zip(chunks, summaries):
+        name = chunk.name
+        if totals[name] > 1:
+            seen[name] = seen.get(name, 0) + 1
+            name = "%s (part %d/%d)" % (name, seen[name], totals[name])
+        depth = 0 if chunk.name == "<module>" else chunk.name.count(".")
+        result.append("%s%s: %s" % ("  " * depth, name, summary))
+    return "\n".join(result)
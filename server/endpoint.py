@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import httpx
+
+# Responses worth retrying: the endpoint is restarting or overloaded.
+RETRY_STATUS = (502, 503, 504)
+
+
+class EndpointClient(object):
+    """
+    Shared HTTP client of the language server for the summary endpoint.
+
+    Keeps a pool of keep-alive connections to the endpoint, gives up on
+    calls that take longer than `timeout` instead of hanging the editor, and
+    retries failed calls with exponential backoff. At most `parallel` calls
+    are in flight at the same time, so a fan-out over many files doesn't
+    flood the endpoint.
+
+    Parameters:
+
+    * `url`- base URL of the endpoint, e.g. "http://localhost:3000".
+    * `max_connections`- size of the connection pool.
+    * `timeout`- seconds to wait for a connection, or for the next part of a
+      response.
+    * `retries`- number of times a failed call is tried again.
+    * `backoff`- seconds to wait before the first retry, doubled after each.
+    * `parallel`- number of calls in flight at the same time.
+    """
+
+    def __init__(
+        self,
+        url,
+        max_connections=10,
+        timeout=10.0,
+        retries=2,
+        backoff=0.5,
+        parallel=8,
+    ):
+        self.url = url.rstrip("/")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.parallel = parallel
+        # Created on first use, so they belong to the server's event loop.
+        self.client = None
+        self.slots = None
+
+    def _start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            self.slots = asyncio.Semaphore(self.parallel)
+
+    async def _retry(self, attempt):
+        "Wait before retry `attempt`, or return False if there are none left."
+        if attempt >= self.retries:
+            return False
+        await asyncio.sleep(self.backoff * 2**attempt)
+        return True
+
+    async def post(self, path, body):
+        "POST `body` as JSON to `path` and return the decoded JSON response."
+        self._start()
+        attempt = 0
+        async with self.slots:
+            while True:
+                try:
+                    response = await self.client.post(self.url + path, json=body)
+                    if response.status_code not in RETRY_STATUS:
+                        response.raise_for_status()
+                        return response.json()
+                    error = httpx.HTTPStatusError(
+                        "%d from %s" % (response.status_code, path),
+                        request=response.request,
+                        response=response,
+                    )
+                except httpx.TransportError as e:
+                    error = e
+                if not await self._retry(attempt):
+                    raise error
+                attempt += 1
+
+    async def events(self, path, body):
+        """
+        POST `body` as JSON to `path` and yield the decoded JSON of every
+        server-sent event of the response. The call is only retried until
+        the first event arrives.
+        """
+        self._start()
+        attempt = 0
+        async with self.slots:
+            while True:
+                received = False
+                try:
+                    async with self.client.stream(
+                        "POST", self.url + path, json=body
+                    ) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if line.startswith("data:"):
+                                received = True
+                                yield json.loads(line[len("data:") :])
+                    return
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    retry = isinstance(e, httpx.TransportError) or (
+                        e.response.status_code in RETRY_STATUS
+                    )
+                    if received or not retry or not await self._retry(attempt):
+                        raise
+                attempt += 1
+
+    async def gather(self, path, bodies):
+        "POST every one of `bodies` to `path` in parallel, results in order."
+        return await asyncio.gather(*[self.post(path, body) for body in bodies])
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import torch
+
+MODES = ("thread", "process")
+
+
+def _init_worker(torch_threads, load):
+    torch.set_num_threads(torch_threads)
+    if load is not None:
+        load()
+
+
+def _ready():
+    return os.getpid()
+
+
+class InferenceExecutor(object):
+    """
+    Runs blocking model calls off the event loop.
+
+    In "thread" mode calls run on a bounded thread pool. In "process" mode
+    they run on a pool of worker processes, started as fresh interpreters
+    ("spawn") rather than forked: GNU OpenMP deadlocks in a process forked
+    from one that has already run torch on several threads. Every worker
+    calls `load` before anything else, e.g. to load the model with its
+    checkpoint memory-mapped, so that the workers share its pages instead
+    of each holding a copy. Streaming calls (see `stream`) always run on
+    threads of this process.
+
+    Parameters:
+
+    * `workers`- number of calls that run at the same time.
+    * `mode`- "thread" or "process".
+    * `torch_threads`- torch intra-op threads per worker, by default the
+      cores are split evenly between the workers.
+    * `load`- called in every worker process when it starts. It has to be
+      picklable: a module-level function, or a functools.partial of one.
+    """
+
+    def __init__(self, workers=1, mode="thread", torch_threads=None, load=None):
+        if mode not in MODES:
+            raise ValueError(
+                "Unknown mode %r, expected one of %s" % (mode, ", ".join(MODES))
+            )
+        self.workers = workers
+        self.mode = mode
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        if mode == "thread":
+            torch.set_num_threads(self.torch_threads)
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.torch_threads, load),
+            )
+            # Start every worker now, so the first calls don't wait for `load`,
+            # and a failing `load` fails here.
+            for future in [self.pool.submit(_ready) for _ in range(workers)]:
+                future.result()
+        # Streaming calls report back through the event loop, so they need
+        # to run in this process.
+        self.stream_pool = ThreadPoolExecutor(max_workers=workers)
+        self.running = 0
+
+    async def run(self, fn, *args):
+        """
+        Run `fn(*args)` on the pool and wait for its result. In "process"
+        mode `fn` must be a module-level function, and the worker sees the
+        state of its module as `load` left it, not as it is in this process.
+        """
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        try:
+            return await loop.run_in_executor(self.pool, fn, *args)
+        finally:
+            self.running -= 1
+
+    def submit(self, fn, *args):
+        """
+        Start `fn(*args)` on the pool from outside the event loop, e.g. while
+        the server starts. Returns a `concurrent.futures.Future`.
+        """
+        return self.pool.submit(fn, *args)
+
+    async def stream(self, fn, *args):
+        """
+        Run `fn(*args, emit)` on a thread, and yield every item it passes to
+        `emit` as soon as it does, followed by its return value.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(item):
+            loop.call_soon_threadsafe(queue.put_nowait, (False, item))
+
+        self.running += 1
+        try:
+            future = loop.run_in_executor(self.stream_pool, fn, *args, emit)
+            future.add_done_callback(lambda _: queue.put_nowait((True, None)))
+            while True:
+                done, item = await queue.get()
+                if done:
+                    break
+                yield item
+            yield await future
+        finally:
+            self.running -= 1
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "running": self.running,
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+        self.stream_pool.shutdown(wait=False)
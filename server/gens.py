@@ -1,11 +1,12 @@
 # reference for the gensim text similarity model usage.
 
 from scipy import spatial
-import gensim.downloader as api
-import numpy as np
+
+import vectors
 
 # choose from multiple models https://github.com/RaRe-Technologies/gensim-data
-model = api.load("glove-wiki-gigaword-300")
+# the vectors are converted once into a memory-mapped store (see vectors.py)
+model = vectors.load("glove-wiki-gigaword-300", "glove-wiki-gigaword-300.vectors")
 
 
 def preprocess(s):
@@ -13,7 +14,10 @@ def preprocess(s):
 
 # returns the vector reprensentation of a word
 def get_vector(s):
-    return np.sum(np.array([model[i] for i in preprocess(s)]), axis=0)
+    result = model.sum(preprocess(s))
+    if result is None:
+        raise KeyError(s)
+    return result
 
 # sorts the descriptions according to the percentage match with query, uses cosine similarity between vectors
 # first generates vectors from words, and then calculates the cosine similarity between vectors for the result
@@ -0,0 +1,289 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# Imported as a top-level module by run.py, and by the language server as
+# part of its package.
+if __package__:
+    from .lexical import LexicalIndex, terms
+    from .ranking import best, normalize
+else:
+    from lexical import LexicalIndex, terms
+    from ranking import best, normalize
+
+
+def text_vector(vectors, text):
+    """
+    Sum of the word vectors (a vectors.WordVectors) of the terms of `text`,
+    or of "not valid" when none of them has one, so every text gets a vector.
+    """
+    result = vectors.sum_known(terms(text))
+    if result is None:
+        result = vectors.sum(terms("not valid"))
+    return result
+
+
+class VectorIndex(object):
+    """
+    Normalized embeddings of function descriptions, keyed by (file, symbol).
+
+    The embeddings are rows of one contiguous float32 matrix, so a query is a
+    single matrix-vector product. Only descriptions that are new or changed
+    get embedded again.
+
+    The symbols and descriptions are also kept in a LexicalIndex, so a query
+    can first shortlist the descriptions sharing a term with it, and only
+    rank those by cosine (see `query`).
+
+    Parameters:
+
+    * `embed`- returns the vector of a description, e.g. `text_vector`.
+    * `dim`- size of the vectors returned by `embed`.
+    """
+
+    def __init__(self, embed, dim):
+        self.embed = embed
+        self.dim = dim
+        # Rows past `size` are spare capacity.
+        self.vectors = np.zeros((64, dim), dtype=np.float32)
+        self.size = 0
+        self.keys = []
+        self.descriptions = []
+        self.rows = {}
+        # file -> symbols of that file in the index
+        self.files = {}
+        self.lexical = LexicalIndex()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return tuple(key) in self.rows
+
+    def upsert(self, file, symbol, description):
+        "Add or update one description. Returns True if it had to be embedded."
+        key = (file, symbol)
+        row = self.rows.get(key)
+        if row is not None and self.descriptions[row] == description:
+            return False
+        vector = normalize(self.embed(description))
+        if row is None:
+            if self.size == len(self.vectors):
+                grown = np.zeros(
+                    (max(64, 2 * len(self.vectors)), self.dim), dtype=np.float32
+                )
+                grown[: self.size] = self.vectors[: self.size]
+                self.vectors = grown
+            row = self.size
+            self.size += 1
+            self.rows[key] = row
+            self.keys.append(key)
+            self.descriptions.append(description)
+            self.files.setdefault(file, set()).add(symbol)
+        self.vectors[row] = vector
+        self.descriptions[row] = description
+        self.lexical.upsert(key, symbol + " " + description)
+        return True
+
+    def remove(self, file, symbol):
+        "Drop one description, moving the last row into its place."
+        row = self.rows.pop((file, symbol), None)
+        if row is None:
+            return False
+        self.lexical.remove((file, symbol))
+        self.files[file].discard(symbol)
+        if not self.files[file]:
+            del self.files[file]
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.keys[row] = self.keys[last]
+            self.descriptions[row] = self.descriptions[last]
+            self.rows[self.keys[row]] = row
+        self.keys.pop()
+        self.descriptions.pop()
+        self.size = last
+        return True
+
+    def update_file(self, file, definitions, replace=True):
+        """
+        Bring the descriptions of `file` up to date with `definitions`
+        ({symbol: description}). With `replace`, symbols of the file that are
+        missing from `definitions` are removed. Returns the number of rows
+        that changed.
+        """
+        changed = 0
+        if replace:
+            for symbol in list(self.files.get(file, ())):
+                if symbol not in definitions:
+                    changed += self.remove(file, symbol)
+        for symbol, description in definitions.items():
+            changed += self.upsert(file, symbol, description)
+        return changed
+
+    def remove_file(self, file):
+        return self.update_file(file, {})
+
+    def query(self, vector, top_k=None, files=None, text=None, shortlist=None):
+        """
+        Find the descriptions closest (by cosine) to `vector`.
+
+        With the query `text` and a `shortlist` size, an index of more than
+        `shortlist` descriptions only ranks the `shortlist` best BM25 matches
+        of `text` by cosine, however many descriptions the index holds. When
+        fewer than `top_k` descriptions share a term with `text`, every
+        description is ranked instead.
+
+        Parameters:
+
+        * `vector`- embedding of the query.
+        * `top_k`- number of results, all of them if None.
+        * `files`- only consider the descriptions of these files.
+        * `text`- the query, for the shortlist.
+        * `shortlist`- number of BM25 matches ranked by cosine.
+
+        Returns: a list of (file, symbol, description, score), best first.
+        """
+        if files is not None:
+            files = set(files)
+        keys = None
+        if text is not None and shortlist and self.size > shortlist:
+            accept = None if files is None else (lambda key: key[0] in files)
+            matches = self.lexical.search(text, max(shortlist, top_k or 0), accept)
+            if matches and len(matches) >= (top_k or 1):
+                keys = [key for key, _ in matches]
+        if keys is None and files is not None:
+            keys = [
+                (file, symbol) for file in files for symbol in self.files.get(file, ())
+            ]
+        if keys is None:
+            rows = np.arange(self.size)
+            vectors = self.vectors[: self.size]
+        else:
+            rows = np.array([self.rows[key] for key in keys], dtype=np.int64)
+            vectors = self.vectors[rows]
+        if len(rows) == 0:
+            return []
+        scores = vectors @ normalize(vector)
+        indices, scores = best(scores[None, :], top_k)
+        return [
+            self.keys[rows[i]] + (self.descriptions[rows[i]], float(score))
+            for i, score in zip(indices[0], scores[0])
+        ]
+
+    def save(self, path):
+        "Write the index to `path` (.npz)."
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                vectors=self.vectors[: self.size],
+                keys=json.dumps(self.keys),
+                descriptions=json.dumps(self.descriptions),
+            )
+
+    @classmethod
+    def load(cls, path, embed):
+        "Read an index written by `save`."
+        with np.load(path) as data:
+            vectors = data["vectors"]
+            index = cls(embed, vectors.shape[1])
+            index.vectors = np.array(vectors, dtype=np.float32)
+            index.size = len(vectors)
+            index.keys = [tuple(key) for key in json.loads(str(data["keys"]))]
+            index.descriptions = json.loads(str(data["descriptions"]))
+        index.rows = {key: row for row, key in enumerate(index.keys)}
+        for (file, symbol), description in zip(index.keys, index.descriptions):
+            index.files.setdefault(file, set()).add(symbol)
+            index.lexical.upsert((file, symbol), symbol + " " + description)
+        return index
+
+
+class IndexFull(ValueError):
+    "A workspace would hold more descriptions than all workspaces may."
+
+
+class WorkspaceIndexes(object):
+    """
+    One VectorIndex per workspace, so that clients whose files have the same
+    paths don't overwrite each other's descriptions. A workspace is any id
+    the client picks.
+
+    At most `max_size` descriptions are kept in all, the least recently used
+    workspaces are dropped to make room for the others.
+
+    Parameters:
+
+    * `embed`, `dim`- see VectorIndex.
+    * `max_size`- number of descriptions kept across every workspace.
+    """
+
+    def __init__(self, embed, dim, max_size=100000):
+        self.embed = embed
+        self.dim = dim
+        self.max_size = max_size
+        # workspace -> VectorIndex, least recently used first
+        self.indexes = OrderedDict()
+        self.dropped = 0
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes.values())
+
+    def get(self, workspace):
+        "The index of `workspace`, or None if it has none."
+        index = self.indexes.get(workspace)
+        if index is not None:
+            self.indexes.move_to_end(workspace)
+        return index
+
+    def update_file(self, workspace, file, definitions, replace=True):
+        """
+        VectorIndex.update_file on the index of `workspace`, dropping the
+        least recently used other workspaces when the descriptions don't fit
+        anymore. Raises IndexFull when they don't fit even on their own.
+        """
+        index = self.get(workspace)
+        if index is None:
+            index = self.indexes[workspace] = VectorIndex(self.embed, self.dim)
+        # at most this many once updated
+        size = len(index) + len(definitions)
+        if replace:
+            size -= len(index.files.get(file, ()))
+        if size > self.max_size:
+            raise IndexFull(
+                "%d descriptions, at most %d are kept" % (size, self.max_size)
+            )
+        changed = index.update_file(file, definitions, replace)
+        while len(self) > self.max_size:
+            self.indexes.popitem(last=False)
+            self.dropped += 1
+        return changed
+
+    def save(self, path):
+        "Write every index to the directory `path`."
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(path, name))
+        names = []
+        for i, (workspace, index) in enumerate(self.indexes.items()):
+            names.append([workspace, "%d.npz" % i])
+            index.save(os.path.join(path, names[-1][1]))
+        with open(os.path.join(path, "workspaces.json"), "w") as f:
+            json.dump(names, f)
+
+    @classmethod
+    def load(cls, path, embed, dim, max_size=100000):
+        "Read the indexes written by `save` to `path`, if there are any."
+        indexes = cls(embed, dim, max_size)
+        if not os.path.exists(os.path.join(path, "workspaces.json")):
+            return indexes
+        with open(os.path.join(path, "workspaces.json")) as f:
+            for workspace, name in json.load(f):
+                indexes.indexes[workspace] = VectorIndex.load(
+                    os.path.join(path, name), embed
+                )
+        while len(indexes) > max_size:
+            indexes.indexes.popitem(last=False)
+        return indexes
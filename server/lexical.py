@@ -0,0 +1,105 @@
+import heapq
+import math
+import re
+
+# Words too common in descriptions and code to narrow a search down.
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the this to with".split()
+)
+
+_WORDS = re.compile(r"[A-Za-z0-9]+")
+# "getHTTPResponse2" -> get, HTTP, Response, 2
+_PARTS = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def terms(text):
+    """
+    Lowercase search terms of `text`. Identifiers are split on underscores
+    and camelCase boundaries, so "get_user_name" and "getUserName" both give
+    ["get", "user", "name"]. Punctuation is dropped.
+    """
+    result = []
+    for word in _WORDS.findall(text):
+        result.extend(part.lower() for part in _PARTS.findall(word))
+    return result
+
+
+class LexicalIndex(object):
+    """
+    Inverted index of documents keyed by (file, symbol), ranked with BM25.
+
+    Every term maps to the documents containing it, so a query only visits
+    the documents that share a term with it, however large the index is.
+    Documents can be added, changed and removed one at a time.
+
+    Parameters:
+
+    * `k1`, `b`- BM25 term frequency saturation and length normalization.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {key: term frequency}
+        self.postings = {}
+        # key -> {term: term frequency}
+        self.documents = {}
+        # key -> number of terms
+        self.lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def upsert(self, key, text):
+        "Index `text` as the document `key`, replacing what it was before."
+        self.remove(key)
+        frequencies = {}
+        for term in terms(text):
+            if term not in STOPWORDS:
+                frequencies[term] = frequencies.get(term, 0) + 1
+        self.documents[key] = frequencies
+        self.lengths[key] = sum(frequencies.values())
+        self.total_length += self.lengths[key]
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[key] = frequency
+
+    def remove(self, key):
+        frequencies = self.documents.pop(key, None)
+        if frequencies is None:
+            return
+        self.total_length -= self.lengths.pop(key)
+        for term in frequencies:
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+
+    def search(self, text, limit=None, accept=None):
+        """
+        The `limit` documents with the highest BM25 score for the query
+        `text`, only among the keys for which `accept(key)` is true when
+        given. Documents without any term of the query are left out.
+
+        Returns: a list of (key, score), best first.
+        """
+        count = len(self.documents)
+        if not count:
+            return []
+        average = self.total_length / count
+        scores = {}
+        for term in set(terms(text)) - STOPWORDS:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                if accept is not None and not accept(key):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average)
+                scores[key] = scores.get(key, 0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + norm
+                )
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: -item[1])
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,153 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+
+from .cache import model_fingerprint
+from .metrics import Metrics
+
+
+class LocalSummarizer(object):
+    """
+    The summarization model and word vectors, loaded in the language server
+    process on first use, so that summaries and searches don't need the
+    hosted endpoint.
+
+    Parameters:
+
+    * `checkpoint`- weights of the summarization model.
+    * `vectors_path`- directory of the memory-mapped word vector store.
+    * `backend`- how the model runs, one of backends.BACKENDS.
+    * `low_memory`, `dtype`- how the weights are kept, see
+      pipeline.build_model.
+    * `shortlist`- number of BM25 matches a search ranks by cosine, see
+      VectorIndex.query.
+    """
+
+    def __init__(
+        self,
+        checkpoint,
+        vectors_path,
+        backend="eager",
+        low_memory=False,
+        dtype="float32",
+        shortlist=256,
+    ):
+        self.checkpoint = checkpoint
+        self.vectors_path = vectors_path
+        self.backend = backend
+        self.low_memory = low_memory
+        self.dtype = dtype
+        self.shortlist = shortlist
+        self.model_id = "local:" + model_fingerprint(checkpoint, backend, dtype)
+        self.lock = threading.Lock()
+        self.model = None
+        self.error = None
+        # stage timers of the model, see metrics.py
+        self.metrics = Metrics()
+
+    def available(self):
+        "Whether the model can be loaded here, without loading it."
+        if self.error is not None or not os.path.exists(self.checkpoint):
+            return False
+        return all(
+            importlib.util.find_spec(name) is not None
+            for name in ("torch", "transformers")
+        )
+
+    def load(self):
+        with self.lock:
+            if self.model is not None:
+                return
+            if self.error is not None:
+                raise self.error
+            try:
+                self._load()
+            except Exception as e:
+                self.error = e
+                raise
+
+    def _load(self):
+        from transformers import RobertaConfig, RobertaModel
+
+        from . import pipeline, vectors
+        from .index import VectorIndex, text_vector
+        from .tokenization import CodeTokenizer
+
+        config = RobertaConfig.from_pretrained("microsoft/codebert-base")
+        self.tokenizer = CodeTokenizer("microsoft/codebert-base")
+        self.pipeline = pipeline
+        self.text_vector = text_vector
+        self.vectors = vectors.load("glove-wiki-gigaword-300", self.vectors_path)
+        self.index = VectorIndex(self.get_vector, self.vectors.vector_size)
+        self.index_lock = threading.Lock()
+        self.model = pipeline.build_model(
+            RobertaModel,
+            config,
+            self.tokenizer,
+            self.checkpoint,
+            self.backend,
+            self.low_memory,
+            self.dtype,
+        )
+        self.model.metrics = self.metrics
+
+    def get_vector(self, s):
+        "Vector of `s`, see index.text_vector."
+        return self.text_vector(self.vectors, s)
+
+    def summarize(self, code, options=None, on_partial=None, cancelled=None):
+        """
+        Summarize `code` with the decoding `options` of a /summary request.
+        `on_partial` is called with the current best summary after every
+        decode step, and decoding stops once `cancelled` returns True.
+        Returns the summary, the decoding settings used and the seconds
+        spent in each stage, like the final event of /summary/stream.
+        """
+        self.load()
+        from .utils import Example
+
+        decoding, deadline = self.pipeline.request_settings(self.model, options or {})
+        if on_partial is not None:
+            partial = lambda active, texts: on_partial(texts[0])
+        else:
+            partial = None
+        with self.metrics.record() as timings:
+            with self.metrics.time("acs_stage_seconds", stage="tokenize"):
+                data = self.pipeline.get_features(
+                    [Example(source=code, target=None)], self.tokenizer
+                )
+            message, _ = self.pipeline.inference(
+                data,
+                self.model,
+                self.tokenizer,
+                on_partial=partial,
+                decoding=decoding,
+                deadline=deadline,
+                cancelled=cancelled,
+            )
+        reached = deadline is not None and time.monotonic() >= deadline
+        return message[0], dict(decoding, deadline_reached=reached), timings
+
+    def search(self, files, query, top_k=None):
+        """
+        Bring the descriptions of `files` ({file: {symbol: description}}) up
+        to date and rank them against `query`, like the /index/query
+        endpoint.
+        """
+        self.load()
+        with self.index_lock:
+            for file, definitions in files.items():
+                self.index.update_file(file, definitions)
+            matches = self.index.query(
+                self.get_vector(query), top_k, list(files), query, self.shortlist
+            )
+        return [
+            {"file": file, "symbol": symbol, "description": description, "score": score}
+            for file, symbol, description, score in matches
+        ]
+
+    async def run(self, fn, *args):
+        "Run `fn(*args)` on a thread, off the language server's event loop."
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
@@ -0,0 +1,195 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets.
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the batch size histogram buckets.
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# Descriptions of the metrics of the server, for metrics created without one.
+HELP = {
+    "acs_stage_seconds": "Seconds spent in each stage of summarization",
+    "acs_decode_steps_total": "Decode steps run by the beam search",
+    "acs_early_stops_total": "Examples cut short by early stopping",
+    "acs_decode_stops_total": "Beam searches by the reason they stopped",
+    "acs_batch_size": "Requests per batch run through the model",
+    "acs_queue_wait_seconds": "Seconds requests waited for their batch",
+    "acs_unbatched_total": "Summaries run in a batch of their own, every batcher was busy",
+    "acs_request_seconds": "Seconds taken by summary requests",
+    "acs_cache_hits_total": "Cache hits",
+    "acs_cache_misses_total": "Cache misses",
+    "acs_startup_seconds": "Seconds each startup stage took",
+    "acs_ready": "Whether each startup stage is ready",
+}
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms of the summarization server, rendered in
+    the Prometheus text format by `render`.
+
+    Every metric is created on first use. Histograms use `TIME_BUCKETS`
+    unless other buckets were given with `histogram`. Labels are passed as
+    keyword arguments, e.g. `metrics.observe("acs_stage_seconds", 0.2,
+    stage="encoder")`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.kinds = {}
+        # name -> {labels: value}, for counters and gauges
+        self.values = {}
+        # name -> buckets
+        self.buckets = {}
+        # name -> {labels: [count per bucket..., count, sum]}
+        self.histograms = {}
+        # `stages` of the block of `record` running on each thread
+        self.recording = threading.local()
+
+    def _declare(self, name, kind, help):
+        if name not in self.kinds:
+            self.kinds[name] = (kind, help or HELP.get(name, name))
+
+    def histogram(self, name, buckets, help=None):
+        "Declare the histogram `name` with the upper bounds `buckets`."
+        with self.lock:
+            self._declare(name, "histogram", help)
+            self.buckets[name] = tuple(buckets)
+
+    def inc(self, name, value=1, help=None, **labels):
+        "Add `value` to the counter `name`."
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self._declare(name, "counter", help)
+            values = self.values.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, help=None, kind="gauge", **labels):
+        """
+        Set the gauge `name` to `value`. With `kind="counter"` it sets a
+        counter kept elsewhere, e.g. the hit counters of a cache.
+        """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self._declare(name, kind, help)
+            self.values.setdefault(name, {})[key] = value
+
+    def observe(self, name, value, help=None, **labels):
+        "Record `value` in the histogram `name`."
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self._declare(name, "histogram", help)
+            buckets = self.buckets.setdefault(name, TIME_BUCKETS)
+            counts = self.histograms.setdefault(name, {}).get(key)
+            if counts is None:
+                counts = self.histograms[name][key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+        stages = getattr(self.recording, "stages", None)
+        if stages is not None and "stage" in labels:
+            stages[labels["stage"]] = stages.get(labels["stage"], 0) + value
+
+    @contextlib.contextmanager
+    def time(self, name, help=None, **labels):
+        "Record the seconds the block takes in the histogram `name`."
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help, **labels)
+
+    @contextlib.contextmanager
+    def record(self):
+        """
+        Yields a dict that collects the seconds of every stage (values
+        observed with a `stage` label) recorded by this thread during the
+        block, e.g. to report the timings of a single request.
+        """
+        previous = getattr(self.recording, "stages", None)
+        self.recording.stages = {}
+        try:
+            yield self.recording.stages
+        finally:
+            self.recording.stages = previous
+
+    def render(self):
+        "Every metric in the Prometheus text exposition format."
+        lines = []
+        with self.lock:
+            for name, (kind, help) in sorted(self.kinds.items()):
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s %s" % (name, kind))
+                if kind != "histogram":
+                    for key, value in sorted(self.values.get(name, {}).items()):
+                        lines.append("%s%s %s" % (name, _labels(key), _number(value)))
+                    continue
+                buckets = self.buckets[name]
+                for key, counts in sorted(self.histograms.get(name, {}).items()):
+                    for bound, count in zip(buckets + ("+Inf",), counts):
+                        if bound == "+Inf":
+                            count = counts[-2]
+                        le = key + (("le", _number(bound)),)
+                        lines.append("%s_bucket%s %d" % (name, _labels(le), count))
+                    lines.append("%s_count%s %d" % (name, _labels(key), counts[-2]))
+                    lines.append(
+                        "%s_sum%s %s" % (name, _labels(key), _number(counts[-1]))
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in key
+    )
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Held while a torch profiler session runs, torch can't run two at once.
+_profiling = threading.Lock()
+
+
+@contextlib.contextmanager
+def profile(directory, name="summary"):
+    """
+    Record a torch profiler trace of the block into `directory` (a Chrome
+    trace, viewable in chrome://tracing or Perfetto). Does nothing when
+    `directory` is not set, or while another block of this process is being
+    profiled.
+    """
+    if not directory or not _profiling.acquire(blocking=False):
+        yield
+        return
+    try:
+        from torch.profiler import ProfilerActivity
+        from torch.profiler import profile as torch_profile
+
+        os.makedirs(directory, exist_ok=True)
+        with torch_profile(
+            activities=[ProfilerActivity.CPU], record_shapes=True
+        ) as prof:
+            yield
+        prof.export_chrome_trace(
+            os.path.join(directory, "%s-%d.json" % (name, time.time_ns()))
+        )
+    finally:
+        _profiling.release()
+
+
+def log_event(logger, event, **fields):
+    "Log `event` and its `fields` as one line of JSON."
+    logger.info(json.dumps(dict(event=event, **fields), sort_keys=True))
@@ -1,8 +1,12 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+import math
+import time
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class Seq2Seq(nn.Module):
@@ -18,6 +22,8 @@ class Seq2Seq(nn.Module):
     * `max_length`- max length of target for beam search.
     * `sos_id`- start of symbol ids in target for beam search.
     * `eos_id`- end of symbol ids in target for beam search.
+    * `use_cache`- decode incrementally, caching the keys/values of every
+      decoder layer instead of re-running the decoder over the whole prefix.
     """
 
     def __init__(
@@ -29,12 +35,14 @@ class Seq2Seq(nn.Module):
         max_length=None,
         sos_id=None,
         eos_id=None,
+        use_cache=False,
     ):
         super(Seq2Seq, self).__init__()
         self.encoder = encoder
         self.decoder = decoder
         self.config = config
-        self.register_buffer("bias", torch.tril(torch.ones(2048, 2048)))
+        # Causal mask of the longest target seen so far, see `_causal_mask`.
+        self.causal_mask = None
         self.dense = nn.Linear(config.hidden_size, config.hidden_size)
         self.lm_head = nn.Linear(config.hidden_size, config.vocab_size, bias=False)
         self.lsm = nn.LogSoftmax(dim=-1)
@@ -44,6 +52,38 @@ class Seq2Seq(nn.Module):
         self.max_length = max_length
         self.sos_id = sos_id
         self.eos_id = eos_id
+        self.use_cache = use_cache
+        # Exported (e.g. TorchScript) versions of `encode` and `decode_step`
+        # used instead of the eager ones, see backends.py.
+        self.exported = {}
+        # Optional metrics.Metrics that receives the time spent in every stage
+        # of `forward` and the decode step counters. Set it after the model
+        # is prepared, it can't be deep-copied.
+        self.metrics = None
+
+    def encode(self, source_ids, source_mask):
+        "Encoder states of the source (source_len x batch x hidden)."
+        outputs = self.encoder(source_ids, attention_mask=source_mask)
+        return outputs[0].permute([1, 0, 2]).contiguous()
+
+    def _causal_mask(self, length, device, dtype):
+        """
+        Additive causal mask of the decoder self-attention (length x length).
+
+        Built on demand and cached, grown only when a longer target comes
+        along, so the model doesn't keep a mask for 2048 tokens around.
+        """
+        mask = self.causal_mask
+        if (
+            mask is None
+            or mask.shape[0] < length
+            or mask.device != device
+            or mask.dtype != dtype
+        ):
+            size = max(length, 0 if mask is None else mask.shape[0])
+            ones = torch.ones(size, size, device=device, dtype=dtype)
+            mask = self.causal_mask = -1e4 * (1 - torch.tril(ones))
+        return mask[:length, :length]
 
     def _tie_or_clone_weights(self, first_module, second_module):
         """Tie or clone module weights depending of weither we are using TorchScript or not"""
@@ -67,12 +107,20 @@ class Seq2Seq(nn.Module):
         target_ids=None,
         target_mask=None,
         args=None,
+        on_step=None,
+        decoding=None,
     ):
-        outputs = self.encoder(source_ids, attention_mask=source_mask)
-        encoder_output = outputs[0].permute([1, 0, 2]).contiguous()
+        start = time.perf_counter()
+        encoder_output = self.exported.get("encode", self.encode)(
+            source_ids, source_mask
+        )
+        if self.metrics is not None:
+            self.metrics.observe(
+                "acs_stage_seconds", time.perf_counter() - start, stage="encoder"
+            )
         if target_ids is not None:
-            attn_mask = -1e4 * (
-                1 - self.bias[: target_ids.shape[1], : target_ids.shape[1]]
+            attn_mask = self._causal_mask(
+                target_ids.shape[1], target_ids.device, encoder_output.dtype
             )
             tgt_embeddings = (
                 self.encoder.embeddings(target_ids).permute([1, 0, 2]).contiguous()
@@ -100,64 +148,343 @@ class Seq2Seq(nn.Module):
             return outputs
         else:
             # Predict
-            preds = []
-            if source_ids.device.type == "cuda":
-                zero = torch.cuda.LongTensor(1).fill_(0)
-            elif source_ids.device.type == "cpu":
-                zero = torch.LongTensor(1).fill_(0)
-            for i in range(source_ids.shape[0]):
-                context = encoder_output[:, i : i + 1]
-                context_mask = source_mask[i : i + 1, :]
-                beam = Beam(
-                    self.beam_size,
-                    self.sos_id,
-                    self.eos_id,
-                    device=source_ids.device.type,
+            return self.beam_search(
+                encoder_output, source_mask, on_step, **(decoding or {})
+            )
+
+    def beam_search(
+        self,
+        encoder_output,
+        source_mask,
+        on_step=None,
+        beam_size=None,
+        max_length=None,
+        length_penalty=None,
+        early_stopping=False,
+        deadline=None,
+        cancelled=None,
+    ):
+        """
+        Run beam search for every example of the batch at once.
+
+        All examples and all of their beams are decoded together as a single
+        `(batch * beam)` decoder batch, laid out example-major. Examples whose
+        beam is done are dropped from the decoder batch, so finished
+        sequences do not cost any further decode steps.
+
+        Parameters:
+
+        * `encoder_output`- encoder states (source_len x batch x hidden)
+        * `source_mask`- attention mask of the source (batch x source_len)
+        * `on_step`- optional callback, called after every decode step with
+          the indices of the examples still being decoded and the tokens of
+          their current best hypothesis (examples x step, without sos).
+        * `beam_size`, `max_length`- override the model's settings for this
+          call, a beam size of 1 is greedy decoding.
+        * `length_penalty`- rank finished hypotheses by their score divided
+          by `((5 + length) / 6) ** length_penalty`, instead of the raw score.
+        * `early_stopping`- stop decoding an example as soon as none of its
+          live beams can beat its best finished hypothesis anymore.
+        * `deadline`- `time.monotonic()` value after which no further steps
+          are decoded, and the best hypotheses found so far are returned.
+        * `cancelled`- optional callable, checked before every step. Once it
+          returns True decoding stops, as when the deadline passes.
+
+        With `self.metrics` set, the time spent in the decoder and in the beam
+        bookkeeping, the number of decode steps and why decoding stopped are
+        recorded there.
+
+        Returns: predicted token ids (batch x beam x max_length), padded with 0.
+        """
+        beam_size = beam_size or self.beam_size
+        max_length = max_length or self.max_length
+        batch_size = source_mask.shape[0]
+        beams = [
+            Beam(
+                beam_size,
+                self.sos_id,
+                self.eos_id,
+                device=source_mask.device.type,
+                length_penalty=length_penalty,
+                early_stopping=early_stopping,
+                max_length=max_length,
+            )
+            for _ in range(batch_size)
+        ]
+        # Indices (into `beams`) of the examples still being decoded.
+        active = list(range(batch_size))
+        # Everything that is kept per row of the decoder batch, rows first.
+        state = {
+            "input_ids": torch.cat([beams[i].getCurrentState() for i in active], 0),
+        }
+        if self.use_cache:
+            state.update(self._init_cache(encoder_output, source_mask, beam_size))
+        else:
+            state["context"] = encoder_output.permute([1, 0, 2]).repeat_interleave(
+                beam_size, dim=0
+            )
+            state["context_mask"] = source_mask.repeat_interleave(beam_size, dim=0)
+        decoder_time = beam_time = 0.0
+        steps = early_stops = 0
+        stop = "max_length"
+        for _ in range(max_length):
+            if deadline is not None and time.monotonic() >= deadline:
+                stop = "deadline"
+                break
+            if cancelled is not None and cancelled():
+                stop = "cancelled"
+                break
+            start = time.perf_counter()
+            keep = [n for n, i in enumerate(active) if not beams[i].done()]
+            if len(keep) != len(active):
+                early_stops += sum(
+                    beams[i].stoppedEarly() for i in active if beams[i].done()
                 )
-                input_ids = beam.getCurrentState()
-                context = context.repeat(1, self.beam_size, 1)
-                context_mask = context_mask.repeat(self.beam_size, 1)
-                for _ in range(self.max_length):
-                    if beam.done():
-                        break
-                    attn_mask = -1e4 * (
-                        1 - self.bias[: input_ids.shape[1], : input_ids.shape[1]]
-                    )
-                    tgt_embeddings = (
-                        self.encoder.embeddings(input_ids)
-                        .permute([1, 0, 2])
-                        .contiguous()
-                    )
-                    out = self.decoder(
-                        tgt_embeddings,
-                        context,
-                        tgt_mask=attn_mask,
-                        memory_key_padding_mask=(1 - context_mask).bool(),
-                    )
-                    out = torch.tanh(self.dense(out))
-                    hidden_states = out.permute([1, 0, 2]).contiguous()[:, -1, :]
-                    out = self.lsm(self.lm_head(hidden_states)).data
-                    beam.advance(out)
-                    input_ids.data.copy_(
-                        input_ids.data.index_select(0, beam.getCurrentOrigin())
-                    )
-                    input_ids = torch.cat((input_ids, beam.getCurrentState()), -1)
-                hyp = beam.getHyp(beam.getFinal())
-                pred = beam.buildTargetTokens(hyp)[: self.beam_size]
-                pred = [
-                    torch.cat(
-                        [x.view(-1) for x in p] + [zero] * (self.max_length - len(p))
-                    ).view(1, -1)
-                    for p in pred
-                ]
-                preds.append(torch.cat(pred, 0).unsqueeze(0))
-
-            preds = torch.cat(preds, 0)
-            return preds
+            if not keep:
+                stop = "done"
+                break
+            if len(keep) != len(active):
+                # Mask out the rows of the examples that just finished.
+                rows = self._beam_rows(keep, source_mask.device, beam_size)
+                state = {
+                    name: value.index_select(0, rows) for name, value in state.items()
+                }
+                active = [active[n] for n in keep]
+            beam_time += time.perf_counter() - start
+            start = time.perf_counter()
+            if self.use_cache:
+                decode_step = self.exported.get("decode_step", self.decode_step)
+                (
+                    hidden_states,
+                    state["self_keys"],
+                    state["self_values"],
+                    state["positions"],
+                ) = decode_step(
+                    state["input_ids"][:, -1:],
+                    state["positions"],
+                    state["self_keys"],
+                    state["self_values"],
+                    state["memory_keys"],
+                    state["memory_values"],
+                    state["memory_mask"],
+                )
+            else:
+                hidden_states = self._decode(state)
+            # Beam scores add up over the steps, keep them in fp32 even when
+            # the weights are bf16/fp16.
+            out = self.lsm(self.lm_head(hidden_states).float()).data
+            out = out.view(len(active), beam_size, -1)
+            decoder_time += time.perf_counter() - start
+            start = time.perf_counter()
+            steps += 1
+            origins = []
+            for n, i in enumerate(active):
+                beams[i].advance(out[n])
+                origins.append(beams[i].getCurrentOrigin() + n * beam_size)
+            origins = torch.cat(origins)
+            # Only the target side differs between the beams of an example.
+            for name in ("input_ids", "positions", "self_keys", "self_values"):
+                if name in state:
+                    state[name] = state[name].index_select(0, origins)
+            state["input_ids"] = torch.cat(
+                (
+                    state["input_ids"],
+                    torch.cat([beams[i].getCurrentState() for i in active], 0),
+                ),
+                -1,
+            )
+            if on_step is not None:
+                # The beams are sorted by score, row 0 of an example is its best.
+                on_step(active, state["input_ids"][::beam_size, 1:])
+            beam_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        preds = []
+        for beam in beams:
+            hyp = beam.getHyp(beam.getFinal())
+            pred = beam.buildTargetTokens(hyp)[:beam_size]
+            preds.append(F.pad(pred, (0, max_length - pred.shape[1])))
+
+        preds = torch.stack(preds, 0)
+        if self.metrics is not None:
+            beam_time += time.perf_counter() - start
+            self.metrics.observe("acs_stage_seconds", decoder_time, stage="decoder")
+            self.metrics.observe("acs_stage_seconds", beam_time, stage="beam")
+            self.metrics.inc("acs_decode_steps_total", steps)
+            # Examples cut short by `early_stopping`.
+            self.metrics.inc("acs_early_stops_total", early_stops)
+            self.metrics.inc("acs_decode_stops_total", stop=stop)
+        return preds
+
+    def _decode(self, state):
+        """Run the decoder over the whole target prefix of every row."""
+        input_ids = state["input_ids"]
+        attn_mask = self._causal_mask(
+            input_ids.shape[1], input_ids.device, state["context"].dtype
+        )
+        tgt_embeddings = (
+            self.encoder.embeddings(input_ids).permute([1, 0, 2]).contiguous()
+        )
+        out = self.decoder(
+            tgt_embeddings,
+            state["context"].permute([1, 0, 2]),
+            tgt_mask=attn_mask,
+            memory_key_padding_mask=(1 - state["context_mask"]).bool(),
+        )
+        out = torch.tanh(self.dense(out))
+        return out.permute([1, 0, 2]).contiguous()[:, -1, :]
+
+    def _init_cache(self, encoder_output, source_mask, beam_size=None):
+        """
+        Build the incremental decoding state of the beam search.
+
+        The encoder output is projected into the cross-attention keys/values
+        of every decoder layer once, before decoding starts. The self-attention
+        keys/values start empty and grow by one position per decode step.
+        """
+        beam_size = beam_size or self.beam_size
+        memory_keys, memory_values = [], []
+        for layer in self.decoder.layers:
+            attn = layer.multihead_attn
+            _, w_k, w_v = attn.in_proj_weight.chunk(3)
+            _, b_k, b_v = attn.in_proj_bias.chunk(3)
+            memory_keys.append(
+                self._split_heads(F.linear(encoder_output, w_k, b_k), attn)
+            )
+            memory_values.append(
+                self._split_heads(F.linear(encoder_output, w_v, b_v), attn)
+            )
+        memory_keys = torch.stack(memory_keys, 1)
+        memory_values = torch.stack(memory_values, 1)
+        rows = memory_keys.shape[0] * beam_size
+        empty = memory_keys.new_zeros(
+            rows, *memory_keys.shape[1:3], 0, memory_keys.shape[-1]
+        )
+        memory_mask = torch.zeros_like(source_mask, dtype=encoder_output.dtype)
+        memory_mask = memory_mask.masked_fill(source_mask == 0, float("-inf"))
+        return {
+            "memory_keys": memory_keys.repeat_interleave(beam_size, dim=0),
+            "memory_values": memory_values.repeat_interleave(beam_size, dim=0),
+            "memory_mask": memory_mask[:, None, None, :].repeat_interleave(
+                beam_size, dim=0
+            ),
+            "self_keys": empty,
+            "self_values": empty,
+            "positions": torch.zeros(
+                rows, 1, dtype=torch.long, device=source_mask.device
+            ),
+        }
+
+    def decode_step(
+        self,
+        input_ids,
+        positions,
+        self_keys,
+        self_values,
+        memory_keys,
+        memory_values,
+        memory_mask,
+    ):
+        """
+        Run the decoder over the newest token of every row only.
+
+        Gives the same hidden states as `_decode`: the newest token attends to
+        the cached keys/values of the prefix. Only takes and returns tensors,
+        so that it can be traced (see backends.py).
+
+        Parameters:
+
+        * `input_ids`- the newest token of every row (rows x 1)
+        * `positions`- number of non-padding tokens before it (rows x 1)
+        * `self_keys`, `self_values`- cached self-attention keys/values
+          (rows x layers x heads x prefix_len x head_dim)
+        * `memory_keys`, `memory_values`- cross-attention keys/values of the
+          encoder output (rows x layers x heads x source_len x head_dim)
+        * `memory_mask`- additive mask of the source padding
+
+        Returns: (hidden_states, self_keys, self_values, positions) with the
+        newest token added to the cache.
+        """
+        # Same position ids as RoBERTa derives from the full prefix.
+        padding_idx = self.encoder.embeddings.padding_idx
+        not_pad = input_ids.ne(padding_idx).long()
+        positions = positions + not_pad
+        x = self.encoder.embeddings(
+            input_ids, position_ids=positions * not_pad + padding_idx
+        )[:, 0]
+        new_keys, new_values = [], []
+        for i, layer in enumerate(self.decoder.layers):
+            attn = layer.self_attn
+            q, k, v = F.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, -1)
+            k = torch.cat((self_keys[:, i], self._split_heads(k, attn)), 2)
+            v = torch.cat((self_values[:, i], self._split_heads(v, attn)), 2)
+            new_keys.append(k)
+            new_values.append(v)
+            out = self._attend(attn, self._split_heads(q, attn), k, v)
+            x = layer.norm1(x + layer.dropout1(out))
+
+            attn = layer.multihead_attn
+            w_q, _, _ = attn.in_proj_weight.chunk(3)
+            b_q, _, _ = attn.in_proj_bias.chunk(3)
+            out = self._attend(
+                attn,
+                self._split_heads(F.linear(x, w_q, b_q), attn),
+                memory_keys[:, i],
+                memory_values[:, i],
+                memory_mask,
+            )
+            x = layer.norm2(x + layer.dropout2(out))
+
+            out = layer.linear2(layer.dropout(layer.activation(layer.linear1(x))))
+            x = layer.norm3(x + layer.dropout3(out))
+        if self.decoder.norm is not None:
+            x = self.decoder.norm(x)
+        return (
+            torch.tanh(self.dense(x)),
+            torch.stack(new_keys, 1),
+            torch.stack(new_values, 1),
+            positions,
+        )
+
+    @staticmethod
+    def _split_heads(x, attn):
+        """
+        Split `x` (rows x hidden, or length x rows x hidden) into the heads
+        of `attn` (rows x heads x length x head_dim).
+        """
+        x = x.view(*x.shape[:-1], attn.num_heads, attn.head_dim)
+        if x.dim() == 3:
+            return x.unsqueeze(2)
+        return x.permute([1, 2, 0, 3])
+
+    @staticmethod
+    def _attend(attn, q, k, v, mask=None):
+        """Scaled dot-product attention of `attn` for a single query position."""
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(attn.head_dim)
+        if mask is not None:
+            scores = scores + mask
+        out = torch.matmul(scores.softmax(-1), v)
+        return attn.out_proj(out.reshape(out.shape[0], -1))
+
+    def _beam_rows(self, examples, device, beam_size=None):
+        """Rows of the `(batch * beam)` decoder batch owned by `examples`."""
+        beam_size = beam_size or self.beam_size
+        examples = torch.tensor(examples, dtype=torch.long, device=device)
+        offsets = torch.arange(beam_size, device=device)
+        return (examples.unsqueeze(1) * beam_size + offsets).view(-1)
 
 
 class Beam(object):
-    def __init__(self, size, sos, eos, device):
+    def __init__(
+        self,
+        size,
+        sos,
+        eos,
+        device,
+        length_penalty=None,
+        early_stopping=False,
+        max_length=None,
+    ):
         self.size = size
         if device == "cuda":
             self.tt = torch.cuda
@@ -173,13 +500,19 @@ class Beam(object):
         # Has EOS topped the beam yet.
         self._eos = eos
         self.eosTop = False
-        # Time and k pair for finished.
+        # (scores, time, beam indices) of the hypotheses finished at each
+        # time-step, kept as tensors.
         self.finished = []
+        self.numFinished = 0
+        # Length-normalized score of the best finished hypothesis.
+        self.lengthPenalty = length_penalty
+        self.earlyStopping = early_stopping
+        self.maxLength = max_length
+        self.bestFinished = -math.inf
 
     def getCurrentState(self):
         "Get the outputs for the current timestep."
-        batch = self.tt.LongTensor(self.nextYs[-1]).view(-1, 1)
-        return batch
+        return self.nextYs[-1].view(-1, 1)
 
     def getCurrentOrigin(self):
         "Get the backpointers for the current timestep."
@@ -201,12 +534,12 @@ class Beam(object):
 
         # Sum the previous scores.
         if len(self.prevKs) > 0:
-            beamLk = wordLk + self.scores.unsqueeze(1).expand_as(wordLk)
+            beamLk = wordLk + self.scores.unsqueeze(1)
 
             # Don't let EOS have children.
-            for i in range(self.nextYs[-1].size(0)):
-                if self.nextYs[-1][i] == self._eos:
-                    beamLk[i] = -1e20
+            beamLk = beamLk.masked_fill(
+                (self.nextYs[-1] == self._eos).unsqueeze(1), -1e20
+            )
         else:
             beamLk = wordLk[0]
         flatBeamLk = beamLk.view(-1)
@@ -220,52 +553,98 @@ class Beam(object):
         self.prevKs.append(prevK)
         self.nextYs.append((bestScoresId - prevK * numWords))
 
-        for i in range(self.nextYs[-1].size(0)):
-            if self.nextYs[-1][i] == self._eos:
-                s = self.scores[i]
-                self.finished.append((s, len(self.nextYs) - 1, i))
+        finishedKs = (self.nextYs[-1] == self._eos).nonzero().view(-1)
+        if finishedKs.numel() > 0:
+            self.finished.append(
+                (self.scores[finishedKs], len(self.nextYs) - 1, finishedKs)
+            )
+            self.numFinished += finishedKs.numel()
+            self.bestFinished = max(
+                self.bestFinished,
+                float(self.normalize(self.scores[finishedKs[0]], len(self.nextYs) - 1)),
+            )
+
+            # End condition is when top-of-beam is EOS and no global score.
+            if finishedKs[0] == 0:
+                self.eosTop = True
 
-        # End condition is when top-of-beam is EOS and no global score.
-        if self.nextYs[-1][0] == self._eos:
-            self.eosTop = True
+    def normalize(self, scores, lengths):
+        "`scores` of hypotheses of `lengths` tokens, with the length penalty."
+        if not self.lengthPenalty:
+            return scores
+        return scores / ((5.0 + lengths) / 6.0) ** self.lengthPenalty
 
     def done(self):
-        return self.eosTop and len(self.finished) >= self.size
+        if self.eosTop and self.numFinished >= self.size:
+            return True
+        return self.stoppedEarly()
+
+    def stoppedEarly(self):
+        "Whether early stopping, not `size` finished hypotheses, ends the beam."
+        if self.eosTop and self.numFinished >= self.size:
+            return False
+        if not self.earlyStopping or self.numFinished == 0:
+            return False
+        # Scores only go down as a hypothesis grows, so the best live beam
+        # can at most reach its current score, normalized at the most
+        # favourable length it can still finish at.
+        live = self.scores.masked_fill(self.nextYs[-1] == self._eos, -math.inf)
+        live = float(live.max())
+        lengths = [len(self.nextYs)]
+        if self.maxLength is not None:
+            lengths.append(self.maxLength)
+        return self.bestFinished >= max(
+            float(self.normalize(torch.tensor(live), length)) for length in lengths
+        )
 
     def getFinal(self):
-        if len(self.finished) == 0:
-            self.finished.append((self.scores[0], len(self.nextYs) - 1, 0))
-        self.finished.sort(key=lambda a: -a[0])
-        if len(self.finished) != self.size:
-            unfinished = []
-            for i in range(self.nextYs[-1].size(0)):
-                if self.nextYs[-1][i] != self._eos:
-                    s = self.scores[i]
-                    unfinished.append((s, len(self.nextYs) - 1, i))
-            unfinished.sort(key=lambda a: -a[0])
-            self.finished += unfinished[: self.size - len(self.finished)]
-        return self.finished[: self.size]
+        """
+        Pick the `size` best hypotheses, topping up the finished ones with the
+        best unfinished ones. Returns (scores, time-steps, beam indices).
+        """
+        finished = self.finished
+        if self.numFinished == 0:
+            finished = [
+                (
+                    self.scores[:1],
+                    len(self.nextYs) - 1,
+                    self.tt.LongTensor(1).fill_(0),
+                )
+            ]
+        scores = torch.cat([s for s, _, _ in finished])
+        timesteps = torch.cat([torch.full_like(k, t) for _, t, k in finished])
+        ks = torch.cat([k for _, _, k in finished])
+        scores = self.normalize(scores, timesteps)
+        scores, order = scores.sort(descending=True, stable=True)
+        timesteps, ks = timesteps[order], ks[order]
+        if ks.numel() < self.size:
+            unfinishedKs = (self.nextYs[-1] != self._eos).nonzero().view(-1)
+            unfinishedScores, order = self.normalize(
+                self.scores[unfinishedKs], len(self.nextYs) - 1
+            ).sort(descending=True, stable=True)
+            unfinishedKs = unfinishedKs[order]
+            scores = torch.cat((scores, unfinishedScores))
+            timesteps = torch.cat(
+                (timesteps, torch.full_like(unfinishedKs, len(self.nextYs) - 1))
+            )
+            ks = torch.cat((ks, unfinishedKs))
+        return scores[: self.size], timesteps[: self.size], ks[: self.size]
 
     def getHyp(self, beam_res):
         """
-        Walk back to construct the full hypothesis.
+        Walk back to construct the full hypotheses, all at once.
+
+        Returns a (hypotheses x time) tensor; positions past the time-step a
+        hypothesis finished at are 0.
         """
-        hyps = []
-        for _, timestep, k in beam_res:
-            hyp = []
-            for j in range(len(self.prevKs[:timestep]) - 1, -1, -1):
-                hyp.append(self.nextYs[j + 1][k])
-                k = self.prevKs[j][k]
-            hyps.append(hyp[::-1])
+        _, timesteps, k = beam_res
+        hyps = k.new_zeros(k.numel(), len(self.prevKs))
+        for j in range(len(self.prevKs) - 1, -1, -1):
+            alive = timesteps > j
+            hyps[:, j] = self.nextYs[j + 1][k].masked_fill(~alive, 0)
+            k = torch.where(alive, self.prevKs[j][k], k)
         return hyps
 
     def buildTargetTokens(self, preds):
-        sentence = []
-        for pred in preds:
-            tokens = []
-            for tok in pred:
-                if tok == self._eos:
-                    break
-                tokens.append(tok)
-            sentence.append(tokens)
-        return sentence
+        """Cut every hypothesis of `preds` at its first EOS, padding with 0."""
+        return preds.masked_fill((preds == self._eos).cumsum(1) > 0, 0)
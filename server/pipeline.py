@@ -0,0 +1,156 @@
+# Loading the summarization model and running it, shared by run.py and the tools.
+import time
+import torch
+import torch.nn as nn
+# run.py and the tools run from this directory, the language server imports the package.
+if __package__:
+    from .model import Seq2Seq
+    from .backends import prepare
+    from .utils import convert_examples_to_tensors
+else:
+    from model import Seq2Seq
+    from backends import prepare
+    from utils import convert_examples_to_tensors
+from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
+
+
+STRATEGIES = ("greedy", "beam")
+# dtypes the weights can be kept in, by name
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def decoding_settings(model, strategy=None, beam_size=None, max_length=None,
+                      length_penalty=None, early_stopping=False, max_beam_size=None):
+    # The decoding settings of one request, with the model's defaults filled in.
+    # "greedy" is a beam of 1; "beam" uses `beam_size`, or the model's beam size.
+    # The beam is cut to `max_beam_size` (when given) and to the vocabulary, the length to the model's.
+    if strategy is None:
+        strategy = "greedy" if beam_size == 1 else "beam"
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown strategy %r, expected one of %s" % (strategy, ", ".join(STRATEGIES)))
+    for name, value in (("beam_size", beam_size), ("max_length", max_length)):
+        if value is not None and value < 1:
+            raise ValueError("%s must be at least 1, got %r" % (name, value))
+    if strategy == "greedy":
+        beam_size = 1
+    beam_size = min(beam_size or model.beam_size, model.config.vocab_size)
+    if max_beam_size:
+        beam_size = min(beam_size, max_beam_size)
+    return {
+        "strategy": strategy,
+        "beam_size": beam_size,
+        "max_length": min(max_length or model.max_length, model.max_length),
+        "length_penalty": length_penalty,
+        "early_stopping": early_stopping,
+    }
+
+
+def request_settings(model, options, max_beam_size=None):
+    # The decoding settings and deadline (a time.monotonic() value, or None) of the `options`
+    # of a /summary request, i.e. its fields other than `code`. Raises ValueError for invalid ones.
+    options = dict(options)
+    deadline_ms = options.pop("deadline_ms", None)
+    deadline = None
+    if deadline_ms is not None:
+        if deadline_ms < 0:
+            raise ValueError("deadline_ms must not be negative, got %r" % (deadline_ms,))
+        deadline = time.monotonic() + deadline_ms / 1000
+    return decoding_settings(model, max_beam_size=max_beam_size, **options), deadline
+
+
+def inference(data, model, tokenizer, on_partial=None, decoding=None, deadline=None, cancelled=None):
+    # on_partial: optional callback, called after every decode step with the indices of
+    # the examples still being decoded and the text of their current best hypothesis.
+    # decoding: settings from decoding_settings, the model's own when None.
+    # deadline: time.monotonic() value after which the best hypotheses found so far are returned.
+    # cancelled: optional callable, the beam search stops as soon as it returns True.
+    decoding = dict(decoding or {}, deadline=deadline, cancelled=cancelled)
+    decoding.pop("strategy", None)
+    eval_sampler = SequentialSampler(data)
+    eval_dataloader = DataLoader(data, sampler=eval_sampler, batch_size=len(data))
+
+    on_step = None
+    if on_partial is not None:
+        def on_step(active, prefixes):
+            sequences = []
+            for prefix in prefixes.tolist():
+                if model.eos_id in prefix:
+                    prefix = prefix[: prefix.index(model.eos_id)]
+                sequences.append(prefix)
+            on_partial(active, tokenizer.batch_decode(sequences, clean_up_tokenization_spaces=False))
+
+    model.eval()
+    p = []
+    for batch in eval_dataloader:
+        batch = tuple(t.to('cpu') for t in batch)
+        source_ids, source_mask = batch
+        with torch.no_grad():
+            preds = model(source_ids=source_ids, source_mask=source_mask, on_step=on_step, decoding=decoding)
+            start = time.perf_counter()
+            sequences = []
+            for pred in preds:
+                t = pred[0].cpu().numpy()
+                t = list(t)
+                if 0 in t:
+                    t = t[: t.index(0)]
+                sequences.append(t)
+            p.extend(tokenizer.batch_decode(sequences, clean_up_tokenization_spaces=False))
+            if model.metrics is not None:
+                model.metrics.observe("acs_stage_seconds", time.perf_counter() - start, stage="detokenize")
+    return (p, source_ids.shape[-1])
+
+
+def get_features(examples, tokenizer):
+    # padded to the longest source of the batch, not to 256 tokens
+    all_source_ids, all_source_mask = convert_examples_to_tensors(
+        examples, tokenizer, stage="test"
+    )
+    return TensorDataset(all_source_ids, all_source_mask)
+
+
+def load_checkpoint(checkpoint, mmap=False):
+    # state dict of a torch.save checkpoint, or of a .safetensors file.
+    # mmap: the tensors are views of the file instead of copies on the heap, so every process that
+    # loads the same checkpoint shares its pages.
+    if checkpoint.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(checkpoint, device="cpu")
+    if mmap:
+        try:
+            return torch.load(checkpoint, map_location=torch.device("cpu"), mmap=True)
+        except RuntimeError:
+            # checkpoints saved in the legacy (non-zip) format can't be memory-mapped
+            pass
+    return torch.load(checkpoint, map_location=torch.device("cpu"))
+
+
+def build_model(model_class, config, tokenizer, checkpoint="pytorch_model.bin", backend="eager",
+                low_memory=False, dtype="float32"):
+    # low_memory: use the memory-mapped tensors of the checkpoint as the weights instead of copying them.
+    # dtype: one of DTYPES, bfloat16 and float16 keep the weights in half the memory. A checkpoint
+    # already saved in that dtype stays memory-mapped.
+    if dtype not in DTYPES:
+        raise ValueError("Unknown dtype %r, expected one of %s" % (dtype, ", ".join(DTYPES)))
+    if backend == "int8" and dtype != "float32":
+        raise ValueError("The int8 backend quantizes float32 weights, not %s" % dtype)
+    encoder = model_class(config=config)
+    decoder_layer = nn.TransformerDecoderLayer(
+        d_model=config.hidden_size, nhead=config.num_attention_heads
+    )
+    decoder = nn.TransformerDecoder(decoder_layer, num_layers=6)
+    model = Seq2Seq(
+        encoder=encoder,
+        decoder=decoder,
+        config=config,
+        beam_size=10,
+        max_length=128,
+        sos_id=tokenizer.cls_token_id,
+        eos_id=tokenizer.sep_token_id,
+        use_cache=True,
+    )
+
+    model.load_state_dict(load_checkpoint(checkpoint, mmap=low_memory), strict=False, assign=low_memory)
+    if low_memory:
+        # assigning replaced lm_head's weight, share the embeddings again
+        model.tie_weights()
+    return prepare(model.to(DTYPES[dtype]), backend)
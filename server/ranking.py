@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def normalize(vectors):
+    "Scale every row of `vectors` to unit length (zero rows stay zero)."
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def rank(queries, documents, top_k=None):
+    """
+    Score every query against every document by cosine similarity, with one
+    matrix product, and pick the best `top_k` documents of each query.
+
+    Parameters:
+
+    * `queries`- query vectors (Q x dim).
+    * `documents`- document vectors (N x dim).
+    * `top_k`- number of documents returned per query, all of them if None.
+
+    Returns: (indices, scores), both (Q x top_k), best match first.
+    """
+    return best(normalize(queries) @ normalize(documents).T, top_k)
+
+
+def best(scores, top_k=None):
+    """
+    Pick the `top_k` highest scores of every row of `scores` (Q x N).
+
+    Returns: (indices, scores), both (Q x top_k), highest score first.
+    """
+    n = scores.shape[1]
+    if top_k is None or top_k >= n:
+        indices = np.broadcast_to(np.arange(n), scores.shape)
+    else:
+        # Only the top_k candidates need sorting.
+        indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    top = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(top, order, axis=1),
+    )
@@ -1,136 +1,583 @@
 import os
+import glob
 import json
-import torch
-import torch.nn as nn
-from model import Seq2Seq
-from utils import Example, convert_examples_to_features
-from transformers import RobertaConfig, RobertaModel, RobertaTokenizer
-from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
-from fastapi import FastAPI
-from pydantic import BaseModel
+import threading
+import time
+import asyncio
+import functools
+import collections
+from typing import Dict, List, Optional
+from pipeline import build_model, decoding_settings, get_features, inference, request_settings
+from backends import sample_sources
+from utils import Example, bucket_by_length
+from batching import Coalescer, MicroBatcher
+from chunking import outline, split_source
+from executor import InferenceExecutor
+from cache import SummaryCache, model_fingerprint
+from metrics import Metrics, SIZE_BUCKETS, profile
+from ranking import rank
+from index import IndexFull, WorkspaceIndexes, text_vector
+from tokenization import CodeTokenizer
+from transformers import RobertaConfig, RobertaModel
+from torch.utils.data import TensorDataset
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
 
 from scipy import spatial
-import gensim.downloader as api
+import vectors
 import numpy as np
 
-## We are defining all the needed functions here.
-def inference(data, model, tokenizer):
-    # Calculate bleu
-    eval_sampler = SequentialSampler(data)
-    eval_dataloader = DataLoader(data, sampler=eval_sampler, batch_size=len(data))
-
-    model.eval()
-    p = []
-    for batch in eval_dataloader:
-        batch = tuple(t.to('cpu') for t in batch)
-        source_ids, source_mask = batch
-        with torch.no_grad():
-            preds = model(source_ids=source_ids, source_mask=source_mask)
-            for pred in preds:
-                t = pred[0].cpu().numpy()
-                t = list(t)
-                if 0 in t:
-                    t = t[: t.index(0)]
-                text = tokenizer.decode(t, clean_up_tokenization_spaces=False)
-                p.append(text)
-    return (p, source_ids.shape[-1])
-
-
-def get_features(examples, tokenizer):
-    features = convert_examples_to_features(
-        examples, tokenizer, stage="test"
-    )
-    all_source_ids = torch.tensor(
-        [f.source_ids[: 256] for f in features], dtype=torch.long
-    )
-    all_source_mask = torch.tensor(
-        [f.source_mask[: 256] for f in features], dtype=torch.long
-    )
-    return TensorDataset(all_source_ids, all_source_mask)
+# The server starts answering right away and loads in stages: "model" (tokenizer, summarization model
+# and workers) and "vectors" (word vectors and description index) load at the same time on background
+# threads, and "warmup" runs once the model is there. Each stage is pending, loading, ready or failed.
+stages = {name: {"status": "pending"} for name in ("model", "vectors", "warmup")}
+
+# ACS_CHECKPOINT: weights of the model, a torch.save file or .safetensors.
+# ACS_BACKEND: how the model runs, one of backends.BACKENDS (eager, int8, torchscript).
+# ACS_LOW_MEMORY: when set, the weights are memory-mapped from the checkpoint and shared between processes.
+# ACS_DTYPE: float32, or bfloat16/float16 to keep the weights in half the memory.
+checkpoint = os.environ.get("ACS_CHECKPOINT", "pytorch_model.bin")
+backend = os.environ.get("ACS_BACKEND", "eager")
+dtype = os.environ.get("ACS_DTYPE", "float32")
+# set by load_model
+config = tokenizer = model = executor = None
+
+# Stage timers and counters of the model and the request path, served at /metrics.
+metrics = Metrics()
+metrics.histogram("acs_batch_size", SIZE_BUCKETS, "Requests per batch run through the model")
+# ACS_PROFILE_DIR: when set, a torch profiler trace (Chrome trace format) of every model run is written there.
+profile_dir = os.environ.get("ACS_PROFILE_DIR")
+
+# The model runs off the event loop, so a slow beam search doesn't hold up other requests.
+# ACS_WORKERS: number of batches summarized at the same time.
+# ACS_WORKER_MODE: "thread", or "process" for worker processes that each load the model with the checkpoint
+# memory-mapped, sharing its weights.
+# ACS_TORCH_THREADS: torch intra-op threads per worker (default: the cores split between the workers).
+worker_mode = os.environ.get("ACS_WORKER_MODE", "thread")
 
+def load_summarizer(low_memory=bool(os.environ.get("ACS_LOW_MEMORY"))):
+    # the tokenizer and model, of the server and of every worker process
+    global config, tokenizer, model
+    config = RobertaConfig.from_pretrained("microsoft/codebert-base")
+    # fast tokenizer when available, token ids of recent sources are cached
+    tokenizer = CodeTokenizer("microsoft/codebert-base")
+    model = build_model(
+        model_class = RobertaModel, config = config, tokenizer = tokenizer, checkpoint = checkpoint,
+        backend = backend,
+        low_memory = low_memory,
+        dtype = dtype,
+    ).to('cpu')
+    model.metrics = metrics
 
-def build_model(model_class, config, tokenizer):
-    encoder = model_class(config=config)
-    decoder_layer = nn.TransformerDecoderLayer(
-        d_model=config.hidden_size, nhead=config.num_attention_heads
+def load_model():
+    global executor, default_decoding, batcher
+    load_summarizer()
+    executor = InferenceExecutor(
+        workers=int(os.environ.get("ACS_WORKERS", 1)),
+        mode=worker_mode,
+        torch_threads=int(os.environ.get("ACS_TORCH_THREADS", 0)) or None,
+        # worker processes memory-map the checkpoint, so they share its pages
+        load=functools.partial(load_summarizer, True),
     )
-    decoder = nn.TransformerDecoder(decoder_layer, num_layers=6)
-    model = Seq2Seq(
-        encoder=encoder,
-        decoder=decoder,
-        config=config,
-        beam_size=10,
-        max_length=128,
-        sos_id=tokenizer.cls_token_id,
-        eos_id=tokenizer.sep_token_id,
+    # the model's own decoding settings, used when a request doesn't choose any
+    default_decoding = decoding_settings(model)
+    batcher = get_batcher(default_decoding)
+
+# Memory-mapped word vectors, built from the gensim model the first time.
+# ACS_VECTORS_PATH: directory of the word vector store.
+# ACS_INDEX_PATH: directory the description indexes are loaded from at startup and saved to at shutdown (optional).
+index_path = os.environ.get("ACS_INDEX_PATH")
+# ACS_INDEX_MAX_SIZE: descriptions kept across all workspaces, the least recently used workspaces are dropped
+# to make room.
+index_max_size = int(os.environ.get("ACS_INDEX_MAX_SIZE", 100000))
+# set by load_vectors
+querymodel = description_indexes = None
+
+def load_vectors():
+    global querymodel, description_indexes
+    querymodel = vectors.load(
+        "glove-wiki-gigaword-300",
+        os.environ.get("ACS_VECTORS_PATH", "glove-wiki-gigaword-300.vectors"),
     )
+    # Index of the function descriptions of each workspace, kept up to date by its language server.
+    if index_path:
+        description_indexes = WorkspaceIndexes.load(index_path, get_vector, querymodel.vector_size, index_max_size)
+    else:
+        description_indexes = WorkspaceIndexes(get_vector, querymodel.vector_size, index_max_size)
+
+
+# identifiers are split into words (getUserName -> get user name), words missing from the vocabulary
+# are skipped instead of turning the whole text into "not valid"
+def get_vector(s):
+    return text_vector(querymodel, s)
+
+# ACS_BUCKET_SIZE: when set, batches are split into buckets of this many sources of similar length,
+# so that short sources are not padded to the longest one of the batch.
+bucket_size = int(os.environ.get("ACS_BUCKET_SIZE", 0))
 
-    model.load_state_dict(
-        torch.load(
-            "pytorch_model.bin",
-            map_location=torch.device("cpu"),
-        ),
-        strict=False,
+def summarize(codes, decoding=None, deadline=None, cancelled=None):
+    with profile(profile_dir):
+        return summarize_buckets(codes, decoding, deadline, cancelled)
+
+def summarize_buckets(codes, decoding, deadline, cancelled):
+    examples = [Example(source=code, target=None) for code in codes]
+    with metrics.time("acs_stage_seconds", stage="tokenize"):
+        data = get_features(examples, tokenizer)
+    if not bucket_size or len(examples) <= bucket_size:
+        message, length = inference(data, model, tokenizer, decoding=decoding, deadline=deadline,
+                                    cancelled=cancelled)
+        return message
+    summaries = [None] * len(examples)
+    for indices, source_ids, source_mask in bucket_by_length(*data.tensors, bucket_size):
+        message, length = inference(TensorDataset(source_ids, source_mask), model, tokenizer,
+                                    decoding=decoding, deadline=deadline, cancelled=cancelled)
+        for i, m in zip(indices.tolist(), message):
+            summaries[i] = m
+    return summaries
+
+def summarize_streaming(code, decoding, deadline, cancelled, emit):
+    # emits the current best summary after every decode step, returns the final one,
+    # whether the deadline cut it short and the seconds spent in each stage
+    with profile(profile_dir), metrics.record() as timings:
+        with metrics.time("acs_stage_seconds", stage="tokenize"):
+            data = get_features([Example(source=code, target=None)], tokenizer)
+        message, length = inference(data, model, tokenizer, on_partial=lambda active, texts: emit(texts[0]),
+                                    decoding=decoding, deadline=deadline, cancelled=cancelled)
+    return message[0], deadline_reached(deadline), timings
+
+def deadline_reached(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+def cancelled_by(*events):
+    # stops the beam search once every one of the events is set. Worker processes can't see the
+    # events of this process, their beam search always runs to the end.
+    if executor.mode != "thread":
+        return None
+    return lambda: all(event.is_set() for event in events)
+
+async def summarize_batch(decoding, items):
+    # items: (code, event set when nobody wants its summary anymore)
+    codes = [code for code, _ in items]
+    return await executor.run(summarize, codes, decoding, None, cancelled_by(*[cancel for _, cancel in items]))
+
+# Concurrent /summary requests with the same decoding settings are batched together before running the model.
+# ACS_BATCH_WINDOW_MS: how long to wait for more requests to join a batch.
+# ACS_MAX_BATCH_SIZE: the most requests run through the model at once.
+batch_window = float(os.environ.get("ACS_BATCH_WINDOW_MS", 10)) / 1000
+max_batch_size = int(os.environ.get("ACS_MAX_BATCH_SIZE", 16))
+# ACS_MAX_BATCHERS: the most decoding settings that keep a batcher of their own. The least recently used idle
+# batcher (other than the default settings' one) is dropped to make room for a new one. When none of them is
+# idle, requests with new settings aren't batched (see submit_summary).
+max_batchers = int(os.environ.get("ACS_MAX_BATCHERS", 8))
+# decoding settings -> batcher, created on first use, least recently used first
+batchers = collections.OrderedDict()
+
+def get_batcher(decoding):
+    # None when there are max_batchers batchers already and none of them can be dropped
+    key = tuple(sorted(decoding.items()))
+    if key in batchers:
+        batchers.move_to_end(key)
+        return batchers[key]
+    for old in list(batchers):
+        if len(batchers) < max_batchers:
+            break
+        if batchers[old] is not batcher and batchers[old].idle():
+            batchers.pop(old).close()
+    if len(batchers) >= max_batchers:
+        return None
+    batchers[key] = MicroBatcher(
+        functools.partial(summarize_batch, decoding),
+        window=batch_window,
+        max_batch_size=max_batch_size,
+        concurrency=executor.workers,
+        metrics=metrics,
     )
-    return model
+    return batchers[key]
 
-config = RobertaConfig.from_pretrained("microsoft/codebert-base")
-tokenizer = RobertaTokenizer.from_pretrained( "microsoft/codebert-base", do_lower_case=False)
+async def submit_summary(decoding, item):
+    # summary of item (see summarize_batch) batched with the requests of the same decoding settings, or in a
+    # batch of its own when there is no room for another batcher
+    batcher_ = get_batcher(decoding)
+    if batcher_ is None:
+        metrics.inc("acs_unbatched_total")
+        [message] = await summarize_batch(decoding, [item])
+        return message
+    return await batcher_.submit(item)
 
-model = build_model( model_class = RobertaModel, config = config, tokenizer = tokenizer).to('cpu')
+# Summaries are cached by code, model checkpoint, backend, dtype and decoding settings.
+# ACS_CACHE_SIZE: number of summaries kept in memory.
+# ACS_CACHE_PATH: sqlite file that keeps summaries across restarts (optional).
+summary_cache = SummaryCache(
+    capacity=int(os.environ.get("ACS_CACHE_SIZE", 4096)),
+    path=os.environ.get("ACS_CACHE_PATH"),
+    model_id=model_fingerprint(checkpoint, backend, dtype),
+)
+# set by load_model
+default_decoding = batcher = None
+# Concurrent /summary requests for the same code share one run, which is cancelled when all of them disconnect.
+in_flight = Coalescer()
 
-querymodel = api.load("glove-wiki-gigaword-300")
+# Sources longer than the model's input window are summarized in chunks, see /summary/long.
+# ACS_LONG_BATCH_SIZE: the most chunks run through the model at once.
+long_batch_size = int(os.environ.get("ACS_LONG_BATCH_SIZE", 64))
 
+def count_tokens(text):
+    return len(tokenizer.tokenize(text))
 
-def preprocess(s):
-    return [i.lower() for i in s.split()]
+# ACS_WARMUP: number of warm-up passes run before the server is ready (0: none). Every pass summarizes
+# one function and a full batch of functions of the server's own sources on each worker, so the first
+# requests don't pay for the first-call allocations and kernel selection.
+warmup_passes = int(os.environ.get("ACS_WARMUP", 1))
 
-def get_vector(s):
-    try:
-        result = np.sum(np.array([querymodel[i] for i in preprocess(s)]), axis=0)
-    except:
-        result = np.sum(np.array([querymodel[i] for i in preprocess("not valid")]), axis=0)
+def warm_up():
+    here = os.path.dirname(os.path.abspath(__file__))
+    codes = sample_sources(sorted(glob.glob(os.path.join(here, "*.py"))))[:max_batch_size]
+    for _ in range(warmup_passes):
+        futures = []
+        for _ in range(executor.workers):
+            futures.append(executor.submit(summarize, codes[:1], default_decoding))
+            futures.append(executor.submit(summarize, codes, default_decoding))
+        for future in futures:
+            future.result()
+
+startup_stages = {"model": load_model, "vectors": load_vectors, "warmup": warm_up}
+
+def run_stages(*names):
+    # runs the startup stages one after the other, a failed stage stops the ones after it
+    # (a stage's status is replaced as a whole, the health endpoints read it from other threads)
+    for name in names:
+        if stages[name]["status"] != "pending":
+            continue
+        stages[name] = {"status": "loading"}
+        start = time.perf_counter()
+        try:
+            startup_stages[name]()
+        except Exception as e:
+            print("Startup stage", name, "failed:", e)
+            stages[name] = {"status": "failed", "error": repr(e), "seconds": time.perf_counter() - start}
+            return
+        stages[name] = {"status": "ready", "seconds": time.perf_counter() - start}
 
-    return result
+def require(*names):
+    # 503 until the startup stages are ready, the language server retries those
+    for name in names:
+        status = stages[name]["status"]
+        if status != "ready":
+            raise HTTPException(status_code=503, detail="%s is %s" % (name, status))
+
+# the search endpoints run on FastAPI's thread pool
+index_lock = threading.Lock()
+# ACS_SEARCH_SHORTLIST: /index/query ranks only this many BM25 matches of the query by cosine (0: all of them).
+search_shortlist = int(os.environ.get("ACS_SEARCH_SHORTLIST", 256))
+
+# ACS_MAX_BEAM_SIZE: the largest beam a request can ask for, larger ones are cut down to it.
+max_beam_size = int(os.environ.get("ACS_MAX_BEAM_SIZE", 10))
 
 class Body(BaseModel):
     code: str
+    # decoding: "greedy" or "beam" (of beam_size beams), the model's own settings by default
+    # (a beam_size above ACS_MAX_BEAM_SIZE and a max_length above the model's are cut down to those)
+    strategy: Optional[str] = None
+    beam_size: Optional[int] = Field(None, ge=1)
+    max_length: Optional[int] = Field(None, ge=1)
+    length_penalty: Optional[float] = Field(None, allow_inf_nan=False)
+    early_stopping: bool = False
+    # latency budget: after this many milliseconds the best summary found so far is returned
+    deadline_ms: Optional[float] = Field(None, ge=0)
+
+def request_decoding(request):
+    # decoding settings and deadline of a /summary request
+    options = dict(request)
+    del options["code"]
+    try:
+        return request_settings(model, options, max_beam_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 class SearchBody(BaseModel):
     query: str
     document: str
 
-print("Hello")
-score = 1 - spatial.distance.cosine(get_vector("s"), get_vector("addNum"))
-print("score = ", score)
+class RankBody(BaseModel):
+    query: Optional[str] = None
+    queries: Optional[List[str]] = None
+    documents: List[str]
+    top_k: Optional[int] = Field(None, ge=1)
+
+# workspace: id picked by the client, each workspace has an index of its own
+class IndexUpdateBody(BaseModel):
+    workspace: str = ""
+    file: str
+    definitions: Dict[str, str]
+    replace: bool = True
+
+class IndexQueryBody(BaseModel):
+    workspace: str = ""
+    query: str
+    top_k: Optional[int] = Field(None, ge=1)
+    files: Optional[List[str]] = None
 
 # using fast api
 app = FastAPI()
 
+@app.on_event("startup")
+def startup():
+    # the model (then the warm-up) and the word vectors load at the same time, the server answers meanwhile
+    threading.Thread(target=run_stages, args=("model", "warmup"), daemon=True).start()
+    threading.Thread(target=run_stages, args=("vectors",), daemon=True).start()
+
+def ready():
+    return all(stage["status"] == "ready" for stage in stages.values())
+
 # Define endpoints
 
 @app.get('/')
 def main():
-	return {"message": "success"}
+    if not ready():
+        return JSONResponse({"message": "starting", "stages": stages}, status_code=503)
+    return {"message": "success"}
+
+# Endpoint '/health/live'
+# the process is up and answering, 500 once a startup stage failed (it has to be restarted)
+@app.get('/health/live')
+def health_live():
+    failed = [name for name, stage in stages.items() if stage["status"] == "failed"]
+    if failed:
+        return JSONResponse({"status": "failed", "stages": failed}, status_code=500)
+    return {"status": "alive"}
+
+# Endpoint '/health/ready'
+# 200 once the model and word vectors are loaded and warmed up, 503 before. Reports every stage,
+# its status and the seconds it took.
+@app.get('/health/ready')
+def health_ready():
+    return JSONResponse({"ready": ready(), "stages": stages}, status_code=200 if ready() else 503)
+
+async def unless_disconnected(connection, awaitable):
+    # result of awaitable, which is cancelled if the client disconnects first
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait([task], timeout=0.1)
+        if done:
+            return task.result()
+        if await connection.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Client closed request")
+
+async def summarize_deadline(code, decoding, deadline, cancel):
+    [message] = await executor.run(summarize, [code], decoding, deadline, cancelled_by(cancel))
+    return message
 
 # Endpoint '/summary'
-# Generates Summary
+# Generates Summary, with the decoding settings that were used and the model_id of the model (see cache.model_fingerprint).
+# Requests with a deadline run on their own instead of waiting for a batch, and summaries cut
+# short by the deadline are not cached. Identical requests in flight share one run, and the beam
+# search stops once every client waiting for it has disconnected.
 @app.post('/summary')
-async def summary( request:Body ):
-    example = [Example(source=request.code, target=None)] 
-    message, length = inference(get_features(example, tokenizer), model, tokenizer)
-    return {"summary": message[0]}
+async def summary( request:Body, connection:Request ):
+    require("model")
+    decoding, deadline = request_decoding(request)
+    reached = False
+    start_time = time.perf_counter()
+    message = await summary_cache.get_async(request.code, **decoding)
+    if message is None:
+        key = (summary_cache.key(request.code, **decoding), deadline)
+        if deadline is None:
+            start = lambda cancel: submit_summary(decoding, (request.code, cancel))
+        else:
+            start = lambda cancel: summarize_deadline(request.code, decoding, deadline, cancel)
+        message = await unless_disconnected(connection, in_flight.run(key, start))
+        reached = deadline_reached(deadline)
+        if not reached:
+            summary_cache.put(request.code, message, **decoding)
+    metrics.observe("acs_request_seconds", time.perf_counter() - start_time, endpoint="/summary")
+    return {"summary": message, "decoding": dict(decoding, deadline_reached=reached),
+            "model_id": summary_cache.model_id}
+
+# Endpoint '/summary/long'
+# Summarizes a source of any length, e.g. a whole file: it is split into chunks that fit the model
+# along ast boundaries (functions, classes, groups of statements), the chunks that aren't cached are
+# summarized together in one batch (of at most ACS_LONG_BATCH_SIZE), and the result is an outline of
+# the chunk summaries, indented by class. Takes the same body as /summary.
+@app.post('/summary/long')
+async def summary_long( request:Body ):
+    require("model")
+    decoding, deadline = request_decoding(request)
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, split_source, request.code, count_tokens)
+    summaries = await asyncio.gather(*[summary_cache.get_async(chunk.source, **decoding) for chunk in chunks])
+    missing = [i for i, message in enumerate(summaries) if message is None]
+    batches = [missing[i:i + long_batch_size] for i in range(0, len(missing), long_batch_size)]
+    results = await asyncio.gather(*[
+        executor.run(summarize, [chunks[i].source for i in batch], decoding, deadline, None)
+        for batch in batches
+    ])
+    reached = deadline_reached(deadline)
+    for batch, messages in zip(batches, results):
+        for i, message in zip(batch, messages):
+            summaries[i] = message
+            if not reached:
+                summary_cache.put(chunks[i].source, message, **decoding)
+    return {
+        "summary": outline(chunks, summaries) if chunks else "",
+        "chunks": [
+            {"name": chunk.name, "start": chunk.start, "end": chunk.end, "summary": message}
+            for chunk, message in zip(chunks, summaries)
+        ],
+        "decoding": dict(decoding, deadline_reached=reached),
+        "model_id": summary_cache.model_id,
+    }
+
+# Endpoint '/summary/stream'
+# Generates Summary, streamed as server-sent events: the current best summary after every decode step
+# ({"summary": ..., "done": false}), then the final summary ({"summary": ..., "done": true, "decoding": ...,
+# "timings": ..., "model_id": ...}), timings are the seconds spent in each stage of the model run (empty when cached).
+@app.post('/summary/stream')
+async def summary_stream( request:Body ):
+    require("model")
+    decoding, deadline = request_decoding(request)
+    async def events():
+        reached = False
+        timings = {}
+        start_time = time.perf_counter()
+        message = await summary_cache.get_async(request.code, **decoding)
+        if message is None:
+            # set when the stream ends, which stops the beam search if the client went away early
+            cancel = threading.Event()
+            try:
+                stream = executor.stream(summarize_streaming, request.code, decoding, deadline, cancel.is_set)
+                async for item in stream:
+                    if isinstance(item, str):
+                        yield "data: %s\n\n" % json.dumps({"summary": item, "done": False})
+                    else:
+                        message, reached, timings = item
+            finally:
+                cancel.set()
+            if not reached:
+                summary_cache.put(request.code, message, **decoding)
+        result = {"summary": message, "done": True, "decoding": dict(decoding, deadline_reached=reached),
+                  "timings": timings, "model_id": summary_cache.model_id}
+        metrics.observe("acs_request_seconds", time.perf_counter() - start_time, endpoint="/summary/stream")
+        yield "data: %s\n\n" % json.dumps(result)
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# Endpoint '/stats'
+# queue depth and batch sizes of the /summary batcher, busy workers, summary cache and token id cache hits
+@app.get('/stats')
+def stats():
+    if stages["model"]["status"] != "ready":
+        return {"stages": stages, "cache": summary_cache.stats()}
+    return {
+        **batcher.stats(),
+        "batchers": len(batchers),
+        "in_flight": in_flight.stats(),
+        "executor": executor.stats(),
+        "cache": summary_cache.stats(),
+        "tokenizer": tokenizer.stats(),
+        "stages": stages,
+    }
+
+# Endpoint '/metrics'
+# stage timers (tokenize, encoder, decoder, beam, detokenize), decode step and early stop counters,
+# batch sizes, queue wait and cache hits, in the Prometheus text format. Runs on the event loop, which is
+# where the batchers are created and dropped.
+@app.get('/metrics', response_class=PlainTextResponse)
+async def prometheus_metrics():
+    cache = summary_cache.stats()
+    metrics.set("acs_cache_hits_total", cache["hits"], kind="counter", cache="summary", tier="memory")
+    metrics.set("acs_cache_hits_total", cache["disk_hits"], kind="counter", cache="summary", tier="disk")
+    metrics.set("acs_cache_misses_total", cache["misses"], kind="counter", cache="summary")
+    for name, stage in stages.items():
+        metrics.set("acs_startup_seconds", stage.get("seconds", 0), stage=name)
+        metrics.set("acs_ready", int(stage["status"] == "ready"), stage=name)
+    if stages["model"]["status"] == "ready":
+        tokens = tokenizer.stats()
+        metrics.set("acs_cache_hits_total", tokens["hits"], kind="counter", cache="tokenizer", tier="memory")
+        metrics.set("acs_cache_misses_total", tokens["misses"], kind="counter", cache="tokenizer")
+        metrics.set("acs_running_batches", executor.stats()["running"])
+    metrics.set("acs_queue_depth", sum(b.stats()["queue_depth"] for b in batchers.values()))
+    metrics.set("acs_coalesced_total", in_flight.stats()["coalesced"], kind="counter")
+    return metrics.render()
+
+# The search endpoints are plain functions, FastAPI runs them on its thread pool instead of the event loop.
 
 # Endpoint '/search'
 # returns the cosine between the vector representations of (query -> is the search string, document -> is the description)
 @app.post('/search')
-async def search( request:SearchBody ):
+def search( request:SearchBody ):
+    require("vectors")
     query = str(request.query)
     d = str(request.document)
     score = 1 - spatial.distance.cosine(get_vector(query), get_vector(d))
     return {"score": str(score) }
 
+# Endpoint '/search/rank'
+# scores one query (or many queries) against a list of documents in one call.
+# For every query, returns the indices of the top_k best matching documents and their cosine scores, best first.
+@app.post('/search/rank')
+def search_rank( request:RankBody ):
+    require("vectors")
+    if request.query is None and request.queries is None:
+        raise HTTPException(status_code=422, detail="Either query or queries is required")
+    queries = request.queries if request.queries is not None else [request.query]
+    if not request.documents:
+        return {"results": [{"indices": [], "scores": []} for _ in queries]}
+    indices, scores = rank(
+        np.stack([get_vector(str(q)) for q in queries]),
+        np.stack([get_vector(str(d)) for d in request.documents]),
+        request.top_k,
+    )
+    return {"results": [{"indices": i.tolist(), "scores": s.tolist()} for i, s in zip(indices, scores)]}
+
+# Endpoint '/index/update'
+# updates the descriptions of one file in the index of the workspace, only changed descriptions are embedded again.
+# 413 if the workspace alone would hold more than ACS_INDEX_MAX_SIZE descriptions.
+@app.post('/index/update')
+def index_update( request:IndexUpdateBody ):
+    require("vectors")
+    with index_lock:
+        try:
+            changed = description_indexes.update_file(request.workspace, request.file, request.definitions,
+                                                      request.replace)
+        except IndexFull as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        return {"changed": changed, "size": len(description_indexes.get(request.workspace))}
+
+# Endpoint '/index/query'
+# returns the top_k descriptions of the index of the workspace closest to the query (optionally only among those of the given files),
+# and the files that are not in the index. Only the descriptions sharing a word with the query (by BM25, over the
+# split symbol names and descriptions) are ranked, unless fewer than top_k do.
+@app.post('/index/query')
+def index_query( request:IndexQueryBody ):
+    require("vectors")
+    vector = get_vector(str(request.query))
+    with index_lock:
+        index = description_indexes.get(request.workspace)
+        if index is None:
+            results, missing = [], list(request.files or [])
+        else:
+            results = index.query(vector, request.top_k, request.files, text=request.query,
+                                  shortlist=search_shortlist)
+            missing = [file for file in request.files or [] if file not in index.files]
+    return {
+        "results": [
+            {"file": file, "symbol": symbol, "description": description, "score": score}
+            for file, symbol, description, score in results
+        ],
+        "missing": missing,
+    }
+
+@app.on_event("shutdown")
+def shutdown():
+    summary_cache.flush()
+    if executor is not None:
+        executor.shutdown()
+    if index_path and description_indexes is not None:
+        with index_lock:
+            description_indexes.save(index_path)
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=3000)
@@ -1,89 +1,355 @@
-from urllib.request import pathname2url
 from pygls.server import LanguageServer
 import os
 import os.path
-import requests
+import logging
+import time
+import uuid
 
-import os
-import json
-from transformers import RobertaConfig, RobertaModel, RobertaTokenizer
-from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
+from .batching import Coalescer
+from .cache import SummaryCache
+from .endpoint import EndpointClient
+from .local import LocalSummarizer
+from .metrics import log_event
+from .workspace import SummaryQueue
+
+try:
+    from lsprotocol.types import WorkDoneProgressBegin, WorkDoneProgressReport, WorkDoneProgressEnd
+    from lsprotocol.types import TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_CHANGE, TEXT_DOCUMENT_DID_CLOSE
+except ImportError:
+    # pygls < 1.0
+    from pygls.lsp.types import WorkDoneProgressBegin, WorkDoneProgressReport, WorkDoneProgressEnd
+    from pygls.lsp.methods import TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_CHANGE, TEXT_DOCUMENT_DID_CLOSE
 
-import torch
-import torch.nn as nn
 
-from scipy import spatial
-import gensim.downloader as api
-import numpy as np
+# Timings of summaries and searches are logged (to pygls.log) as one JSON object per line.
+logger = logging.getLogger(__name__)
 
 
 # Python Lanuage Server Initialization
 class PythonLanguageServer(LanguageServer):
     GET_SEARCH_RESULTS = 'ACS-python.getSearchResults'
     FETCH_SUMMARY = 'ACS-python.fetchSummary'
+    PRIORITIZE_SUMMARIES = 'ACS-python.prioritizeSummaries'
+    # notification sent when the summary of a changed function is ready
+    SUMMARY_READY = 'ACS-python/summaryReady'
+    BACKENDS = ('local', 'remote', 'auto')
 
     def __init__(self):
         super().__init__()
+        # ACS_LSP_BACKEND: where summaries and searches run, "remote" (the hosted endpoint),
+        # "local" (the model loaded in this process) or "auto" (local when the model is there)
+        self.backend = os.environ.get("ACS_LSP_BACKEND", "remote")
+        if self.backend not in self.BACKENDS:
+            raise ValueError("Unknown backend %r, expected one of %s" % (self.backend, ", ".join(self.BACKENDS)))
+
+    def useLocal(self):
+        if self.backend == "auto":
+            return local.available()
+        return self.backend == "local"
 
 
 # Start the server
 server = PythonLanguageServer()
 
+# Summaries already fetched, so repeated requests for the same function body
+# don't go to the endpoint again. ACS_LSP_CACHE_PATH keeps them across restarts.
+summary_cache = SummaryCache(
+    capacity=int(os.environ.get("ACS_CACHE_SIZE", 4096)),
+    path=os.environ.get("ACS_LSP_CACHE_PATH"),
+)
+
+# One pooled client for every call to the hosted endpoint.
+# ACS_ENDPOINT_URL: base URL of the summary server.
+# ACS_HTTP_MAX_CONNECTIONS, ACS_HTTP_TIMEOUT (seconds), ACS_HTTP_RETRIES and
+# ACS_HTTP_PARALLEL (calls in flight at once): see EndpointClient.
+endpoint = EndpointClient(
+    os.environ.get("ACS_ENDPOINT_URL", "http://ec2-35-154-160-245.ap-south-1.compute.amazonaws.com:3000"),
+    max_connections=int(os.environ.get("ACS_HTTP_MAX_CONNECTIONS", 10)),
+    timeout=float(os.environ.get("ACS_HTTP_TIMEOUT", 10)),
+    retries=int(os.environ.get("ACS_HTTP_RETRIES", 2)),
+    parallel=int(os.environ.get("ACS_HTTP_PARALLEL", 8)),
+)
+
+# The model for the "local" and "auto" backends, loaded on first use.
+# ACS_LSP_CHECKPOINT: weights of the model, ACS_VECTORS_PATH, ACS_BACKEND, ACS_LOW_MEMORY and
+# ACS_DTYPE and ACS_SEARCH_SHORTLIST as for run.py.
+local = LocalSummarizer(
+    os.environ.get("ACS_LSP_CHECKPOINT", "pytorch_model.bin"),
+    os.environ.get("ACS_VECTORS_PATH", "glove-wiki-gigaword-300.vectors"),
+    backend=os.environ.get("ACS_BACKEND", "eager"),
+    low_memory=bool(os.environ.get("ACS_LOW_MEMORY")),
+    dtype=os.environ.get("ACS_DTYPE", "float32"),
+    shortlist=int(os.environ.get("ACS_SEARCH_SHORTLIST", 256)),
+)
+
 
 @server.command(PythonLanguageServer.GET_SEARCH_RESULTS)
-def getSearchResults(ls: PythonLanguageServer, *args):
+async def getSearchResults(ls: PythonLanguageServer, *args):
     definitions = args[0][1]
-    results = getResults(definitions, args[0][2])
+    # the file each definition comes from (older clients don't send them)
+    if len(args[0]) > 3:
+        locations = args[0][3]
+    else:
+        locations = [args[0][0]] * (len(definitions) // 2)
+    results = await getResults(ls, definitions, args[0][2], locations)
     return results
 
 
 @server.command(PythonLanguageServer.FETCH_SUMMARY)
-def computeSummary(ls: PythonLanguageServer, *args):
-    # The URL for the hosted endpoint
-    URL = "http://ec2-35-154-160-245.ap-south-1.compute.amazonaws.com:3000/summary"
-    PARAMS = {'code': args[0][0]}
-    # post a request to the url, with params,
+async def computeSummary(ls: PythonLanguageServer, *args):
+    code = args[0][0]
+    # optional decoding options: strategy, beam_size, max_length, length_penalty,
+    # early_stopping and deadline_ms, see the /summary endpoint
+    options = {}
+    if len(args[0]) > 1 and isinstance(args[0][1], dict):
+        options = args[0][1]
+    # show the partial summaries as progress notifications while the model is still decoding,
+    # cached summaries are answered without one
+    token = str(uuid.uuid4())
+    progress = False
     try:
-        print("before requesting")
-        response = requests.post(url=URL, json=PARAMS)
-        print("response = ", response)
-        # reponse contains the summary
-        j = json.loads(response.text)
-        summary = j["summary"]
+        summary = await cachedSummary(ls, code, options)
+        if summary is not None:
+            return summary
+        progress = await beginProgress(ls, token, "Summarizing")
+        report = None
+        if progress:
+            report = lambda partial: ls.progress.report(token, WorkDoneProgressReport(message=partial))
+        return await getSummary(ls, code, options, report)
+    except Exception:
+        logger.exception("Exception occured")
+    finally:
+        if progress:
+            ls.progress.end(token, WorkDoneProgressEnd())
+
+
+# Asks the client to create the progress token and waits for it to accept, progress notifications for a
+# token the client hasn't created yet are dropped. Returns whether the progress has begun.
+async def beginProgress(ls, token, title):
+    try:
+        await ls.progress.create_async(token)
+    except Exception as e:
+        logger.warning("The client didn't create the progress token: %s", e)
+        return False
+    ls.progress.begin(token, WorkDoneProgressBegin(title=title))
+    return True
+
+
+# Summaries being computed, identical requests share one and it is cancelled once none of them
+# wants it anymore (e.g. after $/cancelRequest, which cancels the command's task).
+summary_requests = Coalescer()
+
+
+# summary of the code with the backend of the server, report (optional) is called with the partial summaries
+async def getSummary(ls, code, options=None, report=None):
+    options = options or {}
+    key = summary_cache.key(code, **options)
+    return await summary_requests.run(key, lambda cancel: runSummary(ls, code, options, report, cancel))
+
+
+async def runSummary(ls, code, options, report, cancel):
+    if ls.useLocal():
+        try:
+            return await localSummary(code, options, report, cancel)
+        except Exception as e:
+            if ls.backend == "local":
+                raise
+            logger.warning("Local summary failed, using the endpoint: %s", e)
+    return await remoteSummary(code, options, report)
+
+
+# the cached summary of the code from the backend that would summarize it, None when the model has to run
+async def cachedSummary(ls, code, options):
+    start = time.perf_counter()
+    if ls.useLocal():
+        backend = "local"
+        summary = await summary_cache.get_async(code, url=local.model_id, **options)
+    elif endpointModel is not None and time.monotonic() - endpointModelSeen < modelCheck:
+        backend = "remote"
+        summary = await summary_cache.get_async(code, url=endpoint.url + "/summary", model=endpointModel, **options)
+    else:
+        return None
+    if summary is not None:
+        log_event(logger, "summary", backend=backend, cached=True, seconds=time.perf_counter() - start)
+    return summary
+
+
+# summarizes with the model loaded in this process, the beam search stops once cancel is set
+async def localSummary(code, options, report, cancel):
+    start = time.perf_counter()
+    summary = await summary_cache.get_async(code, url=local.model_id, **options)
+    if summary is not None:
+        log_event(logger, "summary", backend="local", cached=True, seconds=time.perf_counter() - start)
         return summary
-    except:
-        print("Exception occured")
+    summary, decoding, timings = await local.run(local.summarize, code, options, report, cancel.is_set)
+    log_event(logger, "summary", backend="local", cached=False, seconds=time.perf_counter() - start,
+              timings=timings, decoding=decoding)
+    # summaries cut short by the deadline are not cached
+    if not decoding["deadline_reached"]:
+        summary_cache.put(code, summary, url=local.model_id, **options)
+    return summary
 
 
-# returns vectors for a word using the gensim model
-def get_vector(model, s):
-    return np.sum(np.array([model[i] for i in preprocess(s)]), axis=0)
+# model_id of the model the endpoint last answered with, its summaries are cached under it so that they
+# are not used anymore once the endpoint runs another model. None until the endpoint told it.
+# ACS_LSP_MODEL_CHECK: seconds the model_id is trusted, the next summary after that goes to the
+# endpoint (which answers from its own cache) to learn it again.
+endpointModel = None
+endpointModelSeen = 0
+modelCheck = float(os.environ.get("ACS_LSP_MODEL_CHECK", 60))
 
-# convert the words into lower case
 
+# summarizes with the streaming endpoint of the hosted server
+async def remoteSummary(code, options, report):
+    global endpointModel, endpointModelSeen
+    URL = endpoint.url + "/summary"
+    start = time.perf_counter()
+    if endpointModel is not None and time.monotonic() - endpointModelSeen < modelCheck:
+        summary = await summary_cache.get_async(code, url=URL, model=endpointModel, **options)
+        if summary is not None:
+            log_event(logger, "summary", backend="remote", cached=True, seconds=time.perf_counter() - start)
+            return summary
+    PARAMS = {'code': code, **options}
+    first = None
+    final = None
+    # every event is {"summary": ..., "done": ...}, the last one is done and has the decoding settings
+    async for j in endpoint.events("/summary/stream", PARAMS):
+        if first is None:
+            first = time.perf_counter() - start
+        if j["done"]:
+            final = j
+            break
+        if report is not None:
+            report(j["summary"])
+    if final is None:
+        raise RuntimeError("The summary stream of the endpoint ended before the summary was done")
+    summary = final["summary"]
+    # timings are the stages of the model run on the endpoint
+    log_event(logger, "summary", backend="remote", cached=False, seconds=time.perf_counter() - start,
+              first_event_seconds=first, timings=final.get("timings", {}), decoding=final["decoding"])
+    # summaries cut short by the deadline, and those of endpoints that don't tell their model, are not cached
+    endpointModel = final.get("model_id")
+    endpointModelSeen = time.monotonic()
+    if endpointModel is not None and not final["decoding"]["deadline_reached"]:
+        summary_cache.put(code, summary, url=URL, model=endpointModel, **options)
+    return summary
 
-def preprocess(s):
-    return [i.lower() for i in s.split()]
 
+# sends the summary of a changed function to the client
+def summaryReady(uri, function, summary):
+    server.send_notification(PythonLanguageServer.SUMMARY_READY, {
+        'uri': uri,
+        'name': function.name.split('.')[-1],
+        'line': function.start,
+        'summary': summary,
+    })
 
-def getResults(definitions, searchQuery):
-    # The URL for the hosted endpoint
-    URL = "http://ec2-35-154-160-245.ap-south-1.compute.amazonaws.com:3000/search"
-    results = []
+
+# Functions of the open documents, summarized in the background when their body changes.
+# ACS_SUMMARY_DELAY: seconds a function must be left alone before it is summarized again.
+summary_queue = SummaryQueue(
+    lambda code: getSummary(server, code),
+    summaryReady,
+    delay=float(os.environ.get("ACS_SUMMARY_DELAY", 1.0)),
+)
+
+
+@server.feature(TEXT_DOCUMENT_DID_OPEN)
+def didOpen(ls: PythonLanguageServer, params):
+    uri = params.text_document.uri
+    summary_queue.open(uri, ls.workspace.get_document(uri).source)
+
+
+@server.feature(TEXT_DOCUMENT_DID_CHANGE)
+def didChange(ls: PythonLanguageServer, params):
+    uri = params.text_document.uri
+    # lines of the new text touched by the change, the functions there are the ones being edited
+    changed = []
+    for change in params.content_changes:
+        if getattr(change, 'range', None) is not None:
+            first = change.range.start.line
+            changed.append((first, first + change.text.count("\n")))
+    summary_queue.update(uri, ls.workspace.get_document(uri).source, changed)
+
+
+@server.feature(TEXT_DOCUMENT_DID_CLOSE)
+def didClose(ls: PythonLanguageServer, params):
+    summary_queue.close(params.text_document.uri)
+
+
+# summarizes the given functions of a document first (e.g. the hovered one)
+@server.command(PythonLanguageServer.PRIORITIZE_SUMMARIES)
+def prioritizeSummaries(ls: PythonLanguageServer, *args):
+    uri, names = args[0][0], args[0][1]
+    documentNames = summary_queue.documents.get(uri, {})
+    summary_queue.prioritize(uri, [name for name in documentNames if name.split('.')[-1] in names])
+
+
+# descriptions of each file as last sent to the index of the hosted endpoint
+indexedFiles = {}
+# the endpoint keeps one index per workspace, so clients with files of the same name don't overwrite each other
+workspaceId = str(uuid.uuid4())
+
+
+# sends the descriptions of the files that changed since they were last indexed, in parallel
+async def updateIndex(files):
+    changed = [file for file, fileDefinitions in files.items() if indexedFiles.get(file) != fileDefinitions]
+    PARAMS = [{'workspace': workspaceId, 'file': file, 'definitions': files[file]} for file in changed]
+    start = time.perf_counter()
+    await endpoint.gather("/index/update", PARAMS)
+    if changed:
+        log_event(logger, "index_update", seconds=time.perf_counter() - start, files=len(changed))
+    for file in changed:
+        indexedFiles[file] = files[file]
+
+
+# ranks the descriptions of the files against the query with the index of the hosted endpoint
+async def remoteMatches(files, searchQuery):
+    await updateIndex(files)
+    # only the file names go with the query, the endpoint already holds their descriptions
+    PARAMS = {'workspace': workspaceId, 'query': searchQuery, 'top_k': 4, 'files': list(files)}
+    response = await endpoint.post("/index/query", PARAMS)
+    if response["missing"]:
+        # the endpoint lost part of its index (e.g. it restarted or dropped the workspace), index those files again
+        for file in response["missing"]:
+            indexedFiles.pop(file, None)
+        await updateIndex(files)
+        response = await endpoint.post("/index/query", PARAMS)
+    return response["results"]
+
+
+async def getResults(ls, definitions, searchQuery, locations):
+    # group the function descriptions by file, the index on the endpoint is keyed by [file, function name]
+    files = {}
     for i in range(0, len(definitions), 2):
-        functionDescription = definitions[i+1]
-        PARAMS = {'query': searchQuery, 'document': functionDescription}
-        try:
-            response = requests.post(url=URL, json=PARAMS)
-            # match score between query string and the description
-            descriptionScore = json.loads(response.text)
-            descriptionScore = float(descriptionScore["score"])
-        except:
-            descriptionScore = 0
+        file = locations[i // 2]
+        files.setdefault(file, {})[definitions[i]] = definitions[i+1]
 
-        finalScore = descriptionScore
-        # store the description and the corresponding score
-        results.append([finalScore, i])
+    results = []
+    try:
+        start = time.perf_counter()
+        matches = None
+        if ls.useLocal():
+            try:
+                matches = await local.run(local.search, files, searchQuery, 4)
+                backend = "local"
+            except Exception as e:
+                if ls.backend == "local":
+                    raise
+                logger.warning("Local search failed, using the endpoint: %s", e)
+        if matches is None:
+            matches = await remoteMatches(files, searchQuery)
+            backend = "remote"
+        log_event(logger, "search", backend=backend, seconds=time.perf_counter() - start,
+                  functions=len(definitions) // 2, files=len(files), matches=len(matches))
+        for match in matches:
+            # match score between query string and the description
+            descriptionScore = match["score"]
+            finalScore = descriptionScore
+            # store the function name, its description and the corresponding score
+            results.append([finalScore, match["symbol"], match["description"]])
+    except Exception:
+        logger.exception("Exception occured")
 
     # sort the results based on the score
     results.sort(key=lambda x: -x[0])
@@ -96,8 +362,8 @@ def getResults(definitions, searchQuery):
         if(count == 4):
             break
         if(i[0] > 0.4):
-            sortedDefinitions.append(definitions[i[1]])
-            sortedDefinitions.append(definitions[i[1]+1])
+            sortedDefinitions.append(i[1])
+            sortedDefinitions.append(i[2])
             count += 1
 
     return sortedDefinitions
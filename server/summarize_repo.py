@@ -0,0 +1,275 @@
+# Summarizes every function of a source tree offline, e.g. to pre-generate
+# docstrings overnight, and writes one JSON object per function:
+#
+#     python summarize_repo.py path/to/repo --out summaries.jsonl
+#
+# Functions are summarized in batches on a pool of worker processes, which
+# each load the model with the checkpoint memory-mapped. Every batch is
+# appended to the output as soon as it is done, so an interrupted run picks
+# up where it stopped when started again with the same --out.
+import argparse
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import time
+
+from executor import InferenceExecutor
+from pipeline import get_features, inference
+from utils import Example
+from workspace import functions
+
+# Directories never walked into.
+SKIP_DIRS = frozenset(
+    ["__pycache__", "node_modules", "site-packages", "venv", "build", "dist"]
+)
+
+# The model and settings of a worker process, set by `_load`.
+_state = {}
+
+
+def python_files(root):
+    "Paths of the python files under `root`, skipping hidden and build directories."
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(
+            d for d in dirs if not d.startswith(".") and d not in SKIP_DIRS
+        )
+        for name in sorted(files):
+            if name.endswith(".py"):
+                yield os.path.join(directory, name)
+
+
+def extract(path, root):
+    """
+    Every function and method of the file `path` (see workspace.functions),
+    as dicts with the `file` (relative to `root`), the dotted `name`, the
+    0-based `start` and `end` lines, the `source` and the `hash` of the
+    normalized source. Raises SyntaxError for files that can't be parsed,
+    and UnicodeDecodeError for files that aren't utf-8.
+    """
+    with open(path, encoding="utf-8") as f:
+        found = functions(f.read())
+    if found is None:
+        raise SyntaxError("invalid syntax")
+    file = os.path.relpath(path, root)
+    return [dict(file=file, **function._asdict()) for function in found]
+
+
+def resume(path):
+    """
+    The (file, name, hash) of every function already written to the JSONL
+    file `path`. A last line cut short by an interrupted run is removed.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        valid = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            done.add((record["file"], record["name"], record["hash"]))
+            valid += len(line)
+        f.truncate(valid)
+    return done
+
+
+def batches(sources, batch_size):
+    """
+    The keys of `sources` (key -> source) in batches of `batch_size`, sorted
+    by the length of their source first so that each batch pads its sources
+    to about the same length.
+    """
+    order = sorted(sources, key=lambda key: len(sources[key]))
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def _load(checkpoint, backend, dtype, strategy, beam_size, max_length):
+    from transformers import RobertaConfig, RobertaModel
+
+    from pipeline import build_model, decoding_settings
+    from tokenization import CodeTokenizer
+
+    config = RobertaConfig.from_pretrained("microsoft/codebert-base")
+    tokenizer = CodeTokenizer("microsoft/codebert-base")
+    model = build_model(
+        RobertaModel,
+        config,
+        tokenizer,
+        checkpoint,
+        backend=backend,
+        low_memory=True,
+        dtype=dtype,
+    )
+    decoding = decoding_settings(model, strategy, beam_size, max_length)
+    _state.update(model=model, tokenizer=tokenizer, decoding=decoding)
+
+
+def _decoding():
+    return _state["decoding"]
+
+
+def _summarize(codes):
+    examples = [Example(source=code, target=None) for code in codes]
+    data = get_features(examples, _state["tokenizer"])
+    summaries, _ = inference(
+        data, _state["model"], _state["tokenizer"], decoding=_state["decoding"]
+    )
+    return summaries
+
+
+def main():
+    from backends import BACKENDS
+    from pipeline import DTYPES
+
+    parser = argparse.ArgumentParser(
+        description="Summarize every function of a source tree into a JSONL file."
+    )
+    parser.add_argument("root", help="Directory whose python files are summarized")
+    parser.add_argument("--out", default="summaries.jsonl")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Start over instead of resuming from the functions already in --out",
+    )
+    parser.add_argument("--checkpoint", default="pytorch_model.bin")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="float32")
+    parser.add_argument("--strategy", choices=["greedy", "beam"], default=None)
+    parser.add_argument("--beam-size", type=int, default=None)
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=None,
+        help="torch intra-op threads per worker "
+        "(default: the cores split between the workers)",
+    )
+    parser.add_argument(
+        "--report-every",
+        type=float,
+        default=10,
+        help="Seconds between progress reports",
+    )
+    args = parser.parse_args()
+
+    # Identical functions (after normalization) are summarized once.
+    functions = {}
+    total = failed = 0
+    for path in python_files(args.root):
+        try:
+            found = extract(path, args.root)
+        except (SyntaxError, UnicodeDecodeError, OSError) as e:
+            print("Skipping %s: %s" % (path, e), file=sys.stderr)
+            failed += 1
+            continue
+        for function in found:
+            functions.setdefault(function["hash"], []).append(function)
+            total += 1
+    if args.restart and os.path.exists(args.out):
+        os.remove(args.out)
+    done = resume(args.out)
+    pending = {
+        digest: [f for f in group if (f["file"], f["name"], digest) not in done]
+        for digest, group in functions.items()
+    }
+    pending = {digest: group for digest, group in pending.items() if group}
+    remaining = sum(len(group) for group in pending.values())
+    print(
+        "%d functions in %s (%d files skipped), %d already summarized, %d to go"
+        % (total, args.root, failed, total - remaining, remaining),
+        file=sys.stderr,
+    )
+    if not pending:
+        return
+
+    # Only the workers load the model.
+    pool = InferenceExecutor(
+        workers=args.workers,
+        mode="process",
+        torch_threads=args.torch_threads,
+        load=functools.partial(
+            _load,
+            args.checkpoint,
+            args.backend,
+            args.dtype,
+            args.strategy,
+            args.beam_size,
+            args.max_length,
+        ),
+    )
+    decoding = pool.submit(_decoding).result()
+
+    start = last_report = time.perf_counter()
+    written = 0
+    sources = {digest: group[0]["source"] for digest, group in pending.items()}
+    todo = iter(batches(sources, args.batch_size))
+    # future -> the keys of its batch
+    running = {}
+    try:
+        with open(args.out, "a", encoding="utf-8") as out:
+            while True:
+                # two batches per worker in flight, so no worker waits for the next one
+                while len(running) < 2 * args.workers:
+                    batch = next(todo, None)
+                    if batch is None:
+                        break
+                    codes = [sources[k] for k in batch]
+                    running[pool.submit(_summarize, codes)] = batch
+                if not running:
+                    break
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    batch = running.pop(future)
+                    for digest, summary in zip(batch, future.result()):
+                        for function in pending[digest]:
+                            record = dict(function, summary=summary)
+                            del record["source"]
+                            out.write(json.dumps(record) + "\n")
+                            written += 1
+                # every finished batch is on disk before the next report
+                out.flush()
+                now = time.perf_counter()
+                if now - last_report >= args.report_every:
+                    last_report = now
+                    rate = written / (now - start)
+                    print(
+                        "%d/%d functions, %.1f functions/sec, %.0fs left"
+                        % (written, remaining, rate, (remaining - written) / rate),
+                        file=sys.stderr,
+                    )
+    finally:
+        pool.shutdown()
+    seconds = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "functions": written,
+                "unique": len(pending),
+                "seconds": round(seconds, 3),
+                "functions_per_sec": round(written / seconds, 2),
+                "workers": args.workers,
+                "torch_threads": pool.torch_threads,
+                "batch_size": args.batch_size,
+                "decoding": decoding,
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
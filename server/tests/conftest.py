@@ -0,0 +1,69 @@
+import collections
+import os
+import sys
+import time
+
+import pytest
+
+# The modules of the server are imported as top-level modules, the way run.py
+# (which runs from the server directory) imports them.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import SyntheticTokenizer, synthetic_vectors, tiny_model  # noqa: E402
+
+
+class Tokenizer(SyntheticTokenizer):
+    def __init__(self):
+        super().__init__(1000)
+
+    def stats(self):
+        return {"hits": 0, "misses": 0}
+
+
+@pytest.fixture(scope="session")
+def word_vectors(tmp_path_factory):
+    "Directory of a word vector store of random words (see bench.WORDS)."
+    path = str(tmp_path_factory.mktemp("vectors") / "store")
+    synthetic_vectors(path, 500)
+    return path
+
+
+def start(run, timeout=60):
+    "Wait until every startup stage of `run` is done, or one failed."
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        statuses = [stage["status"] for stage in run.stages.values()]
+        if "failed" in statuses or all(status == "ready" for status in statuses):
+            return
+        time.sleep(0.01)
+    raise TimeoutError("The server didn't start: %s" % run.stages)
+
+
+@pytest.fixture
+def client(monkeypatch, word_vectors):
+    """
+    A client of run.py's app serving a tiny random model (beams of 3, at most
+    8 tokens) and the random word vectors, once it is ready. Settings of the
+    server can be patched on `run` before using the fixture.
+    """
+    import run
+    from batching import Coalescer
+    from cache import SummaryCache
+    from fastapi.testclient import TestClient
+
+    def load_summarizer(low_memory=False):
+        run.tokenizer = Tokenizer()
+        run.model = tiny_model(3, 8)
+        run.model.metrics = run.metrics
+
+    monkeypatch.setattr(run, "load_summarizer", load_summarizer)
+    monkeypatch.setenv("ACS_VECTORS_PATH", word_vectors)
+    monkeypatch.setattr(
+        run, "stages", {name: {"status": "pending"} for name in run.stages}
+    )
+    monkeypatch.setattr(run, "batchers", collections.OrderedDict())
+    monkeypatch.setattr(run, "summary_cache", SummaryCache(model_id="tiny"))
+    monkeypatch.setattr(run, "in_flight", Coalescer())
+    with TestClient(run.app) as client:
+        start(run)
+        yield client
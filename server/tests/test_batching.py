@@ -0,0 +1,130 @@
+import asyncio
+
+from batching import Coalescer, MicroBatcher
+
+
+async def double(items):
+    await asyncio.sleep(0.01)
+    return [2 * item for item in items]
+
+
+def test_closed_batcher_finishes_its_batches_and_starts_over():
+    async def main():
+        batcher = MicroBatcher(double, window=0.001)
+        assert batcher.idle()
+        running = asyncio.ensure_future(batcher.submit(1))
+        await asyncio.sleep(0.005)
+        assert not batcher.idle()
+        worker = batcher.worker
+        batcher.close()
+        assert await running == 2
+        assert batcher.idle()
+        assert worker.cancelled()
+        assert await batcher.submit(3) == 6
+
+    asyncio.run(main())
+
+
+def test_concurrent_requests_share_batches():
+    async def main():
+        sizes = []
+
+        async def run_batch(items):
+            sizes.append(len(items))
+            return [item * 10 for item in items]
+
+        batcher = MicroBatcher(run_batch, window=0.05, max_batch_size=4)
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+        assert results == [i * 10 for i in range(10)]
+        assert sizes == [4, 4, 2]
+        assert batcher.stats()["batches"] == 3
+
+    asyncio.run(main())
+
+
+def test_a_failing_batch_fails_each_of_its_requests():
+    async def main():
+        async def run_batch(items):
+            raise ValueError("model failed")
+
+        batcher = MicroBatcher(run_batch, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+        assert [type(result) for result in results] == [ValueError, ValueError]
+        assert batcher.idle()
+
+    asyncio.run(main())
+
+
+def test_batches_run_at_most_concurrency_at_a_time():
+    async def main():
+        running = []
+        most = []
+
+        async def run_batch(items):
+            running.append(1)
+            most.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+            return items
+
+        batcher = MicroBatcher(run_batch, window=0, max_batch_size=1, concurrency=2)
+        assert await asyncio.gather(*[batcher.submit(i) for i in range(6)]) == list(
+            range(6)
+        )
+        assert max(most) == 2
+
+    asyncio.run(main())
+
+
+def test_identical_requests_share_one_run():
+    async def main():
+        starts = []
+
+        async def start(cancel):
+            starts.append(cancel)
+            await asyncio.sleep(0.01)
+            return "summary"
+
+        coalescer = Coalescer()
+        results = await asyncio.gather(
+            coalescer.run("a", start),
+            coalescer.run("a", start),
+            coalescer.run("b", start),
+        )
+        assert results == ["summary"] * 3
+        assert len(starts) == 2
+        assert coalescer.stats() == {"in_flight": 0, "coalesced": 1, "cancelled": 0}
+
+    asyncio.run(main())
+
+
+def test_a_run_is_cancelled_once_every_caller_left():
+    async def main():
+        cancels = []
+
+        async def start(cancel):
+            cancels.append(cancel)
+            await asyncio.sleep(1)
+
+        coalescer = Coalescer()
+        first = asyncio.ensure_future(coalescer.run("a", start))
+        second = asyncio.ensure_future(coalescer.run("a", start))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        # the other caller still wants it
+        assert not cancels[0].is_set()
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancels[0].is_set()
+        assert coalescer.stats() == {"in_flight": 0, "coalesced": 1, "cancelled": 1}
+
+        # the next request starts over
+        third = asyncio.ensure_future(coalescer.run("a", start))
+        await asyncio.sleep(0.01)
+        assert len(cancels) == 2 and not cancels[1].is_set()
+        third.cancel()
+
+    asyncio.run(main())
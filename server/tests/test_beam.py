@@ -0,0 +1,97 @@
+import pytest
+import torch
+
+from model import Beam
+
+SOS, EOS = 0, 2
+
+
+class LoopBeam(object):
+    "The per-element bookkeeping Beam replaced, as the reference."
+
+    def __init__(self, size):
+        self.size = size
+        self.scores = torch.zeros(size)
+        self.prevKs = []
+        self.nextYs = [torch.zeros(size, dtype=torch.long)]
+        self.nextYs[0][0] = SOS
+        self.eosTop = False
+        self.finished = []
+
+    def advance(self, wordLk):
+        numWords = wordLk.size(1)
+        if len(self.prevKs) > 0:
+            beamLk = wordLk + self.scores.unsqueeze(1).expand_as(wordLk)
+            for i in range(self.nextYs[-1].size(0)):
+                if self.nextYs[-1][i] == EOS:
+                    beamLk[i] = -1e20
+        else:
+            beamLk = wordLk[0]
+        bestScores, bestScoresId = beamLk.view(-1).topk(self.size, 0, True, True)
+        self.scores = bestScores
+        prevK = bestScoresId // numWords
+        self.prevKs.append(prevK)
+        self.nextYs.append(bestScoresId - prevK * numWords)
+        for i in range(self.nextYs[-1].size(0)):
+            if self.nextYs[-1][i] == EOS:
+                self.finished.append((self.scores[i], len(self.nextYs) - 1, i))
+        if self.nextYs[-1][0] == EOS:
+            self.eosTop = True
+
+    def done(self):
+        return self.eosTop and len(self.finished) >= self.size
+
+    def getFinal(self):
+        if len(self.finished) == 0:
+            self.finished.append((self.scores[0], len(self.nextYs) - 1, 0))
+        self.finished.sort(key=lambda a: -a[0])
+        if len(self.finished) != self.size:
+            unfinished = []
+            for i in range(self.nextYs[-1].size(0)):
+                if self.nextYs[-1][i] != EOS:
+                    unfinished.append((self.scores[i], len(self.nextYs) - 1, i))
+            unfinished.sort(key=lambda a: -a[0])
+            self.finished += unfinished[: self.size - len(self.finished)]
+        return self.finished[: self.size]
+
+    def getHyp(self, beam_res):
+        hyps = []
+        for _, timestep, k in beam_res:
+            hyp = []
+            for j in range(len(self.prevKs[:timestep]) - 1, -1, -1):
+                hyp.append(int(self.nextYs[j + 1][k]))
+                k = self.prevKs[j][k]
+            hyps.append(hyp[::-1])
+        return hyps
+
+
+def cut(tokens):
+    return tokens[: tokens.index(EOS)] if EOS in tokens else tokens
+
+
+# A small vocabulary finishes hypotheses early and often, a large one rarely.
+@pytest.mark.parametrize("vocab_size", [5, 50])
+@pytest.mark.parametrize("size", [1, 3, 5])
+@pytest.mark.parametrize("seed", range(4))
+def test_beam_matches_the_loop_bookkeeping(vocab_size, size, seed):
+    generator = torch.Generator().manual_seed(seed)
+    beam, reference = Beam(size, SOS, EOS, "cpu"), LoopBeam(size)
+    for _ in range(12):
+        wordLk = torch.randn(size, vocab_size, generator=generator).log_softmax(-1)
+        beam.advance(wordLk.clone())
+        reference.advance(wordLk.clone())
+        assert torch.equal(beam.getCurrentState().view(-1), reference.nextYs[-1])
+        assert torch.equal(beam.getCurrentOrigin(), reference.prevKs[-1])
+        assert beam.done() == reference.done()
+        if beam.done():
+            break
+
+    final = beam.getFinal()
+    expected = reference.getFinal()
+    assert torch.allclose(final[0], torch.stack([s for s, _, _ in expected]))
+    assert final[2].tolist() == [k for _, _, k in expected]
+    hyps = beam.buildTargetTokens(beam.getHyp(final))
+    for hyp, timestep, tokens in zip(hyps, final[1], reference.getHyp(expected)):
+        assert hyp[:timestep].tolist() == cut(tokens) + [0] * (
+            int(timestep) - len(cut(tokens))
+        )
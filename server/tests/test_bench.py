@@ -0,0 +1,40 @@
+import bench
+
+
+def test_measure_times_each_call_after_the_warmup():
+    calls = []
+    timings = bench.measure(lambda: calls.append(1), repeat=3, warmup=2)
+    assert len(calls) == 5 and len(timings) == 3
+
+    row = bench.summarize([0.001, 0.002, 0.003, 0.004], items=8)
+    assert row["p50_ms"] == 2.5
+    assert row["mean_ms"] == 2.5
+    assert row["p50_ms"] <= row["p90_ms"] <= row["p99_ms"] <= 4
+    assert row["throughput"] == 8 / 0.0025
+
+
+def test_compare_flags_rows_slower_than_the_threshold():
+    def row(name, p50, **params):
+        return {"name": name, "params": params, "p50_ms": p50}
+
+    baseline = {"results": [row("beam", 10, beam_size=1), row("beam", 10, beam_size=4)]}
+    rows = [
+        row("beam", 12, beam_size=1),
+        row("beam", 13, beam_size=4),
+        # not in the baseline
+        row("beam", 100, beam_size=10),
+    ]
+    assert bench.compare(rows, baseline, 1.25) == [(rows[1], 10)]
+    assert bench.compare(rows, baseline, 1.5) == []
+
+
+def test_quick_run_reports_every_point_of_the_grid():
+    rows = bench.run_benchmarks(["beam", "features"], quick=True, repeat=1)
+    assert [(row["name"], row["params"]) for row in rows] == [
+        ("beam", {"beam_size": 1}),
+        ("beam", {"beam_size": 10}),
+        ("features", {"source_length": 32, "batch_size": 1}),
+        ("features", {"source_length": 32, "batch_size": 16}),
+    ]
+    for row in rows:
+        assert row["p50_ms"] > 0 and row["throughput"] > 0
@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+import time
+
+from cache import SummaryCache, model_fingerprint
+
+
+def test_summaries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SummaryCache(capacity=2, path=path, model_id="a")
+    for i in range(10):
+        cache.put("def f%d(): pass" % i, "summary %d" % i, beam_size=10)
+    # evicted from memory, but not written yet or written in the background
+    assert cache.get("def f0(): pass", beam_size=10) == "summary 0"
+    cache.flush()
+    assert cache.pending == {}
+
+    reopened = SummaryCache(capacity=2, path=path, model_id="a")
+    assert reopened.get("def f3(): pass", beam_size=10) == "summary 3"
+    assert reopened.get("def f3(): pass", beam_size=1) is None
+    assert (
+        SummaryCache(path=path, model_id="b").get("def f3(): pass", beam_size=10)
+        is None
+    )
+
+
+def test_put_writes_in_the_background(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SummaryCache(path=path, model_id="a")
+    cache.put("def f(): pass", "summary")
+    db = sqlite3.connect(path)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]:
+            break
+        time.sleep(0.01)
+    assert SummaryCache(path=path, model_id="a").get("def f(): pass") == "summary"
+
+
+def test_backends_have_their_own_summaries(tmp_path):
+    checkpoint = tmp_path / "model.bin"
+    checkpoint.write_bytes(b"weights")
+    eager = model_fingerprint(str(checkpoint))
+    assert eager == model_fingerprint(str(checkpoint), "eager", "float32")
+    assert eager != model_fingerprint(str(checkpoint), "int8")
+    assert eager != model_fingerprint(str(checkpoint), "eager", "bfloat16")
+
+    path = str(tmp_path / "cache.sqlite")
+    cache = SummaryCache(path=path, model_id=eager)
+    cache.put("def f(): pass", "summary")
+    cache.flush()
+    int8 = SummaryCache(path=path, model_id=model_fingerprint(str(checkpoint), "int8"))
+    assert int8.get("def f(): pass") is None
+
+
+def test_get_async_reads_the_sqlite_file_off_the_loop(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SummaryCache(path=path, model_id="a")
+    cache.put("def f(): pass", "summary")
+    cache.flush()
+
+    async def main():
+        reopened = SummaryCache(path=path, model_id="a")
+        assert await reopened.get_async("def f(): pass") == "summary"
+        assert await reopened.get_async("def f(): pass") == "summary"
+        assert await reopened.get_async("def g(): pass") is None
+        assert await SummaryCache().get_async("def f(): pass") is None
+        return reopened.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["disk_hits"], stats["hits"], stats["misses"]) == (1, 1, 1)
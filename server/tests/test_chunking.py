@@ -0,0 +1,77 @@
+from chunking import Chunk, outline, split_source
+
+
+def count(text):
+    return len(text.split())
+
+
+def function(name, statements, indent=""):
+    body = "".join("%s    x%d = %d\n" % (indent, i, i) for i in range(statements))
+    return "%sdef %s(a):\n%s" % (indent, name, body)
+
+
+def test_short_sources_are_one_chunk():
+    assert split_source("x = 1\n", count) == [Chunk("<module>", 0, 0, "x = 1\n")]
+    assert split_source("", count) == []
+
+
+def test_chunks_follow_definitions_and_fit_the_model():
+    source = (
+        "import os\n"
+        + function("small", 2)
+        + "class Big:\n"
+        + function("one", 4, "    ")
+        + function("two", 4, "    ")
+        + function("long", 12)
+    )
+    chunks = split_source(source, count, max_tokens=16)
+    assert all(count(chunk.source) <= 16 for chunk in chunks)
+    assert [chunk.name for chunk in chunks] == [
+        "<module>",
+        "small",
+        "Big.one",
+        "Big.two",
+        "long",
+        "long",
+        "long",
+    ]
+    lines = source.splitlines(keepends=True)
+    for chunk in chunks[:4]:
+        assert chunk.source == "".join(lines[chunk.start : chunk.end + 1])
+    # the parts of a long function repeat its signature
+    for chunk in chunks[4:]:
+        assert chunk.source.startswith("def long(a):\n    x")
+    assert [(chunk.start, chunk.end) for chunk in chunks[4:]] == [
+        (16, 19),
+        (20, 23),
+        (24, 27),
+    ]
+
+
+def test_sources_that_dont_parse_are_cut_into_overlapping_windows():
+    source = "".join("line %d (\n" % i for i in range(10))
+    chunks = split_source(source, count, max_tokens=9, overlap=1)
+    assert [(chunk.start, chunk.end) for chunk in chunks] == [
+        (0, 2),
+        (2, 4),
+        (4, 6),
+        (6, 8),
+        (8, 9),
+    ]
+    assert {chunk.name for chunk in chunks} == {"<module>"}
+
+
+def test_outline_indents_by_depth_and_numbers_parts():
+    chunks = [
+        Chunk("<module>", 0, 0, ""),
+        Chunk("Big.one", 1, 2, ""),
+        Chunk("long", 3, 4, ""),
+        Chunk("long", 5, 6, ""),
+    ]
+    assert outline(chunks, ["imports", "adds", "loops", "returns"]) == (
+        "<module>: imports\n"
+        "  Big.one: adds\n"
+        "long (part 1/2): loops\n"
+        "long (part 2/2): returns"
+    )
+    assert outline(chunks[:1], ["imports"]) == "imports"
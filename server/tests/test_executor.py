@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import os
+
+import pytest
+import torch
+
+from executor import InferenceExecutor
+
+# set by `load` in the worker processes
+loaded = None
+
+
+def load(value):
+    global loaded
+    loaded = value
+
+
+def matmul():
+    "Runs torch on the worker's threads, returns what the worker sees."
+    a = torch.randn(256, 256)
+    for _ in range(4):
+        a = (a @ a).tanh()
+    return os.getpid(), torch.get_num_threads(), loaded
+
+
+@pytest.fixture
+def parallel_parent():
+    "This process has run torch on several threads, as after loading a model."
+    threads = torch.get_num_threads()
+    torch.set_num_threads(4)
+    a = torch.randn(512, 512)
+    a @ a
+    yield
+    torch.set_num_threads(threads)
+
+
+def test_process_workers_run_torch_on_several_threads(parallel_parent):
+    executor = InferenceExecutor(
+        workers=2,
+        mode="process",
+        torch_threads=2,
+        load=functools.partial(load, "model"),
+    )
+    try:
+        futures = [executor.submit(matmul) for _ in range(4)]
+        results = [future.result(timeout=120) for future in futures]
+    finally:
+        executor.shutdown()
+    for pid, threads, state in results:
+        assert pid != os.getpid()
+        assert threads == 2
+        assert state == "model"
+
+
+def test_process_workers_from_the_event_loop(parallel_parent):
+    executor = InferenceExecutor(workers=1, mode="process", torch_threads=2)
+
+    async def run():
+        return await asyncio.wait_for(executor.run(matmul), 120)
+
+    try:
+        pid, threads, state = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert pid != os.getpid() and threads == 2 and state is None
+
+
+def test_thread_workers(parallel_parent):
+    executor = InferenceExecutor(workers=2, mode="thread", torch_threads=2)
+    try:
+        pid, threads, _ = executor.submit(matmul).result(timeout=120)
+    finally:
+        executor.shutdown()
+    assert pid == os.getpid() and threads == 2
@@ -0,0 +1,62 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from index import IndexFull, VectorIndex, WorkspaceIndexes
+
+
+def embed(text):
+    "A random vector per word, summed over the words of `text`."
+    return sum(
+        np.random.default_rng(zlib.crc32(word.encode())).standard_normal(16)
+        for word in text.split()
+    )
+
+
+@pytest.mark.parametrize("shortlist", [None, 2])
+def test_query_only_ranks_the_given_files(shortlist):
+    index = VectorIndex(embed, 16)
+    index.update_file("a.py", {"read": "reads a file", "write": "writes a file"})
+    index.update_file("b.py", {"load": "reads a file from disk"})
+    index.update_file("c.py", {"parse": "parses the config"})
+
+    results = index.query(
+        embed("reads file"), 4, ["b.py", "c.py"], "reads file", shortlist
+    )
+    assert [(file, symbol) for file, symbol, _, _ in results][0] == ("b.py", "load")
+    assert {file for file, _, _, _ in results} <= {"b.py", "c.py"}
+    everything = index.query(embed("reads file"), None, text="reads file")
+    assert len(everything) == 4
+    assert index.query(embed("reads file"), 4, ["d.py"], "reads file", shortlist) == []
+
+
+def test_workspaces_with_the_same_files_keep_their_own_descriptions(tmp_path):
+    indexes = WorkspaceIndexes(embed, 16, max_size=4)
+    indexes.update_file("one", "a.py", {"read": "reads a file"})
+    indexes.update_file("two", "a.py", {"parse": "parses the config"})
+    assert [key[:2] for key in indexes.get("one").query(embed("file"))] == [
+        ("a.py", "read")
+    ]
+
+    indexes.save(tmp_path)
+    indexes = WorkspaceIndexes.load(tmp_path, embed, 16, max_size=4)
+    assert indexes.get("two").descriptions == ["parses the config"]
+    assert indexes.get("three") is None
+
+
+def test_least_recently_used_workspaces_make_room():
+    indexes = WorkspaceIndexes(embed, 16, max_size=3)
+    indexes.update_file("one", "a.py", {"read": "reads", "write": "writes"})
+    indexes.update_file("two", "a.py", {"parse": "parses"})
+    indexes.get("one")
+    indexes.update_file("three", "a.py", {"load": "loads"})
+    assert list(indexes.indexes) == ["one", "three"]
+    assert (len(indexes), indexes.dropped) == (3, 1)
+
+    # replacing the descriptions of a file only counts the new ones
+    indexes.update_file("three", "a.py", {"save": "saves"})
+    assert len(indexes) == 3
+    with pytest.raises(IndexFull):
+        indexes.update_file("three", "a.py", {str(i): "x" for i in range(4)})
+    assert len(indexes) == 3
@@ -0,0 +1,43 @@
+import threading
+
+import torch
+
+from metrics import Metrics, profile
+
+
+def test_overlapping_blocks_are_profiled_one_at_a_time(tmp_path):
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        with profile(str(tmp_path), "thread"):
+            started.set()
+            release.wait()
+            torch.ones(4).sum()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    # another thread is profiling, this one isn't traced
+    with profile(str(tmp_path), "main"):
+        torch.ones(4).sum()
+    release.set()
+    thread.join()
+    with profile(str(tmp_path), "after"):
+        with profile(str(tmp_path), "nested"):
+            torch.ones(4).sum()
+    assert sorted(path.name.split("-")[0] for path in tmp_path.iterdir()) == [
+        "after",
+        "thread",
+    ]
+
+
+def test_render_declares_each_metric_once():
+    metrics = Metrics()
+    metrics.inc("acs_early_stops_total", 2)
+    metrics.inc("acs_decode_stops_total", stop="done")
+    metrics.inc("acs_decode_stops_total", stop="deadline")
+    text = metrics.render()
+    assert text.count("# TYPE acs_decode_stops_total counter") == 1
+    assert 'acs_decode_stops_total{stop="deadline"} 1' in text
+    assert "# HELP acs_early_stops_total Examples cut short by early stopping" in text
+    assert "acs_early_stops_total 2" in text
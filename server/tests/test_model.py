@@ -0,0 +1,124 @@
+import time
+
+import pytest
+import torch
+
+from bench import tiny_model
+from metrics import Metrics
+from pipeline import decoding_settings
+
+PAD = 1
+
+
+def batch(lengths, vocab_size=1000, seed=0):
+    "Random source ids of `lengths`, padded to the longest, and their mask."
+    generator = torch.Generator().manual_seed(seed)
+    source_ids = torch.full((len(lengths), max(lengths)), PAD, dtype=torch.long)
+    source_mask = torch.zeros_like(source_ids)
+    for i, length in enumerate(lengths):
+        source_ids[i, :length] = torch.randint(
+            3, vocab_size, (length,), generator=generator
+        )
+        source_mask[i, :length] = 1
+    return source_ids, source_mask
+
+
+def decode(model, source_ids, source_mask, **decoding):
+    with torch.no_grad():
+        return model(source_ids=source_ids, source_mask=source_mask, decoding=decoding)
+
+
+# A small vocabulary makes examples reach eos at different steps, so finished
+# examples leave the decoder batch while others are still decoded.
+@pytest.mark.parametrize("vocab_size", [1000, 8])
+@pytest.mark.parametrize("beam_size", [1, 3, 5])
+@pytest.mark.parametrize(
+    "lengths", [[7], [12, 12, 12], [5, 31, 17, 9], [40, 3, 3, 22, 8, 15]]
+)
+def test_batched_decoding_matches_one_example_at_a_time(vocab_size, beam_size, lengths):
+    model = tiny_model(beam_size, max_length=16, vocab_size=vocab_size)
+    source_ids, source_mask = batch(lengths, vocab_size)
+    batched = decode(model, source_ids, source_mask)
+    assert batched.shape == (len(lengths), beam_size, 16)
+    for i, length in enumerate(lengths):
+        single = decode(
+            model, source_ids[i : i + 1, :length], source_mask[i : i + 1, :length]
+        )
+        assert torch.equal(batched[i], single[0])
+
+
+@pytest.mark.parametrize("vocab_size", [1000, 8])
+@pytest.mark.parametrize("beam_size", [1, 3, 5])
+@pytest.mark.parametrize("lengths", [[7], [5, 31, 17, 9]])
+def test_cached_decoding_matches_full_decoding(vocab_size, beam_size, lengths):
+    model = tiny_model(beam_size, max_length=16, vocab_size=vocab_size)
+    source_ids, source_mask = batch(lengths, vocab_size, seed=1)
+    cached = decode(model, source_ids, source_mask)
+    model.use_cache = False
+    assert torch.equal(cached, decode(model, source_ids, source_mask))
+
+
+def test_decoding_settings_override_the_model():
+    model = tiny_model(5, max_length=16)
+    source_ids, source_mask = batch([5, 31, 17], seed=2)
+    batched = decode(model, source_ids, source_mask, beam_size=2, max_length=8)
+    assert batched.shape == (3, 2, 8)
+    for i in range(3):
+        single = decode(
+            model,
+            source_ids[i : i + 1],
+            source_mask[i : i + 1],
+            beam_size=2,
+            max_length=8,
+        )
+        assert torch.equal(batched[i], single[0])
+
+
+def test_decoding_settings_reject_and_cut_down_beams():
+    model = tiny_model(5, max_length=16, vocab_size=8)
+    for bad in ({"beam_size": 0}, {"beam_size": -3}, {"max_length": 0}):
+        with pytest.raises(ValueError):
+            decoding_settings(model, **bad)
+    assert decoding_settings(model, beam_size=50)["beam_size"] == 8
+    assert decoding_settings(model, beam_size=50, max_beam_size=6)["beam_size"] == 6
+    assert decoding_settings(model, beam_size=3, max_beam_size=6)["beam_size"] == 3
+    assert decoding_settings(model, max_length=500)["max_length"] == 16
+
+
+def test_cancelled_and_late_decoding_stop_before_the_next_step():
+    model = tiny_model(3, max_length=16)
+    model.metrics = Metrics()
+    source_ids, source_mask = batch([5, 31], seed=3)
+    steps = []
+    with torch.no_grad():
+        preds = model(
+            source_ids=source_ids,
+            source_mask=source_mask,
+            on_step=lambda active, tokens: steps.append(len(active)),
+            decoding={"cancelled": lambda: len(steps) == 2},
+        )
+    assert preds.shape == (2, 3, 16)
+    assert len(steps) == 2
+
+    decode(model, source_ids, source_mask, deadline=time.monotonic())
+    values = model.metrics.values
+    assert values["acs_decode_steps_total"][()] == 2
+    assert values["acs_decode_stops_total"] == {
+        (("stop", "cancelled"),): 1,
+        (("stop", "deadline"),): 1,
+    }
+
+
+def test_only_early_stopping_cutoffs_count_as_early_stops():
+    source_ids, source_mask = batch([5, 31, 17, 9], vocab_size=5, seed=4)
+    counts = {}
+    for early_stopping in (False, True):
+        model = tiny_model(3, max_length=32, vocab_size=5, seed=1)
+        model.metrics = Metrics()
+        decode(model, source_ids, source_mask, early_stopping=early_stopping)
+        values = model.metrics.values
+        counts[early_stopping] = values["acs_early_stops_total"][()]
+        # every example is done before max_length either way
+        assert values["acs_decode_stops_total"] == {(("stop", "done"),): 1}
+        assert values["acs_decode_steps_total"][()] < 32
+    assert counts == {False: 0, True: 4}
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from ranking import rank
+
+
+@pytest.mark.parametrize("top_k", [None, 1, 3, 7, 50])
+def test_rank_orders_documents_by_cosine(top_k):
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((4, 8))
+    documents = rng.standard_normal((7, 8))
+    documents[2] = 0
+    indices, scores = rank(queries, documents, top_k)
+
+    for query, row, row_scores in zip(queries, indices, scores):
+        expected = [
+            document @ query / (np.linalg.norm(document) * np.linalg.norm(query) or 1)
+            for document in documents
+        ]
+        order = np.argsort(expected, kind="stable")[::-1][: top_k or len(documents)]
+        assert sorted(row) == sorted(order)
+        np.testing.assert_allclose(row_scores, np.array(expected)[row], rtol=1e-5)
+        assert list(row_scores) == sorted(row_scores, reverse=True)
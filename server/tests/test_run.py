@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import run
+from cache import SummaryCache
+from chunking import outline, split_source
+from conftest import start
+
+
+def test_summaries_name_the_model(client):
+    body = {"code": "def add(a, b): return a + b"}
+    first = client.post("/summary", json=body).json()
+    assert first["model_id"] == run.summary_cache.model_id
+    assert client.post("/summary", json=body).json() == first
+    assert run.summary_cache.stats()["hits"] == 1
+
+    events = client.post("/summary/stream", json=body).text.split("\n\n")
+    assert '"model_id": "tiny"' in events[-2]
+
+
+def test_rank_scores_every_query_against_the_documents(client):
+    body = {"queries": ["aaaaa", "aaaab"], "documents": ["aaaab", "aaaaa aaaac"]}
+    results = client.post("/search/rank", json=dict(body, top_k=1)).json()["results"]
+    assert [result["indices"] for result in results] == [[1], [0]]
+    for top_k in (0, -1):
+        response = client.post("/search/rank", json=dict(body, top_k=top_k))
+        assert response.status_code == 422
+    assert client.post("/search/rank", json={"documents": ["aaaab"]}).status_code == 422
+
+
+def test_index_queries_stay_in_their_workspace(client):
+    update = {"file": "a.py", "definitions": {"load": "aaaab aaaac"}}
+    for workspace in ("one", "two"):
+        body = dict(update, workspace=workspace)
+        assert client.post("/index/update", json=body).json()["size"] == 1
+    body = dict(update, workspace="two", definitions={"save": "aaaaa"})
+    client.post("/index/update", json=body)
+
+    query = {"workspace": "one", "query": "aaaab", "files": ["a.py", "b.py"]}
+    response = client.post("/index/query", json=query).json()
+    assert [result["symbol"] for result in response["results"]] == ["load"]
+    assert response["missing"] == ["b.py"]
+    response = client.post("/index/query", json=dict(query, workspace="new")).json()
+    assert response == {"results": [], "missing": ["a.py", "b.py"]}
+    for top_k in (0, -1):
+        response = client.post("/index/query", json=dict(query, top_k=top_k))
+        assert response.status_code == 422
+
+
+def test_buckets_summarize_like_one_batch(client, monkeypatch):
+    codes = [
+        "def f(%s): pass" % ", ".join("a%d" % i for i in range(n))
+        for n in (9, 1, 5, 3, 7)
+    ]
+    expected = run.summarize(codes)
+    monkeypatch.setattr(run, "bucket_size", 2)
+    assert run.summarize(codes) == expected
+
+
+def stream(client, body):
+    "The events of a /summary/stream response."
+    text = client.post("/summary/stream", json=body).text
+    return [json.loads(event[len("data: ") :]) for event in text.split("\n\n") if event]
+
+
+def test_stream_sends_partial_summaries_then_the_final_one(client):
+    body = {"code": "def add(a, b): return a + b", "strategy": "greedy"}
+    events = stream(client, body)
+    assert [event["done"] for event in events] == [False] * (len(events) - 1) + [True]
+    assert len(events) > 1
+    final = events[-1]
+    assert final["summary"] == client.post("/summary", json=body).json()["summary"]
+    assert final["decoding"]["deadline_reached"] is False
+    assert final["timings"]
+
+    # cached: only the final event, without timings
+    cached = stream(client, body)
+    assert len(cached) == 1
+    assert cached[0]["summary"] == final["summary"]
+    assert cached[0]["timings"] == {}
+
+
+def test_new_settings_run_unbatched_while_every_batcher_is_busy(client, monkeypatch):
+    monkeypatch.setattr(run, "max_batchers", 2)
+    body = {"code": "def add(a, b): return a + b"}
+    client.post("/summary", json=dict(body, strategy="greedy"))
+    assert len(run.batchers) == 2
+    busy = [b for b in run.batchers.values() if b is not run.batcher]
+    monkeypatch.setattr(busy[0], "waiting", 1)
+
+    expected = run.summarize([body["code"]], dict(run.default_decoding, beam_size=2))
+    response = client.post("/summary", json=dict(body, beam_size=2)).json()
+    assert response["summary"] == expected[0]
+    assert list(run.batchers.values()) == [run.batcher, busy[0]]
+    assert "acs_unbatched_total 1" in client.get("/metrics").text
+
+    # once idle, the batcher makes room for the new settings
+    monkeypatch.setattr(busy[0], "waiting", 0)
+    client.post("/summary", json=dict(body, max_length=4))
+    assert len(run.batchers) == 2 and busy[0] not in run.batchers.values()
+
+
+def test_a_batch_is_cancelled_once_every_request_of_it_is(client):
+    first, second = threading.Event(), threading.Event()
+    cancelled = run.cancelled_by(first, second)
+    first.set()
+    assert not cancelled()
+    second.set()
+    assert cancelled()
+
+
+def test_long_sources_are_summarized_by_chunk(client, monkeypatch):
+    split = lambda text, count: split_source(text, count, max_tokens=24)
+    monkeypatch.setattr(run, "split_source", split)
+    code = "".join(
+        "def f%d(a):\n%s"
+        % (n, "".join("    x%d = a + %d\n" % (i, i) for i in range(4)))
+        for n in range(3)
+    )
+    response = client.post("/summary/long", json={"code": code}).json()
+    chunks = split(code, run.count_tokens)
+    assert [chunk["name"] for chunk in response["chunks"]] == ["f0", "f1", "f2"]
+    summaries = run.summarize([chunk.source for chunk in chunks])
+    assert [chunk["summary"] for chunk in response["chunks"]] == summaries
+    assert response["summary"] == outline(chunks, summaries)
+    # each chunk is cached on its own
+    assert (
+        client.post("/summary", json={"code": chunks[1].source}).json()["summary"]
+        == summaries[1]
+    )
+    assert run.summary_cache.stats()["hits"] == 1
+
+
+@pytest.fixture
+def staged(monkeypatch):
+    """
+    run.py's app, with startup stages that only record that they ran: the
+    model stage waits for the returned event, or raises it if it's an error.
+    """
+    gate = threading.Event()
+    ran = []
+
+    def stage(name):
+        def load():
+            if name == "model":
+                if isinstance(model, Exception):
+                    raise model
+                gate.wait(10)
+            ran.append(name)
+
+        return load
+
+    model = None
+    monkeypatch.setattr(
+        run, "startup_stages", {name: stage(name) for name in run.startup_stages}
+    )
+    monkeypatch.setattr(
+        run, "stages", {name: {"status": "pending"} for name in run.stages}
+    )
+    monkeypatch.setattr(run, "executor", None)
+    monkeypatch.setattr(run, "description_indexes", None)
+    monkeypatch.setattr(run, "summary_cache", SummaryCache(model_id="tiny"))
+
+    def app(error=None):
+        nonlocal model
+        model = error
+        return TestClient(run.app)
+
+    return app, gate, ran
+
+
+def test_the_server_answers_while_its_stages_load(staged):
+    app, gate, ran = staged
+    with app() as client:
+        while run.stages["vectors"]["status"] != "ready":
+            time.sleep(0.01)
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        stages = response.json()["stages"]
+        assert [stages[name]["status"] for name in ("model", "vectors", "warmup")] == [
+            "loading",
+            "ready",
+            "pending",
+        ]
+        assert client.get("/").status_code == 503
+        assert client.get("/health/live").status_code == 200
+        response = client.post("/summary", json={"code": "pass"})
+        assert (response.status_code, response.json()["detail"]) == (
+            503,
+            "model is loading",
+        )
+
+        gate.set()
+        start(run)
+        assert ran == ["vectors", "model", "warmup"]
+        assert client.get("/health/ready").status_code == 200
+        assert client.get("/").json() == {"message": "success"}
+
+
+def test_a_failed_stage_stops_the_ones_after_it(staged):
+    app, gate, ran = staged
+    with app(RuntimeError("no checkpoint")) as client:
+        start(run)
+        assert run.stages["warmup"]["status"] == "pending"
+        assert ran == ["vectors"]
+        response = client.get("/health/live")
+        assert (response.status_code, response.json()["stages"]) == (500, ["model"])
+        assert "no checkpoint" in run.stages["model"]["error"]
+        assert client.get("/health/ready").status_code == 503
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from transformers.models.roberta.tokenization_roberta import bytes_to_unicode
+
+import tokenization
+from tokenization import CodeTokenizer
+
+
+@pytest.fixture(scope="module")
+def vocabulary(tmp_path_factory):
+    "Directory of a byte-level BPE tokenizer of single bytes, without merges."
+    path = tmp_path_factory.mktemp("tokenizer")
+    tokens = ["<s>", "<pad>", "</s>", "<unk>"] + list(bytes_to_unicode().values())
+    tokens.append("<mask>")
+    with open(path / "vocab.json", "w") as f:
+        json.dump({token: i for i, token in enumerate(tokens)}, f)
+    with open(path / "merges.txt", "w") as f:
+        f.write("#version: 0.2\n")
+    return str(path)
+
+
+@pytest.fixture(params=["fast", "slow"])
+def tokenizer(request, vocabulary, monkeypatch):
+    if request.param == "slow":
+        monkeypatch.setattr(tokenization, "RobertaTokenizerFast", None)
+    tokenizer = CodeTokenizer(vocabulary, capacity=2)
+    assert tokenizer.is_fast == (request.param == "fast")
+    return tokenizer
+
+
+def test_encode_batch_matches_the_tokenizer(tokenizer):
+    sources = ["def f(): pass", "x = 1", "def f(): pass"]
+    ids = tokenizer.encode_batch(sources, max_length=8)
+    assert ids[0] == ids[2]
+    assert len(ids[0]) == 8
+    assert ids[1] == tokenizer.tokenizer("x = 1")["input_ids"]
+    assert (ids[0][0], ids[0][-1]) == (tokenizer.cls_token_id, tokenizer.sep_token_id)
+
+
+def test_token_ids_are_cached_per_source_and_length(tokenizer):
+    first = tokenizer.encode_batch(["a", "b"], max_length=8)
+    assert tokenizer.encode_batch(["b", "a"], max_length=8) == first[::-1]
+    assert tokenizer.stats()["hits"] == 2
+    # another max_length is another entry, it drops the least recently used one
+    tokenizer.encode_batch(["a"], max_length=4)
+    assert tokenizer.stats()["entries"] == 2
+    tokenizer.encode_batch(["b"], max_length=8)
+    assert (tokenizer.stats()["hits"], tokenizer.stats()["misses"]) == (2, 4)
+    tokenizer.encode_batch(["a"], max_length=4)
+    assert (tokenizer.stats()["hits"], tokenizer.stats()["misses"]) == (3, 4)
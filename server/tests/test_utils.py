@@ -0,0 +1,26 @@
+import torch
+
+from utils import bucket_by_length, pad_sequences
+
+
+def test_pad_sequences_pads_to_the_longest():
+    ids, mask = pad_sequences([[5, 6, 7], [8], []], pad_id=1)
+    assert ids.tolist() == [[5, 6, 7], [8, 1, 1], [1, 1, 1]]
+    assert mask.tolist() == [[1, 1, 1], [1, 0, 0], [0, 0, 0]]
+    ids, mask = pad_sequences([], pad_id=1)
+    assert ids.shape == mask.shape == (0, 0)
+
+
+def test_buckets_group_similar_lengths_and_trim_the_padding():
+    lengths = [2, 9, 4, 8, 1]
+    ids, mask = pad_sequences([list(range(3, 3 + n)) for n in lengths], pad_id=1)
+    buckets = list(bucket_by_length(ids, mask, 2))
+
+    assert [indices.tolist() for indices, _, _ in buckets] == [[1, 3], [2, 0], [4]]
+    assert [bucket_ids.shape[1] for _, bucket_ids, _ in buckets] == [9, 4, 1]
+    for indices, bucket_ids, bucket_mask in buckets:
+        width = bucket_ids.shape[1]
+        assert torch.equal(bucket_ids, ids[indices, :width])
+        assert torch.equal(bucket_mask, mask[indices, :width])
+        # only padding was trimmed
+        assert mask[indices, width:].sum() == 0
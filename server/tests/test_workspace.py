@@ -0,0 +1,82 @@
+import asyncio
+
+from summarize_repo import extract
+from workspace import SummaryQueue, functions
+
+SOURCE = """\
+def top():
+    def inner():
+        pass
+
+
+class Shape:
+    async def area(self):
+        return 0
+"""
+
+
+def test_functions_are_named_by_their_dotted_path(tmp_path):
+    found = functions(SOURCE)
+    assert [(f.name, f.start, f.end) for f in found] == [
+        ("top", 0, 2),
+        ("top.inner", 1, 2),
+        ("Shape.area", 6, 7),
+    ]
+    assert functions("def broken(:\n") is None
+
+    (tmp_path / "shapes.py").write_text(SOURCE)
+    records = extract(str(tmp_path / "shapes.py"), str(tmp_path))
+    assert [(r["file"], r["name"], r["hash"]) for r in records] == [
+        ("shapes.py", f.name, f.hash) for f in found
+    ]
+
+
+def test_opening_a_document_queues_nothing():
+    async def main():
+        summarized = []
+
+        async def summarize(code):
+            return "summary"
+
+        queue = SummaryQueue(
+            summarize, lambda uri, f, summary: summarized.append(f.name), delay=0
+        )
+        queue.open("shapes.py", SOURCE)
+        await asyncio.sleep(0.05)
+        assert summarized == []
+        changed = SOURCE.replace("return 0", "return 1")
+        assert [f.name for f in queue.update("shapes.py", changed, [(7, 7)])] == [
+            "Shape.area"
+        ]
+        await asyncio.sleep(0.05)
+        assert summarized == ["Shape.area"]
+
+    asyncio.run(main())
+
+
+def test_prioritized_jobs_run_before_due_background_jobs():
+    async def main():
+        source = "def a():\n    pass\n\n\ndef b():\n    pass\n\n\ndef c():\n    pass\n"
+        gate = asyncio.Event()
+        summarized = []
+
+        async def summarize(code):
+            await gate.wait()
+            return "summary"
+
+        queue = SummaryQueue(
+            summarize, lambda uri, f, summary: summarized.append(f.name), delay=0.1
+        )
+        queue.open("abc.py", source)
+        source = source.replace("pass", "return 1", 1)
+        queue.update("abc.py", source)
+        await asyncio.sleep(0.15)
+        # a is running, b and c become due while it waits
+        queue.update("abc.py", source.replace("pass", "return 2"))
+        await asyncio.sleep(0.15)
+        queue.prioritize("abc.py", ["c"])
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert summarized == ["a", "c", "b"]
+
+    asyncio.run(main())
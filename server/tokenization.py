@@ -0,0 +1,103 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from transformers import RobertaTokenizer
+
+try:
+    from transformers import RobertaTokenizerFast
+except ImportError:
+    RobertaTokenizerFast = None
+
+
+class CodeTokenizer(object):
+    """
+    Tokenizer of the summarization model.
+
+    Uses the fast (Rust-backed) tokenizer when it is available, so a whole
+    batch of sources is tokenized in one call, and falls back to the slow
+    Python tokenizer otherwise. The token ids of recently seen sources are
+    cached by a hash of the source. Anything else is forwarded to the
+    underlying `transformers` tokenizer.
+
+    Parameters:
+
+    * `name`- name or path of the pretrained tokenizer.
+    * `capacity`- number of sources whose token ids are cached.
+    """
+
+    def __init__(self, name, capacity=4096):
+        self.tokenizer = None
+        if RobertaTokenizerFast is not None:
+            try:
+                self.tokenizer = RobertaTokenizerFast.from_pretrained(name)
+            except (OSError, ValueError):
+                # e.g. the `tokenizers` package is missing
+                self.tokenizer = None
+        if self.tokenizer is None:
+            self.tokenizer = RobertaTokenizer.from_pretrained(name, do_lower_case=False)
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.tokenizer, name)
+
+    def encode_batch(self, sources, max_length=256):
+        """
+        Token ids of every source, starting with the cls token and ending with
+        the sep token, truncated to `max_length` ids.
+        """
+        keys = [
+            (hashlib.sha1(source.encode("utf-8")).digest(), max_length)
+            for source in sources
+        ]
+        ids = [None] * len(sources)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    ids[i] = self.cache[key]
+                    self.hits += 1
+                else:
+                    missing.append(i)
+                    self.misses += 1
+        if not missing:
+            return ids
+
+        texts = [sources[i] for i in missing]
+        if self.tokenizer.is_fast:
+            encoded = self.tokenizer(
+                texts, truncation=True, max_length=max_length, verbose=False
+            )["input_ids"]
+        else:
+            encoded = [
+                self.tokenizer.convert_tokens_to_ids(
+                    [self.tokenizer.cls_token]
+                    + self.tokenizer.tokenize(text)[: max_length - 2]
+                    + [self.tokenizer.sep_token]
+                )
+                for text in texts
+            ]
+        with self.lock:
+            for i, source_ids in zip(missing, encoded):
+                ids[i] = source_ids
+                self.cache[keys[i]] = source_ids
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+        return ids
+
+    def batch_decode(self, sequences, **kwargs):
+        return self.tokenizer.batch_decode(sequences, **kwargs)
+
+    def stats(self):
+        "Hit/miss counters of the token id cache."
+        return {
+            "fast": self.tokenizer.is_fast,
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import torch
+
 
 class Example(object):
     """A single training/test example."""
@@ -43,31 +45,34 @@ class InputFeatures(object):
         self.target_mask = target_mask
 
 
-def convert_examples_to_features(examples, tokenizer, stage=None):
+def convert_examples_to_features(
+    examples, tokenizer, stage=None, max_source_length=256, max_target_length=128
+):
     features = []
     for example_index, example in enumerate(examples):
         # source
-        source_tokens = tokenizer.tokenize(example.source)[: 256 - 2]
+        source_tokens = tokenizer.tokenize(example.source)[: max_source_length - 2]
         source_tokens = [tokenizer.cls_token] + source_tokens + [tokenizer.sep_token]
         source_ids = tokenizer.convert_tokens_to_ids(source_tokens)
         source_mask = [1] * (len(source_tokens))
-        padding_length = 256 - len(source_ids)
+        padding_length = max_source_length - len(source_ids)
         source_ids += [tokenizer.pad_token_id] * padding_length
         source_mask += [0] * padding_length
 
-        # target
+        # target, not used at inference
         if stage == "test":
-            target_tokens = tokenizer.tokenize("None")
+            target_ids = None
+            target_mask = None
         else:
             target_tokens = tokenizer.tokenize(example.target)[
-                : 128 - 2
+                : max_target_length - 2
             ]
-        target_tokens = [tokenizer.cls_token] + target_tokens + [tokenizer.sep_token]
-        target_ids = tokenizer.convert_tokens_to_ids(target_tokens)
-        target_mask = [1] * len(target_ids)
-        padding_length = 128 - len(target_ids)
-        target_ids += [tokenizer.pad_token_id] * padding_length
-        target_mask += [0] * padding_length
+            target_tokens = [tokenizer.cls_token] + target_tokens + [tokenizer.sep_token]
+            target_ids = tokenizer.convert_tokens_to_ids(target_tokens)
+            target_mask = [1] * len(target_ids)
+            padding_length = max_target_length - len(target_ids)
+            target_ids += [tokenizer.pad_token_id] * padding_length
+            target_mask += [0] * padding_length
 
         features.append(
             InputFeatures(
@@ -80,3 +85,63 @@ def convert_examples_to_features(examples, tokenizer, stage=None):
         )
     return features
 
+
+def pad_sequences(sequences, pad_id):
+    """
+    Stack token id lists into a (batch x longest) tensor padded with `pad_id`,
+    and its attention mask.
+    """
+    lengths = torch.tensor([len(s) for s in sequences], dtype=torch.long)
+    width = int(lengths.max()) if len(sequences) else 0
+    mask = torch.arange(width).unsqueeze(0) < lengths.unsqueeze(1)
+    ids = torch.full((len(sequences), width), pad_id, dtype=torch.long)
+    ids[mask] = torch.tensor([i for s in sequences for i in s], dtype=torch.long)
+    return ids, mask.long()
+
+
+def convert_examples_to_tensors(
+    examples, tokenizer, stage=None, max_source_length=256, max_target_length=128
+):
+    """
+    Tokenize `examples` straight into tensors, padded to the longest sequence
+    of the batch instead of the maximum length.
+
+    Returns (source_ids, source_mask), plus (target_ids, target_mask) unless
+    `stage` is "test".
+    """
+    if hasattr(tokenizer, "encode_batch"):
+        # tokenization.CodeTokenizer: batched, with cached token ids
+        sources = tokenizer.encode_batch(
+            [example.source for example in examples], max_source_length
+        )
+    else:
+        sources = []
+        for example in examples:
+            source_tokens = tokenizer.tokenize(example.source)[: max_source_length - 2]
+            source_tokens = [tokenizer.cls_token] + source_tokens + [tokenizer.sep_token]
+            sources.append(tokenizer.convert_tokens_to_ids(source_tokens))
+    tensors = pad_sequences(sources, tokenizer.pad_token_id)
+    if stage == "test":
+        return tensors
+
+    targets = []
+    for example in examples:
+        target_tokens = tokenizer.tokenize(example.target)[: max_target_length - 2]
+        target_tokens = [tokenizer.cls_token] + target_tokens + [tokenizer.sep_token]
+        targets.append(tokenizer.convert_tokens_to_ids(target_tokens))
+    return tensors + pad_sequences(targets, tokenizer.pad_token_id)
+
+
+def bucket_by_length(source_ids, source_mask, bucket_size):
+    """
+    Split a padded batch into buckets of at most `bucket_size` examples of
+    similar length, each trimmed to its own longest sequence.
+
+    Yields (indices, source_ids, source_mask), where `indices` are the
+    positions of the bucket's examples in the batch.
+    """
+    lengths = source_mask.sum(1)
+    order = lengths.argsort(descending=True)
+    for indices in order.split(bucket_size):
+        width = int(lengths[indices].max())
+        yield indices, source_ids[indices, :width], source_mask[indices, :width]
@@ -0,0 +1,116 @@
+import argparse
+import os
+
+import numpy as np
+
+
+class WordVectors(object):
+    """
+    Word vectors memory-mapped from a directory written by `build`.
+
+    `words.npy` holds the vocabulary as sorted fixed-width utf-8 strings and
+    `vectors.npy` the matching rows. Both are opened with `np.load(...,
+    mmap_mode="r")`, so opening the store reads nothing up front and every
+    process using it shares the same pages through the OS page cache. Words
+    are looked up with a binary search over the sorted vocabulary.
+    """
+
+    def __init__(self, path):
+        self.words = np.load(os.path.join(path, "words.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.vector_size = self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return self.rows([word]) is not None
+
+    def __getitem__(self, word):
+        rows = self.rows([word])
+        if rows is None:
+            raise KeyError(word)
+        return np.asarray(self.vectors[rows[0]], dtype=np.float32)
+
+    def rows(self, words):
+        "Rows of `words` in `vectors`, or None if any of them is unknown."
+        rows, found = self.lookup(words)
+        if not found.all():
+            return None
+        return rows
+
+    def lookup(self, words):
+        """
+        Rows of `words` in `vectors`, and a mask of the words that are in the
+        vocabulary (the rows of the others are meaningless).
+        """
+        keys = [word.encode("utf-8") for word in words]
+        # Longer than any word of the vocabulary.
+        fits = np.array(
+            [len(key) <= self.words.dtype.itemsize for key in keys], dtype=bool
+        )
+        keys = np.array(
+            [key if ok else b"" for key, ok in zip(keys, fits)], dtype=self.words.dtype
+        )
+        rows = np.minimum(np.searchsorted(self.words, keys), len(self.words) - 1)
+        return rows, fits & (self.words[rows] == keys)
+
+    def sum(self, words):
+        "Sum of the vectors of `words` (float32), or None if any is unknown."
+        rows = self.rows(words)
+        if rows is None:
+            return None
+        return self.vectors[rows].sum(axis=0, dtype=np.float32)
+
+    def sum_known(self, words):
+        """
+        Sum of the vectors of the `words` that are in the vocabulary, or None
+        if none of them is.
+        """
+        rows, found = self.lookup(words)
+        if not found.any():
+            return None
+        return self.vectors[rows[found]].sum(axis=0, dtype=np.float32)
+
+
+def build(model, path, dtype=np.float32):
+    """
+    Write the vocabulary and vectors of a gensim `KeyedVectors` model to
+    `path`, in the layout read by `WordVectors`.
+    """
+    words = getattr(model, "index_to_key", None)
+    if words is None:
+        words = model.index2word
+    words = np.array([word.encode("utf-8") for word in words], dtype=bytes)
+    order = np.argsort(words, kind="stable")
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "words.npy"), words[order])
+    np.save(os.path.join(path, "vectors.npy"), model.vectors[order].astype(dtype))
+
+
+def load(name, path, dtype=np.float32):
+    """
+    Open the word vectors stored at `path`, first building them from the
+    gensim-data model `name` if they don't exist yet.
+    """
+    if not os.path.exists(os.path.join(path, "vectors.npy")):
+        import gensim.downloader as api
+
+        build(api.load(name), path, dtype)
+    return WordVectors(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a memory-mapped word vector store from a gensim-data model."
+    )
+    parser.add_argument("--model", default="glove-wiki-gigaword-300")
+    parser.add_argument("--out", default="glove-wiki-gigaword-300.vectors")
+    parser.add_argument(
+        "--float16", action="store_true", help="Store the vectors as float16"
+    )
+    args = parser.parse_args()
+
+    import gensim.downloader as api
+
+    build(api.load(args.model), args.out, np.float16 if args.float16 else np.float32)
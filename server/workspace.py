@@ -0,0 +1,250 @@
+import ast
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+from collections import namedtuple
+
+# The language server imports this module as part of its package, the tools
+# (e.g. summarize_repo.py) from this directory.
+if __package__:
+    from .cache import normalize_code
+else:
+    from cache import normalize_code
+
+logger = logging.getLogger(__name__)
+
+# Priorities of summary jobs, lower runs first.
+VISIBLE = 0
+BACKGROUND = 1
+
+# `start` and `end` are the 0-based lines of the `def` and of the last line
+# of the body, `source` is every line in between.
+Function = namedtuple("Function", ["name", "start", "end", "source", "hash"])
+
+
+def functions(text):
+    """
+    Every function and method defined in `text`, named by its dotted path
+    (e.g. "Class.method"). None if `text` doesn't parse.
+    """
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return None
+    lines = text.splitlines(keepends=True)
+    found = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                source = "".join(lines[child.lineno - 1 : child.end_lineno])
+                digest = hashlib.sha1(normalize_code(source).encode("utf-8"))
+                found.append(
+                    Function(
+                        prefix + child.name,
+                        child.lineno - 1,
+                        child.end_lineno - 1,
+                        source,
+                        digest.hexdigest(),
+                    )
+                )
+                visit(child, prefix + child.name + ".")
+            elif isinstance(child, ast.ClassDef):
+                visit(child, prefix + child.name + ".")
+            else:
+                visit(child, prefix)
+
+    visit(tree, "")
+    return found
+
+
+class SummaryQueue(object):
+    """
+    Keeps the functions of the open documents summarized.
+
+    Every change of a document is parsed with `ast`, and only functions
+    whose normalized source hash changed are queued. Opening a document
+    queues nothing, its functions are summarized once they are edited. Jobs
+    run in the background, visible functions first, once their function has
+    been left alone for `delay` seconds. A job is dropped when its function
+    changes again before it runs, and cancelled when the function changes
+    (or its document is closed) while it is running.
+
+    Parameters:
+
+    * `summarize`- coroutine function, returns the summary of a function's
+      source.
+    * `on_summary`- called with (uri, function, summary) when a summary is
+      ready.
+    * `delay`- seconds a function must be left unchanged before it is
+      summarized.
+    * `workers`- number of jobs that run at the same time.
+    """
+
+    def __init__(self, summarize, on_summary, delay=1.0, workers=1):
+        self.summarize = summarize
+        self.on_summary = on_summary
+        self.delay = delay
+        self.workers = workers
+        # uri -> {name: Function} as of the last change that parsed
+        self.documents = {}
+        # (uri, name) -> id of the live heap entry of that function
+        self.jobs = {}
+        # (priority, due, id, (uri, name), hash)
+        self.heap = []
+        # (uri, name) -> (hash, task) of the jobs being summarized
+        self.running = {}
+        self.ids = itertools.count()
+        # Created on first use, so they belong to the server's event loop.
+        self.wakeup = None
+        self.tasks = []
+
+        self.queued = 0
+        self.summarized = 0
+        self.dropped = 0
+
+    def open(self, uri, text):
+        """
+        Start tracking the document `uri`: remember the hashes of its
+        functions without queuing any of them.
+        """
+        self.update(uri, text)
+
+    def update(self, uri, text, changed=None):
+        """
+        Parse the new `text` of the document `uri` and queue the functions
+        whose source changed. Functions that overlap the `changed` line
+        ranges ([(first, last)]) are queued as VISIBLE, the rest as
+        BACKGROUND. The first text of a document that parses is only
+        remembered. Returns the queued functions.
+        """
+        found = functions(text)
+        if found is None:
+            # Keep the last state until the document parses again.
+            return []
+        old = self.documents.get(uri)
+        self.documents[uri] = {function.name: function for function in found}
+        if old is None:
+            return []
+        for name in old:
+            if name not in self.documents[uri]:
+                self.jobs.pop((uri, name), None)
+                self._cancel((uri, name))
+        queued = []
+        for function in found:
+            previous = old.get(function.name)
+            if previous is not None and previous.hash == function.hash:
+                continue
+            self._cancel((uri, function.name), function.hash)
+            visible = any(
+                function.start <= last and first <= function.end
+                for first, last in changed or ()
+            )
+            self._push(uri, function, VISIBLE if visible else BACKGROUND)
+            queued.append(function)
+        return queued
+
+    def prioritize(self, uri, names):
+        """
+        Move the pending jobs of the functions `names` of `uri` to the front,
+        they run without waiting for the rest of their `delay`.
+        """
+        loop = asyncio.get_running_loop()
+        for name in names:
+            function = self.documents.get(uri, {}).get(name)
+            if function is not None and (uri, name) in self.jobs:
+                self._push(uri, function, VISIBLE, loop.time())
+
+    def close(self, uri):
+        "Forget the document `uri` and drop its pending jobs."
+        for name in self.documents.pop(uri, {}):
+            self.jobs.pop((uri, name), None)
+            self._cancel((uri, name))
+
+    def _cancel(self, key, digest=None):
+        "Cancel the running job of `key`, unless it is summarizing `digest`."
+        running = self.running.get(key)
+        if running is not None and running[0] != digest:
+            running[1].cancel()
+
+    def _push(self, uri, function, priority, due=None):
+        "Queue `function`, due in `delay` seconds unless `due` is given."
+        loop = asyncio.get_running_loop()
+        if due is None:
+            due = loop.time() + self.delay
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+            self.tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        job = next(self.ids)
+        # A newer entry for the same function makes the old one stale.
+        self.jobs[(uri, function.name)] = job
+        heapq.heappush(
+            self.heap,
+            (
+                priority,
+                due,
+                job,
+                (uri, function.name),
+                function.hash,
+            ),
+        )
+        self.queued += 1
+        self.wakeup.set()
+
+    def _peek(self):
+        "The next live heap entry, dropping stale ones, or None."
+        while self.heap:
+            _, _, job, key, _ = self.heap[0]
+            if self.jobs.get(key) == job:
+                return self.heap[0]
+            heapq.heappop(self.heap)
+            self.dropped += 1
+        return None
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = self._peek()
+            if entry is None or entry[1] > loop.time():
+                self.wakeup.clear()
+                timeout = None if entry is None else entry[1] - loop.time()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            _, _, _, (uri, name), digest = entry
+            del self.jobs[(uri, name)]
+            task = asyncio.ensure_future(
+                self.summarize(self.documents[uri][name].source)
+            )
+            self.running[(uri, name)] = (digest, task)
+            try:
+                await asyncio.wait([task])
+            finally:
+                del self.running[(uri, name)]
+            if task.cancelled():
+                # Changed (or closed) while it was being summarized.
+                self.dropped += 1
+                continue
+            if task.exception() is not None:
+                logger.error("Exception occured", exc_info=task.exception())
+                continue
+            function = self.documents.get(uri, {}).get(name)
+            if function is None or function.hash != digest or task.result() is None:
+                self.dropped += 1
+                continue
+            self.summarized += 1
+            self.on_summary(uri, function, task.result())
+
+    def stats(self):
+        return {
+            "pending": len(self.jobs),
+            "running": len(self.running),
+            "queued": self.queued,
+            "summarized": self.summarized,
+            "dropped": self.dropped,
+        }